@@ -0,0 +1,171 @@
+# benchmarks/bss_label_bench.py
+"""
+Microbenchmark: classes/bss_label.py against the inline re.match label
+helpers BaseUtils used before.
+
+Run from the repository root:
+
+    python -m benchmarks.bss_label_bench [--labels 500] [--rounds 20]
+
+It first checks that both give the same answers on a mixed corpus (labels,
+odd casing, padding, label-like prefixes, plain words), then times the calls
+a request makes: is-label / type / section per label, and sorting by sort key.
+"""
+
+import argparse
+import random
+import re
+import time
+
+from classes.bss_label import label_key, parse_label
+
+
+# --- previous implementation (BaseUtils, inline patterns) -------------------
+
+def old_is_bss_label(label):
+    if not isinstance(label, str) or not label.strip():
+        return False
+    s = label.strip()
+    if re.match(r"^A\d+_[A-Z0-9_]+$", s, flags=re.IGNORECASE):
+        return True
+    return re.match(r"^(UC|PROC|COMP|ROLE|UI|ENT|INT|API|NFR)-?\d+_[A-Z0-9_]+$", s, flags=re.IGNORECASE) is not None
+
+
+def old_bss_label_type(label):
+    if not isinstance(label, str):
+        return None
+    s = label.strip()
+    if re.match(r"^A\d+_", s, flags=re.IGNORECASE):
+        return "A"
+    m = re.match(r"^(UC|PROC|COMP|ROLE|UI|ENT|INT|API|NFR)-?\d+_", s, flags=re.IGNORECASE)
+    if not m:
+        return None
+    return m.group(1).upper()
+
+
+def old_bss_section_for_label(label):
+    t = old_bss_label_type(label)
+    if not t:
+        return None
+    mapping = {
+        "A": "A", "UC": "UseCases", "PROC": "Processes", "COMP": "Components", "ROLE": "Actors",
+        "UI": "UI", "ENT": "Entities", "INT": "Integrations", "API": "APIs", "NFR": "NFRs",
+    }
+    return mapping.get(t)
+
+
+def old_bss_label_sort_key(label):
+    t = old_bss_label_type(label) or "ZZZ"
+    type_order = {
+        "A": 0, "UC": 1, "PROC": 2, "COMP": 3, "ROLE": 4, "UI": 5,
+        "ENT": 6, "INT": 7, "API": 8, "NFR": 9, "ZZZ": 99,
+    }
+    m = re.match(r"^(A|UC|PROC|COMP|ROLE|UI|ENT|INT|API|NFR)-?(\d+)_", label.strip(), flags=re.IGNORECASE)
+    n = int(m.group(2)) if m else 10**9
+    return (type_order.get(t, 99), n, label)
+
+
+# --- new implementation ------------------------------------------------------
+
+def new_is_bss_label(label):
+    return isinstance(label, str) and parse_label(label).is_label
+
+
+def new_bss_label_type(label):
+    return parse_label(label).family if isinstance(label, str) else None
+
+
+def new_bss_section_for_label(label):
+    return parse_label(label).section if isinstance(label, str) else None
+
+
+def new_bss_label_sort_key(label):
+    return parse_label(label).sort_key
+
+
+# -----------------------------------------------------------------------------
+
+FAMILIES = ["A", "UC", "PROC", "COMP", "ROLE", "UI", "ENT", "INT", "API", "NFR"]
+
+
+def make_labels(n, rng):
+    labels = []
+    for i in range(n):
+        fam = rng.choice(FAMILIES)
+        idx = rng.randint(1, 200)
+        labels.append(f"A{idx}_Canvas{i}" if fam == "A" else f"{fam}-{idx}_Thing{i}")
+    return labels
+
+
+def make_corpus(labels, rng):
+    odd = [
+        "", " ", "metadata", "Processes", "PROC-1_", "proc1_x", " ent-2_User ", "A-1_x",
+        "API-01_Get", "NFR-3_Fast\n", "UC_1_x", "ROLE-7_Ops-Team", "ui-12_Screen_2",
+    ]
+    corpus = list(labels) + odd
+    corpus += [label.lower() for label in rng.sample(labels, min(50, len(labels)))]
+    return corpus
+
+
+def check(corpus):
+    for label in corpus:
+        assert new_is_bss_label(label) == old_is_bss_label(label), label
+        assert new_bss_label_type(label) == old_bss_label_type(label), label
+        assert new_bss_section_for_label(label) == old_bss_section_for_label(label), label
+        assert new_bss_label_sort_key(label) == old_bss_label_sort_key(label), label
+    assert sorted(corpus, key=new_bss_label_sort_key) == sorted(corpus, key=old_bss_label_sort_key)
+    assert label_key(" role-1_CUSTOMER ") == label_key("ROLE-1_Customer")
+
+
+def timed(fn, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--labels", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    labels = make_labels(args.labels, rng)
+    check(make_corpus(labels, rng))
+
+    def per_label(is_label, label_type, section):
+        def run():
+            for label in labels:
+                is_label(label)
+                label_type(label)
+                section(label)
+        return run
+
+    def sorting(sort_key):
+        def run():
+            # the pair orientation loop compares sort keys of both ends per pair
+            for a, b in zip(labels, reversed(labels)):
+                sort_key(a) < sort_key(b)
+            sorted(labels, key=sort_key)
+        return run
+
+    cases = [
+        ("is_label + type + section", per_label(old_is_bss_label, old_bss_label_type, old_bss_section_for_label),
+         per_label(new_is_bss_label, new_bss_label_type, new_bss_section_for_label)),
+        ("sort keys (pairs + sorted)", sorting(old_bss_label_sort_key), sorting(new_bss_label_sort_key)),
+    ]
+
+    print(f"{len(labels)} labels, best of {args.rounds} rounds (ms)")
+    print(f"{'':30} {'inline re':>10} {'bss_label':>10} {'speedup':>8}")
+    for name, old_fn, new_fn in cases:
+        old_ms = timed(old_fn, args.rounds)
+        new_ms = timed(new_fn, args.rounds)
+        print(f"{name:30} {old_ms:10.2f} {new_ms:10.2f} {old_ms / new_ms:7.1f}x")
+    print("parse_label cache:", parse_label.cache_info())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,144 @@
 import os
 import json
+import threading
+import time
 from datetime import timedelta
-from typing import Callable, Optional
+from typing import Any, Callable, Dict, Optional
 
 from google.cloud import storage, secretmanager
 from google.oauth2 import service_account
 from google.auth import default as google_auth_default
 
 import pg8000
-from sqlalchemy import NullPool, create_engine, text
+from sqlalchemy import NullPool, create_engine, event, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, Session
 
 
+# !###############################################
+# !   CONNECTION POOL (one engine per DATABASE_URL
+# !   per process, shared by every SessionFactory)
+# !###############################################
+# DB_POOL=null restores the old connect-per-session behaviour
+# (e.g. behind PgBouncer in transaction mode).
+DB_POOL = os.getenv("DB_POOL", "queue").strip().lower()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").strip().lower() in ("1", "true", "yes")
+
+
+class DbPoolMetrics:
+    """
+    Counters fed by SQLAlchemy pool events, plus the live pool status.
+      connects     – new DBAPI connections opened (should plateau at pool size)
+      checkouts    – connections handed to a Session / Connection
+      invalidated  – connections dropped (pre-ping failure, errors)
+      max_checked_out / avg_checkout_ms – how busy and how long held
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidated = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self._held_seconds = 0.0
+
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_conn, record) -> None:
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_conn, record, proxy) -> None:
+        record.info["checkout_at"] = time.monotonic()
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def _on_checkin(self, dbapi_conn, record) -> None:
+        started = record.info.pop("checkout_at", None) if record is not None else None
+        with self._lock:
+            self.checkins += 1
+            self.checked_out = max(0, self.checked_out - 1)
+            if started is not None:
+                self._held_seconds += time.monotonic() - started
+
+    def _on_invalidate(self, dbapi_conn, record, exception) -> None:
+        with self._lock:
+            self.invalidated += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "invalidated": self.invalidated,
+                "avg_checkout_ms": round(1000.0 * self._held_seconds / self.checkins, 2) if self.checkins else 0.0,
+            }
+        out["pool"] = self.engine.pool.status()
+        return out
+
+
+_engines: Dict[str, Engine] = {}
+_pool_metrics: Dict[str, DbPoolMetrics] = {}
+_engines_lock = threading.Lock()
+
+
+def _create_pooled_engine(database_url: str) -> Engine:
+    if DB_POOL == "null":
+        return create_engine(database_url, future=True, pool_pre_ping=DB_POOL_PRE_PING, poolclass=NullPool)
+    return create_engine(
+        database_url,
+        future=True,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+
+
+def get_db_engine(database_url: Optional[str] = None) -> Engine:
+    """
+    Process-wide engine registry: one pooled Engine per DATABASE_URL.
+    Without a URL, resolves it through the shared GCConnection (env / Secret Manager).
+    """
+    if database_url is None:
+        database_url = _get_gc_connection().DATABASE_URL
+    engine = _engines.get(database_url)
+    if engine is not None:
+        return engine
+    with _engines_lock:
+        engine = _engines.get(database_url)
+        if engine is None:
+            engine = _create_pooled_engine(database_url)
+            _pool_metrics[database_url] = DbPoolMetrics(engine)
+            _engines[database_url] = engine
+    return engine
+
+
+def get_pool_metrics() -> Dict[str, Any]:
+    """
+    Metrics of every registered engine, keyed by URL (password hidden).
+    """
+    return {
+        metrics.engine.url.render_as_string(hide_password=True): metrics.snapshot()
+        for metrics in list(_pool_metrics.values())
+    }
+
+
 class GCConnection:
     def __init__(self) -> None:
         # ---- env config (shared) ----
@@ -86,16 +213,9 @@ class GCConnection:
     # -------- SQLAlchemy Session factory --------
     def build_db_session_factory(self) -> Callable[[], Session]:
         if not getattr(self, "_sessionmaker", None):
-            # engine = create_engine(
-            #     self.DATABASE_URL,
-            #     future=True,
-            #     pool_pre_ping=True,
-            #     pool_size=10,      # <= keep up to 10 connections in the pool
-            #     max_overflow=0,    # <= do NOT allow extra "overflow" connections
-            #     pool_timeout=30,   # optional: how long to wait for a conn before error
-            #     pool_recycle=1800, # optional: recycle conns every 30 min to avoid stale
-            # )
-            engine = create_engine(self.DATABASE_URL, future=True, pool_pre_ping=True, poolclass = NullPool)
+            # shared with every other GCConnection pointing at the same database
+            engine = get_db_engine(self.DATABASE_URL)
+            self._engine = engine
             self._sessionmaker = sessionmaker(
                 bind=engine,
                 autoflush=False,
@@ -108,6 +228,14 @@ class GCConnection:
 
         return _factory
 
+    def build_db_engine(self) -> Engine:
+        """
+        Shared pooled engine behind build_db_session_factory().
+        Needed for raw connections, e.g. the queue LISTEN connection.
+        """
+        self.build_db_session_factory()
+        return self._engine
+
     # -------- Storage helpers --------
     # Examples:
     # gs_url, https_url = self._upload_to_gcs(self.BUCKET_NAME, object_path, result["zip_bytes"]) <----Regular URLs
@@ -141,17 +269,30 @@ class GCConnection:
 
 
 
+_gc_connection: Optional[GCConnection] = None
 _session_factory: Optional[Callable[[], Session]] = None
+_singleton_lock = threading.Lock()
+
+
+def _get_gc_connection() -> GCConnection:
+    global _gc_connection
+    if _gc_connection is None:
+        with _singleton_lock:
+            if _gc_connection is None:
+                _gc_connection = GCConnection()
+    return _gc_connection
 
 
 def get_session_factory() -> Callable[[], Session]:
     """
     Lazy, per-process singleton.
-    Creates one GCConnection + one Engine + one SessionFactory,
+    Creates one GCConnection + one pooled Engine + one SessionFactory,
     and returns the same factory on every call.
     """
     global _session_factory
     if _session_factory is None:
-        conn = GCConnection()
-        _session_factory = conn.build_db_session_factory()
+        factory = _get_gc_connection().build_db_session_factory()
+        with _singleton_lock:
+            if _session_factory is None:
+                _session_factory = factory
     return _session_factory
@@ -10,7 +10,10 @@ import contextvars
 
 from sqlalchemy.orm import sessionmaker
 
+from classes.bss_cache import BSS_CAS_RETRIES, BssVersionConflict, copy_document
+from classes.bss_diff import parse_base_version
 from classes.bss_chat_refinement import BssChatSupport
+from classes.cpu_pool import CpuOffload
 from classes.bss_ingestion import BSSIngestion
 from classes.entities import Base, Job, Project
 from classes.GCConnection_hlpr import get_session_factory
@@ -34,7 +37,15 @@ logger = logging.getLogger("kahuna_backend")
 _job_ctx_var = contextvars.ContextVar("job_ctx", default=None)
 
 
-class Backend(Utils, BssChatSupport):
+class Backend(CpuOffload, Utils, BssChatSupport):
+    # Cheap edits the worker may hand over together (see _process_request_batch)
+    BATCHABLE_REQUEST_TYPES = (
+        "edit_bss_node",
+        "create_bss_relationship",
+        "remove_bss_relationship",
+        "save_state",
+    )
+
     def __init__(self):
         self.SessionFactory = get_session_factory()
         self.llm_timeout=300
@@ -85,15 +96,17 @@ class Backend(Utils, BssChatSupport):
 
             if request_type == "load_project":
                 response_data["data"] = {}
+                # read before the document: a stale version only costs the client a full document later
+                bss_version = self.bss_version(project_id)
 
                 # preliminary schema
                 response_data["data"]["updated_schema"] = self.load_project(project_id)
-                # full BSS with metadata
-                raw_bss = self.load_bss_schema(project_id)
                 # send metadata only on load_project
-                response_data["data"]["metadata"] = raw_bss.get("metadata", None)
-                # document for the editor: redacted, no metadata
-                response_data["data"]["bss_schema"] = self._redact_bss_schema_for_ui(raw_bss)
+                response_data["data"]["metadata"] = self.load_bss_metadata(project_id).get("metadata", None)
+                # document for the editor: redacted, no metadata (stored view with BSS_UI_VIEW)
+                response_data["data"]["bss_schema"] = self.load_bss_ui_view(project_id)
+                # clients send it back as payload.base_version to get deltas
+                response_data["data"]["bss_version"] = bss_version
                 response_data["data"]["bss_labels"] = self._bss_labels
 
             elif request_type == "save_project":
@@ -104,21 +117,21 @@ class Backend(Utils, BssChatSupport):
                 response_data["data"] = self.handle_bss_chat(project_id, payload)
 
             elif request_type == "edit_bss_document":
-                response_data["data"] = self.handle_edit_bss_document(project_id, payload)
+                response_data["data"] = self._with_cas_retry(self.handle_edit_bss_document, project_id, payload)
 
             elif request_type == "edit_bss_node":
-                response_data["data"] = self.handle_edit_bss_node(project_id, payload)
+                response_data["data"] = self._with_cas_retry(self.handle_edit_bss_node, project_id, payload)
 
             elif request_type == "create_bss_relationship":
-                response_data["data"] = self.handle_create_relationship(project_id, payload)
+                response_data["data"] = self._with_cas_retry(self.handle_create_relationship, project_id, payload)
 
             elif request_type == "remove_bss_relationship":
-                response_data["data"] = self.handle_remove_bss_relationship(project_id, payload)
+                response_data["data"] = self._with_cas_retry(self.handle_remove_bss_relationship, project_id, payload)
 
             elif request_type == "ingestion":
                 response_data["data"] = self.handle_ingestion(project_id, payload)
             elif request_type == "save_state":
-                response_data["data"] = self.handle_save_state(project_id, payload)
+                response_data["data"] = self._with_cas_retry(self.handle_save_state, project_id, payload)
             else:
                 response_data["status"] = "error"
                 response_data["message"] = f"Unknown request type: {request_type}"
@@ -137,6 +150,115 @@ class Backend(Utils, BssChatSupport):
             traceback.print_exc()
             raise
 
+    def _with_cas_retry(self, handler, project_id: str, payload):
+        """
+        Run a load -> apply -> save handler again (it reloads the document)
+        when its save lost the race with another writer of the project.
+        """
+        attempts = max(1, BSS_CAS_RETRIES)
+        for attempt in range(1, attempts + 1):
+            try:
+                return handler(project_id, payload)
+            except BssVersionConflict as e:
+                if attempt == attempts:
+                    raise
+                logger.info(f"{handler.__name__} for project {project_id}: {e}; retrying")
+
+    def _process_request_batch(self, requests: list[dict], job_ctxs: list | None = None) -> list:
+        """
+        _process_request_batch_once, run again on a fresh document when the
+        save lost the race with another writer.
+        """
+        attempts = max(1, BSS_CAS_RETRIES)
+        for attempt in range(1, attempts + 1):
+            try:
+                return self._process_request_batch_once(requests, job_ctxs)
+            except BssVersionConflict as e:
+                if attempt == attempts:
+                    raise
+                logger.info(f"Batch of {len(requests)} request(s): {e}; retrying")
+
+    def _process_request_batch_once(self, requests: list[dict], job_ctxs: list | None = None) -> list:
+        """
+        Run consecutive BATCHABLE_REQUEST_TYPES requests of ONE project as a unit:
+        load once -> apply all -> one recompute -> one save.
+
+        Returns one entry per request, in order: the same response_data dict
+        _process_request_data would return, or the Exception that request
+        raised (it is skipped, the others still apply).
+        If the load or save fails, the exception propagates for the whole batch.
+
+        job_ctxs: the job context of each request; it is the current one (see
+        emit()) while that request is applied and its response built, so
+        emits carry the request's own correlation_id. The shared load /
+        recompute / save belong to no single request and run without one.
+        """
+        appliers = {
+            "edit_bss_node": self._apply_edit_bss_node,
+            "create_bss_relationship": self._apply_create_relationship,
+            "remove_bss_relationship": self._apply_remove_bss_relationship,
+            "save_state": self._apply_save_state,
+        }
+        project_id = str(requests[0].get("sender_id"))
+        metadata_only = all(r.get("type") == "save_state" for r in requests)
+
+        loaded_version = None
+        if metadata_only:
+            current_bss = self.load_bss_metadata(project_id)
+        else:
+            current_bss, loaded_version = self.load_bss_schema(project_id)
+        if not isinstance(current_bss, dict):
+            current_bss = {}
+
+        outcomes: list = []
+        needs_recompute = False
+        for i, request_data in enumerate(requests):
+            request_type = request_data.get("type")
+            token = _job_ctx_var.set(job_ctxs[i]) if job_ctxs else None
+            try:
+                apply = appliers.get(request_type)
+                if apply is None:
+                    raise ValueError(f"Request type cannot be batched: {request_type}")
+                outcomes.append(apply(current_bss, request_data.get("payload")))
+                if request_type != "save_state":
+                    needs_recompute = True
+            except Exception as e:
+                logger.info(f"Error while applying batched {request_type}: {e}")
+                outcomes.append(e)
+            finally:
+                if token is not None:
+                    _job_ctx_var.reset(token)
+
+        updated_bss = current_bss
+        if any(not isinstance(o, Exception) for o in outcomes):
+            if needs_recompute:
+                updated_bss = self._recompute_bss_dependency_fields(current_bss)
+            if metadata_only:
+                self.save_bss_metadata(project_id, updated_bss)
+            else:
+                self.save_bss_schema(project_id, updated_bss, expected_version=loaded_version)
+
+        results: list = []
+        for i, outcome in enumerate(outcomes):
+            if isinstance(outcome, Exception):
+                results.append(outcome)
+                continue
+            token = _job_ctx_var.set(job_ctxs[i]) if job_ctxs else None
+            try:
+                data = outcome(updated_bss)
+            finally:
+                if token is not None:
+                    _job_ctx_var.reset(token)
+            results.append(
+                {
+                    "status": "success",
+                    "message": "",
+                    "project_id": project_id,
+                    "data": data,
+                }
+            )
+        return results
+
     # -----------------------
     # Handlers
     # -----------------------
@@ -147,18 +269,22 @@ class Backend(Utils, BssChatSupport):
         chat_queue = None
 
         llm, chat_llm = self._build_llms_for_payload(payload)
-        current_bss = self.load_bss_schema(project_id)
+        current_bss, base_version = self.load_bss_schema(project_id)
+        client_version = parse_base_version(payload)
+        # pre-turn document, only needed to answer with a delta
+        before_bss = copy_document(current_bss) if client_version == base_version else None
 
         # PRE: build prompt inputs
-        current_document = self._bss_current_document_for_prompt(current_bss)
-        registry_ledger = self._build_registry_ledger(current_bss)
+        chat_inputs = self._prepare_bss_chat_inputs(current_bss)
+        current_document = chat_inputs["current_document"]
+        registry_ledger = chat_inputs["registry_ledger"]
         registry_ledger_json = json.dumps(registry_ledger, indent=2)
-        open_items = self._collect_open_items_by_gravity(current_bss)
+        open_items = chat_inputs["open_items"]
         open_items_block = "\n".join(f"{a}: {b}" for (a, b) in open_items)
-        next_indices = self._bss_next_indices(current_bss)
+        next_indices = chat_inputs["next_indices"]
         next_indices_str = ", ".join(f"{fam}:{idx}" for fam, idx in sorted(next_indices.items()))
 
-        example_kwargs = self._bss_example_kwargs(current_bss)
+        example_kwargs = chat_inputs["example_kwargs"]
 
         prompt = self.unsafe_string_format(
             BSS_PROMPT,
@@ -215,16 +341,126 @@ class Backend(Utils, BssChatSupport):
             return {
                 "bot_message": "I produced malformed structured output. Please resend your last message.",
                 "bss_schema": self._redact_bss_schema_for_ui(current_bss),
+                "bss_version": base_version,
                 "bss_labels": self._bss_labels,
             }
 
+        updated_bss, draft_roots, locked_for_relationships = self._apply_bss_chat_turn(
+            current_bss, slot_updates, project_id, base_version
+        )
+
+        if locked_for_relationships:
+            next_question += f"\n\nMessage from Host: the LLM tried to modify the following items: {', '.join(list(locked_for_relationships))} that have been locked. \nIf you agree with this change please change the permissions and ask the LLM to try again."
+
+
+        # Store chat history + heartbeat together in the global history cache
+        # (see note below on HistoryCache)
+        GLOBAL_BSS_HISTORY_CACHE.append_turn(
+            project_id,
+            user_text,
+            next_question,
+        )
+
+        # Persist current chat queue into metadata.chat_queue
+        # build chat_queue from history only (no prompt)
+        hist_msgs = GLOBAL_BSS_HISTORY_CACHE.snapshot(project_id)
+        chat_queue = self._messages_to_chat_queue(hist_msgs, limit=10)
+
+        def with_chat_queue(bss: dict) -> dict:
+            metadata = bss.get("metadata")
+            if not isinstance(metadata, dict):
+                metadata = {}
+            metadata["chat_queue"] = chat_queue
+            bss["metadata"] = metadata
+            return bss
+
+        # the LLM calls are paid for however the saves below end
+        refine_extra_cost = 0.0
+        try:
+            save_version = base_version
+            attempts = max(1, BSS_CAS_RETRIES)
+            for attempt in range(1, attempts + 1):
+                try:
+                    version = self.save_bss_schema(project_id, with_chat_queue(updated_bss), expected_version=save_version)
+                    break
+                except BssVersionConflict as e:
+                    if attempt == attempts:
+                        raise
+                    # The document was edited while the LLM was answering: replay this
+                    # turn's updates on the current one rather than losing either.
+                    logger.info(f"bss_chat for project {project_id}: {e}; replaying the turn on the current document")
+                    latest_bss, save_version = self.load_bss_schema(project_id)
+                    updated_bss, draft_roots, _ = self._apply_bss_chat_turn(
+                        latest_bss, slot_updates, project_id, save_version
+                    )
+
+            # ###############################################################
+            # 1) Early callback: send updated doc + bot reply immediately
+            #    (intermediate event; final HTTP response will only contain
+            #    relationship diffs + heartbeat).
+            # ###############################################################
+            self.emit(
+                "chat_early_callback",
+                {
+                    "bot_message": next_question,
+                    **self._bss_ui_update(before_bss, updated_bss, base_version, version, client_version),
+                    "bss_labels": self._bss_labels,
+                },
+            )
+
+            # 2) Second-pass relationship refinement (PROC↔API, PROC↔PROC, UI↔UI, ENT↔ENT).
+            updated_bss, updated_relationships, refine_extra_cost = self._refine_all_second_pass_relationships(
+                updated_bss,
+                draft_roots=draft_roots,
+                model_name=self._detect_llm_model_in_payload(payload) or "gemini-2.5-flash-lite",
+                project_id=str(project_id),
+                user_text=user_text,
+                bot_message=next_question,
+                history_msgs=hist_msgs,
+                turn_labels=draft_roots,
+            )
+
+            # Persist any relationship changes derived from the tie-break step.
+            if updated_relationships:
+                try:
+                    version = self.save_bss_schema(project_id, updated_bss, expected_version=version)
+                except BssVersionConflict as e:
+                    # edited during the second pass: that edit wins, the refinement is dropped
+                    logger.info(f"bss_chat for project {project_id}: {e}; relationship refinement not saved")
+                    updated_relationships = []
+        finally:
+            # 3) Compute amount/currency from the LLM client (both calls).
+            main_cost = chat_llm.get_accrued_cost() if chat_llm else 0
+            total_cost = float(main_cost) + float(refine_extra_cost or 0.0)
+            idempotency_key = record_pending_charge(
+                self.SessionFactory,
+                project_id=str(project_id),
+                amount=total_cost,
+                currency=CURRENCY
+            )
+
+            # Store idempotency_key
+            IDEMPOTENCY_CACHE.add(idempotency_key)
+
+        return {
+            "updated_relationships": updated_relationships,
+            "heartbeat": idempotency_key,
+        }
+
+    def _apply_bss_chat_turn(self, current_bss: dict, slot_updates: dict, project_id: str, version: int):
+        """
+        Apply one chat turn's slot updates to the document (loaded at `version`).
+        Returns (updated_bss, draft_roots, locked_for_relationships).
+        """
         deleted_labels = self._collect_deleted_labels_from_slot_updates(slot_updates)
 
         updated_bss = self._apply_bss_slot_updates(current_bss, slot_updates)
+        graph = self._bss_graph(updated_bss)
 
         # Emergency cleanup: only if something was deleted AND it is still referenced elsewhere
-        if deleted_labels and self._bss_any_item_references_labels(updated_bss, deleted_labels):
+        if deleted_labels and self._bss_any_item_references_labels(graph, deleted_labels):
             updated_bss = self._emergency_purge_deleted_labels_from_references(updated_bss, deleted_labels)
+            graph = self._bss_graph(updated_bss)
 
         # Identify labels whose relationships the LLM is allowed to edit:
         # labels that are in slot_updates and are currently in 'draft' status
@@ -235,15 +471,11 @@ class Backend(Utils, BssChatSupport):
         for label in (slot_updates or {}).keys():
             if not self._is_bss_label(label):
                 continue
-            section = self._bss_section_for_label(label)
-            if not section:
-                continue
-            item = (updated_bss.get(section) or {}).get(label)
-            if not item:
+            node = graph.nodes.get(label)
+            if node is None or not node.section:
                 continue
 
-            norm = self._normalize_bss_item(item)
-            status_now = (norm.get("status") or "").strip().lower()
+            status_now = (node.item.get("status") or "").strip().lower()
 
             if status_now == "draft":
                 draft_roots.add(label)
@@ -251,10 +483,6 @@ class Backend(Utils, BssChatSupport):
                 # LLM emitted this label, but it is not in draft → frozen for relationships
                 locked_for_relationships.add(label)
 
-        if locked_for_relationships:
-            next_question += f"\n\nMessage from Host: the LLM tried to modify the following items: {', '.join(list(locked_for_relationships))} that have been locked. \nIf you agree with this change please change the permissions and ask the LLM to try again."
-
-
         # POST: recompute host-maintained dependency fields.
         #
         # - If we deleted labels, keep the old behaviour: full recompute
@@ -264,81 +492,22 @@ class Backend(Utils, BssChatSupport):
         #     - already in draft before this turn, and
         #     - emitted in this turn (draft_roots).
         if deleted_labels:
-            updated_bss = self._recompute_bss_dependency_fields(updated_bss)
+            updated_bss = self._recompute_bss_dependency_fields(graph)
         elif draft_roots:
+            # nodes mentioning a root: the stored index, plus this turn's edits
+            # (not in it yet); the recompute checks each against its text
+            referencing = self.load_bss_referencing(project_id, version, draft_roots)
+            if referencing is not None:
+                edited = [label for label in slot_updates if self._is_bss_label(label)]
+                referencing = {key: labels + edited for key, labels in referencing.items()}
             updated_bss = self._recompute_bss_dependency_fields(
-                updated_bss,
+                graph,
                 root_labels=draft_roots,
+                referencing=referencing,
             )
         # else: no relationship recompute (non-draft items' relationships stay frozen)
 
-        # Store chat history + heartbeat together in the global history cache
-        # (see note below on HistoryCache)
-        GLOBAL_BSS_HISTORY_CACHE.append_turn(
-            project_id,
-            user_text,
-            next_question,
-        )
-
-        # Persist current chat queue into metadata.chat_queue
-        # build chat_queue from history only (no prompt)
-        hist_msgs = GLOBAL_BSS_HISTORY_CACHE.snapshot(project_id)
-        chat_queue = self._messages_to_chat_queue(hist_msgs, limit=10)
-        metadata = updated_bss.get("metadata")
-        if not isinstance(metadata, dict):
-            metadata = {}
-        metadata["chat_queue"] = chat_queue
-        updated_bss["metadata"] = metadata
-
-        self.save_bss_schema(project_id, updated_bss)
-
-        # ###############################################################
-        # 1) Early callback: send updated doc + bot reply immediately
-        #    (intermediate event; final HTTP response will only contain
-        #    relationship diffs + heartbeat).
-        # ###############################################################
-        self.emit(
-            "chat_early_callback",
-            {
-                "bot_message": next_question,
-                "bss_schema": self._redact_bss_schema_for_ui(updated_bss),
-                "bss_labels": self._bss_labels,
-            },
-        )
-
-        # 2) Second-pass relationship refinement (PROC↔API, PROC↔PROC, UI↔UI, ENT↔ENT).
-        updated_bss, updated_relationships, refine_extra_cost = self._refine_all_second_pass_relationships(
-            updated_bss,
-            draft_roots=draft_roots,
-            model_name=self._detect_llm_model_in_payload(payload) or "gemini-2.5-flash-lite",
-            project_id=str(project_id),
-            user_text=user_text,
-            bot_message=next_question,
-            history_msgs=hist_msgs,
-            turn_labels=draft_roots,
-        )
-
-        # Persist any relationship changes derived from the tie-break step.
-        if updated_relationships:
-            self.save_bss_schema(project_id, updated_bss)
-
-        # 3) Compute amount/currency from the LLM client (both calls).
-        main_cost = chat_llm.get_accrued_cost() if chat_llm else 0
-        total_cost = float(main_cost) + float(refine_extra_cost or 0.0)
-        idempotency_key = record_pending_charge(
-            self.SessionFactory,
-            project_id=str(project_id),
-            amount=total_cost,
-            currency=CURRENCY
-        )
-
-        # Store idempotency_key
-        IDEMPOTENCY_CACHE.add(idempotency_key)
-
-        return {
-            "updated_relationships": updated_relationships,
-            "heartbeat": idempotency_key,
-        }
+        return updated_bss, draft_roots, locked_for_relationships
 
     def handle_save_state(self, project_id: str, payload: dict) -> dict:
         """
@@ -349,16 +518,22 @@ class Backend(Utils, BssChatSupport):
             "state": <any JSON-serializable blob>
           }
         """
+        current_bss = self.load_bss_metadata(project_id)
+        if not isinstance(current_bss, dict):
+            current_bss = {}
+
+        respond = self._apply_save_state(current_bss, payload)
+        self.save_bss_metadata(project_id, current_bss)
+
+        return respond(current_bss)
+
+    def _apply_save_state(self, current_bss: dict, payload: dict):
         payload = payload or {}
         if "state" not in payload:
             raise ValueError("save_state payload.state is required")
 
         state_blob = payload["state"]
 
-        current_bss = self.load_bss_schema(project_id)
-        if not isinstance(current_bss, dict):
-            current_bss = {}
-
         metadata = current_bss.get("metadata")
         if not isinstance(metadata, dict):
             metadata = {}
@@ -366,9 +541,7 @@ class Backend(Utils, BssChatSupport):
         metadata["ui_state"] = state_blob
         current_bss["metadata"] = metadata
 
-        self.save_bss_schema(project_id, current_bss)
-
-        return {"ok": True}
+        return lambda updated_bss: {"ok": True}
 
 
     def handle_edit_bss_document(self, project_id: str, payload):
@@ -396,9 +569,11 @@ class Backend(Utils, BssChatSupport):
         if new_status is None and new_definition is None and ("cancelled" not in content):
             raise ValueError("edit_bss_document payload.content must include 'status' and/or 'definition'/'value' and/or 'cancelled'")
 
-        current_bss = self.load_bss_schema(project_id)
+        current_bss, base_version = self.load_bss_schema(project_id)
         if not isinstance(current_bss, dict):
             current_bss = {}
+        client_version = parse_base_version(payload)
+        before_bss = copy_document(current_bss) if client_version == base_version else None
 
         current_bss.setdefault(section, {})
 
@@ -423,10 +598,10 @@ class Backend(Utils, BssChatSupport):
         # Keep host-maintained fields consistent
         current_bss = self._recompute_bss_dependency_fields(current_bss)
 
-        self.save_bss_schema(project_id, current_bss)
+        version = self.save_bss_schema(project_id, current_bss, expected_version=base_version)
 
         return {
-            "bss_schema": self._redact_bss_schema_for_ui(current_bss),
+            **self._bss_ui_update(before_bss, current_bss, base_version, version, client_version),
             "bss_labels": self._bss_labels,
         }
 
@@ -442,6 +617,19 @@ class Backend(Utils, BssChatSupport):
             "segments": { ... }       # optional; full definition if present
           }
         """
+        current_bss, loaded_version = self.load_bss_schema(project_id)
+        if not isinstance(current_bss, dict):
+            current_bss = {}
+
+        respond = self._apply_edit_bss_node(current_bss, payload)
+
+        # Recompute graph with existing status semantics
+        updated_bss = self._recompute_bss_dependency_fields(current_bss)
+        self.save_bss_schema(project_id, updated_bss, expected_version=loaded_version)
+
+        return respond(updated_bss)
+
+    def _apply_edit_bss_node(self, current_bss: dict, payload: dict):
         payload = payload or {}
         label = (payload.get("label") or "").strip()
         if not label or not self._is_bss_label(label):
@@ -453,10 +641,6 @@ class Backend(Utils, BssChatSupport):
 
         new_status = (payload.get("status") or "").strip() or None
 
-        current_bss = self.load_bss_schema(project_id)
-        if not isinstance(current_bss, dict):
-            current_bss = {}
-
         section = self._bss_section_for_label(label)
         if not section:
             raise ValueError(f"Could not map label to section: {label}")
@@ -524,12 +708,8 @@ class Backend(Utils, BssChatSupport):
         current_bss.setdefault(section, {})
         current_bss[section][label] = existing
 
-        # 3) Recompute graph with existing status semantics
-        updated_bss = self._recompute_bss_dependency_fields(current_bss)
-        self.save_bss_schema(project_id, updated_bss)
-
         # UI does not care about the response body
-        return {}
+        return lambda updated_bss: {}
 
 
     def handle_create_relationship(self, project_id: str, payload: dict) -> dict:
@@ -542,6 +722,19 @@ class Backend(Utils, BssChatSupport):
         - from_label / from
         - to_label   / to
         """
+        current_bss, loaded_version = self.load_bss_schema(project_id)
+        if not isinstance(current_bss, dict):
+            current_bss = {}
+
+        respond = self._apply_create_relationship(current_bss, payload)
+
+        # Recompute dependency/dependant fields to include this relationship
+        updated_bss = self._recompute_bss_dependency_fields(current_bss)
+        self.save_bss_schema(project_id, updated_bss, expected_version=loaded_version)
+
+        return respond(updated_bss)
+
+    def _apply_create_relationship(self, current_bss: dict, payload: dict):
         payload = payload or {}
         src = (payload.get("from_label") or payload.get("from") or "").strip()
         dst = (payload.get("to_label") or payload.get("to") or "").strip()
@@ -555,10 +748,6 @@ class Backend(Utils, BssChatSupport):
         if not self._is_bss_label(dst):
             raise ValueError(f"Invalid target label: {dst}")
 
-        current_bss = self.load_bss_schema(project_id)
-        if not isinstance(current_bss, dict):
-            current_bss = {}
-
         # Ensure both nodes exist in the current schema
         existing_labels = {label for label, _ in self._iter_bss_items(current_bss)}
         if src not in existing_labels:
@@ -586,13 +775,9 @@ class Backend(Utils, BssChatSupport):
 
         current_bss[src_section][src] = src_item
 
-        # Recompute dependency/dependant fields to include this relationship
-        updated_bss = self._recompute_bss_dependency_fields(current_bss)
-        self.save_bss_schema(project_id, updated_bss)
-
         # Return only the two affected nodes with their edge fields,
         # to avoid sending the whole document back.
-        def _extract_edges(label: str) -> dict:
+        def _extract_edges(updated_bss: dict, label: str) -> dict:
             section = self._bss_section_for_label(label)
             if not section:
                 raise ValueError(f"Could not map label to section after update: {label}")
@@ -605,9 +790,9 @@ class Backend(Utils, BssChatSupport):
                 "dependants": item.get("dependants", ""),
             }
 
-        return {
-            "from": _extract_edges(src),
-            "to": _extract_edges(dst),
+        return lambda updated_bss: {
+            "from": _extract_edges(updated_bss, src),
+            "to": _extract_edges(updated_bss, dst),
         }
 
 
@@ -617,6 +802,18 @@ class Backend(Utils, BssChatSupport):
 
         Semantics: remove the edge 'source_label depends on target_label'.
         """
+        current_bss, loaded_version = self.load_bss_schema(project_id)
+        if not isinstance(current_bss, dict):
+            current_bss = {}
+
+        respond = self._apply_remove_bss_relationship(current_bss, payload)
+
+        updated_bss = self._recompute_bss_dependency_fields(current_bss)
+        self.save_bss_schema(project_id, updated_bss, expected_version=loaded_version)
+
+        return respond(updated_bss)
+
+    def _apply_remove_bss_relationship(self, current_bss: dict, payload: dict):
         payload = payload or {}
         src = (payload.get("from_label") or payload.get("from") or "").strip()
         dst = (payload.get("to_label") or payload.get("to") or "").strip()
@@ -630,10 +827,6 @@ class Backend(Utils, BssChatSupport):
         if not self._is_bss_label(dst):
             raise ValueError(f"Invalid target label: {dst}")
 
-        current_bss = self.load_bss_schema(project_id)
-        if not isinstance(current_bss, dict):
-            current_bss = {}
-
         existing_labels = {label for label, _ in self._iter_bss_items(current_bss)}
         if src not in existing_labels:
             raise ValueError(f"Source label does not exist in schema: {src}")
@@ -667,10 +860,7 @@ class Backend(Utils, BssChatSupport):
         current_bss[src_section][src] = src_item
         current_bss[dst_section][dst] = dst_item
 
-        updated_bss = self._recompute_bss_dependency_fields(current_bss)
-        self.save_bss_schema(project_id, updated_bss)
-
-        def _extract_node(label: str) -> dict:
+        def _extract_node(updated_bss: dict, label: str) -> dict:
             section = self._bss_section_for_label(label)
             item = self._normalize_bss_item(
                 (updated_bss.get(section) or {}).get(label) or {}
@@ -682,9 +872,9 @@ class Backend(Utils, BssChatSupport):
                 "dependants": item.get("dependants", ""),
             }
 
-        return {
-            "from": _extract_node(src),
-            "to": _extract_node(dst),
+        return lambda updated_bss: {
+            "from": _extract_node(updated_bss, src),
+            "to": _extract_node(updated_bss, dst),
         }
 
 
@@ -814,13 +1004,33 @@ class Backend(Utils, BssChatSupport):
     # ! INGESTION
     # !##############################################
 
+    def _save_ingested_bss(self, project_id: str, ingested_bss: dict) -> int:
+        """
+        Replace the stored document with an ingested one (last writer wins on
+        the items, as before), keeping the metadata (ui_state, chat_queue) the
+        project has at save time. Saved again on the newer version when a
+        metadata write lands in between.
+        """
+        attempts = max(1, BSS_CAS_RETRIES)
+        for attempt in range(1, attempts + 1):
+            # version first: metadata read after it is at least as new
+            version = self.bss_version(project_id)
+            metadata = self.load_bss_metadata(project_id).get("metadata")
+            content = dict(ingested_bss)
+            if isinstance(metadata, dict) and metadata:
+                content["metadata"] = {**metadata, **(ingested_bss.get("metadata") or {})}
+            try:
+                return self.save_bss_schema(project_id, content, expected_version=version)
+            except BssVersionConflict as e:
+                if attempt == attempts:
+                    raise
+                logger.info(f"Ingestion for project {project_id}: {e}; saving again on the current version")
+
     def handle_ingestion(self, project_id: str, payload):
         ingestion_handler = BSSIngestion()
         current_bss, total_cost= ingestion_handler.handle_ingestion(payload, self.emit)
 
-        # finally persist
-        self.save_bss_schema(project_id, current_bss)
-
+        # billed before the save: the ingestion is paid for even if that fails
         idempotency_key = record_pending_charge(
             self.SessionFactory,
             project_id=str(project_id),
@@ -830,8 +1040,12 @@ class Backend(Utils, BssChatSupport):
 
         IDEMPOTENCY_CACHE.add(idempotency_key)
 
+        # finally persist
+        version = self._save_ingested_bss(project_id, current_bss)
+
         return {
             "bss_schema": self._redact_bss_schema_for_ui(current_bss),
+            "bss_version": version,
             "bss_labels": self._bss_labels,
             "heartbeat": idempotency_key,
         }
@@ -9,6 +9,14 @@ import commentjson
 import yaml
 
 from classes.base_utils import BaseUtils
+from classes.bss_blob import BssBlobStore
+from classes.bss_cache import CachedBssStore
+from classes.bss_diff import changed_labels, subdocument, ui_delta
+from classes.bss_graph import BssGraph
+from classes.bss_definition_tokens import tokenize_definition
+from classes.bss_label import label_key, parse_label
+from classes.bss_nodes import BSS_STORAGE, BssNodeStore
+from classes.bss_ui_view import BSS_REDACTION_CACHE, BSS_UI_VIEW, MISSING, item_hash
 from chat_prompts.chat_prompts import ASK_LOG_SYNTH_PROMPT, BSS_PROMPT_EXAMPLES, CALL_SEQUENCE_EXTRACTOR_PROMPT, COMP_OWNERSHIP_PROMPT, ENT_ENT_DEP_EXTRACTOR_PROMPT, PROC_PROC_DEP_EXTRACTOR_PROMPT, UI_UI_DEP_EXTRACTOR_PROMPT
 from classes.entities import Project
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
@@ -28,7 +36,7 @@ class Utils(BaseUtils):
     # bss_prompt reconstruction
     # -----------------------
 
-    def _bss_example_kwargs(self, bss_schema: dict) -> dict:
+    def _bss_example_kwargs(self, bss_schema: dict | BssGraph) -> dict:
         REQUIRED = {
             "A":   {"notes"},
             "UC":  {"definition","flow","notes"},
@@ -60,20 +68,16 @@ class Utils(BaseUtils):
         for fam in RULES.keys():
             stats[fam] = {"ce": 0, "chars": {}, "min_notes_len": None}
 
-        for label, item in self._iter_bss_items(bss_schema or {}):
-            norm = self._normalize_bss_item(item)
-            if norm.get("cancelled") is True:
-                continue
-
-            fam = (self._bss_label_type(label) or "").upper()
+        for label, node in self._bss_graph(bss_schema).active.items():
+            fam = (node.type or "").upper()
             if fam not in RULES:
                 continue
 
-            definition = norm.get("definition") or ""
+            definition = node.item.get("definition") or ""
             if fam == "A":
                 segs = {"notes": definition.strip()}
             else:
-                segs_raw = self._split_definition_segments(definition)
+                segs_raw = node.segments
                 segs = {k.lower(): (v or "").strip() for k, v in (segs_raw or {}).items()}
 
             required = REQUIRED.get(fam, set())
@@ -450,7 +454,21 @@ class Utils(BaseUtils):
     # -----------------------
 
 
-    def _bss_current_document_for_prompt(self, bss_schema: dict) -> str:
+    def _prepare_bss_chat_inputs(self, bss_schema: dict | BssGraph) -> dict:
+        """
+        Everything handle_bss_chat derives from the schema before prompting,
+        in one call (one trip when offloaded to the CPU pool) over one graph.
+        """
+        graph = self._bss_graph(bss_schema)
+        return {
+            "current_document": self._bss_current_document_for_prompt(graph),
+            "registry_ledger": self._build_registry_ledger(graph),
+            "open_items": self._collect_open_items_by_gravity(graph),
+            "next_indices": self._bss_next_indices(graph),
+            "example_kwargs": self._bss_example_kwargs(graph),
+        }
+
+    def _bss_current_document_for_prompt(self, bss_schema: dict | BssGraph) -> str:
         """
         Build the BSS document text sent to the LLM in the new format:
 
@@ -458,16 +476,14 @@ class Utils(BaseUtils):
         - [segment]:
         body...
         """
-        flat: dict[str, dict] = {}
-        for label, item in self._iter_bss_items(bss_schema):
-            flat[label] = self._normalize_bss_item(item)
-
-        ordered_labels = sorted(flat.keys(), key=self._bss_label_sort_key)
+        graph = self._bss_graph(bss_schema)
+        ordered_labels = graph.sorted_labels(graph.nodes)
 
         lines: list[str] = []
 
         for label in ordered_labels:
-            obj = flat[label]
+            node = graph.nodes[label]
+            obj = node.item
             status = (obj.get("status") or "").strip()
 
             # -------------------
@@ -476,14 +492,14 @@ class Utils(BaseUtils):
             segments: dict[str, str] = {}
 
             definition_text = obj.get("definition") or ""
-            label_type = self._bss_label_type(label)
+            label_type = node.type
 
             if label_type == "A":
                 # For A-items, "notes" is effectively the definition
                 if definition_text.strip():
                     segments["notes"] = definition_text.strip()
             else:
-                segs = self._split_definition_segments(definition_text)
+                segs = node.segments
                 for seg_name, seg_body in segs.items():
                     # References segment disappears from the LLM-facing document
                     if seg_name == "references":
@@ -553,69 +569,122 @@ class Utils(BaseUtils):
         return s
 
 
-    def load_bss_schema(self, project_id: str) -> dict:
-        session = self.SessionFactory()
-        try:
-            project = (
-                session.query(Project)
-                .filter(Project.project_id == str(project_id))
-                .one_or_none()
-            )
-            if not project:
-                raise ValueError(f"Project not found: {project_id}")
-            return project.bss_schema or {}
-        finally:
-            session.close()
+    def _bss_store(self) -> CachedBssStore:
+        # with BSS_UI_VIEW the stores persist each node's redacted item too
+        redact_item = self._redact_bss_item_for_ui if BSS_UI_VIEW else None
+        if BSS_STORAGE == "nodes":
+            return CachedBssStore(BssNodeStore(self.SessionFactory, redact_item))
+        return CachedBssStore(BssBlobStore(self.SessionFactory, redact_item))
 
-    def save_bss_schema(self, project_id: str, content) -> None:
+    def load_bss_schema(self, project_id: str) -> tuple[dict, int]:
+        """
+        (document, version); save_bss_schema() needs that version back.
+        """
+        return self._bss_store().load_versioned(project_id)
+
+    def save_bss_schema(self, project_id: str, content, expected_version: int) -> int:
+        """
+        Only what changed since the last load/save of the project is written
+        (see classes/bss_blob.py and classes/bss_nodes.py).
+        Raises BssVersionConflict if the project is no longer at
+        expected_version (the version the caller loaded). Returns the new one.
+        """
         if content is None:
             content = {}
         if not isinstance(content, dict):
             raise ValueError("save_bss_schema content must be a JSON object (dict)")
 
-        session = self.SessionFactory()
+        return self._bss_store().save(project_id, content, expected_version=expected_version)
+
+    def load_bss_referencing(self, project_id: str, version: int, labels) -> dict[str, list[str]] | None:
+        """
+        {label_key(label): [labels whose text mentions it]} from the stored
+        reference index, if it describes `version` (the one the caller
+        loaded); None otherwise. Items edited since are not in it.
+        """
         try:
-            project = (
-                session.query(Project)
-                .filter(Project.project_id == str(project_id))
-                .one_or_none()
-            )
-            if not project:
-                raise ValueError(f"Project not found: {project_id}")
+            return self._bss_store().load_referencing(project_id, version, labels)
+        except Exception as e:
+            logger.info(f"Reference index of project {project_id} unavailable: {e}")
+            return None
 
-            project.bss_schema = content
-            session.commit()
-        finally:
-            session.close()
+    def load_bss_metadata(self, project_id: str) -> dict:
+        """
+        {"metadata": {...}} only, for operations that only touch metadata;
+        persist it with save_bss_metadata().
+        """
+        return self._bss_store().load_metadata(project_id)
+
+    def save_bss_metadata(self, project_id: str, content: dict) -> None:
+        self._bss_store().save_metadata(project_id, content)
+
+    def load_bss_ui_view(self, project_id: str) -> dict:
+        """
+        The redacted document for the editor: the stored view when
+        BSS_UI_VIEW is on and it is current, else redacted from the
+        canonical document (see classes/bss_ui_view.py).
+        """
+        if BSS_UI_VIEW:
+            items = self._bss_store().load_ui(project_id)
+            if items is not None:
+                return self._bss_ui_sections(items)
+        return self._redact_bss_schema_for_ui(self.load_bss_schema(project_id)[0])
+
+    def bss_version(self, project_id: str) -> int:
+        """
+        Stored version of the project's BSS document (handlers that save use
+        the version load_bss_schema() returned instead).
+        """
+        return self._bss_store().store.current_version(project_id)
+
+    def _bss_ui_update(
+        self,
+        before_bss: dict | None,
+        after_bss: dict,
+        base_version: int | None,
+        version: int,
+        client_version: int | None,
+    ) -> dict:
+        """
+        What the UI gets after a change: a delta from base_version when the
+        client holds that version (and before_bss was kept), else the whole
+        redacted document. See classes/bss_diff.py.
+        """
+        if before_bss is None or client_version is None or client_version != base_version:
+            return {"bss_schema": self._redact_bss_schema_for_ui(after_bss), "bss_version": version}
+
+        changed, removed = changed_labels(before_bss, after_bss)
+        touched = changed | removed
+        delta = ui_delta(
+            self._redact_bss_schema_for_ui(subdocument(before_bss, touched)),
+            self._redact_bss_schema_for_ui(subdocument(after_bss, touched)),
+            base_version,
+            version,
+            removed,
+        )
+        return {"bss_delta": delta, "bss_version": version}
 
 
     # -----------------------
     # BSS label/type/section helpers
     # -----------------------
 
-    def _build_registry_ledger(self, bss_schema: dict) -> dict:
+    def _build_registry_ledger(self, bss_schema: dict | BssGraph) -> dict:
         ledger: dict[str, list[str]] = {k: [] for k in self._bss_section_order()}
 
         # collect labels, skip cancelled
-        flat: dict[str, dict] = {}
-        for label, item in self._iter_bss_items(bss_schema):
-            norm = self._normalize_bss_item(item)
-            flat[label] = norm
-
-        for label, item in flat.items():
-            if item.get("cancelled") is True:
-                continue
-            section = self._bss_section_for_label(label)
-            if not section:
+        graph = self._bss_graph(bss_schema)
+        for label, node in graph.active.items():
+            if not node.section:
                 continue
-            ledger.setdefault(section, []).append(label)
+            ledger.setdefault(node.section, []).append(label)
 
         for section in list(ledger.keys()):
-            ledger[section] = sorted(list(dict.fromkeys(ledger[section])), key=self._bss_label_sort_key)
+            ledger[section] = graph.sorted_labels(dict.fromkeys(ledger[section]))
 
         return ledger
 
-    def _bss_next_indices(self, bss_schema: dict) -> dict[str, int]:
+    def _bss_next_indices(self, bss_schema: dict | BssGraph) -> dict[str, int]:
         """
         For each family (UC, PROC, UI, ...) return the next numeric index
         (max existing + 1, or 1 if none).
@@ -623,18 +692,17 @@ class Utils(BaseUtils):
         from collections import defaultdict
         max_idx = defaultdict(int)
 
-        for label, _ in self._iter_bss_items(bss_schema or {}):
-            fam = self._bss_label_type(label)
-            if not fam:
-                continue
-            m = re.match(
-                r"^(A|UC|PROC|COMP|ROLE|UI|ENT|INT|API|NFR)-?(\d+)_",
-                label.strip(),
-                flags=re.IGNORECASE,
-            )
-            if not m:
+        if isinstance(bss_schema, BssGraph):
+            labels = list(bss_schema.nodes)
+        else:
+            labels = [label for label, _ in self._iter_bss_items(bss_schema or {})]
+
+        for label in labels:
+            parsed = parse_label(label)
+            fam = parsed.family
+            if not fam or parsed.index is None:
                 continue
-            n = int(m.group(2))
+            n = parsed.index
             if n > max_idx[fam]:
                 max_idx[fam] = n
 
@@ -644,7 +712,7 @@ class Utils(BaseUtils):
         return out
 
 
-    def _collect_open_items_by_gravity(self, bss_schema: dict) -> list:
+    def _collect_open_items_by_gravity(self, bss_schema: dict | BssGraph) -> list:
         """
         Scan all BSS items and group their open_items snippets by gravity.
         Each snippet is expected (tolerantly) to look like:
@@ -658,14 +726,11 @@ class Utils(BaseUtils):
             "med": [],
             "low": [],
         }
-        if not isinstance(bss_schema, dict):
+        if not isinstance(bss_schema, (dict, BssGraph)):
             return buckets
 
-        for label, item in self._iter_bss_items(bss_schema):
-            norm = self._normalize_bss_item(item)
-            if norm.get("cancelled") is True:
-                continue
-            raw_open = (norm.get("open_items") or "").strip()
+        for label, node in self._bss_graph(bss_schema).active.items():
+            raw_open = (node.item.get("open_items") or "").strip()
             if not raw_open:
                 continue
             parts = [p.strip() for p in raw_open.split(";") if p and p.strip()]
@@ -724,7 +789,19 @@ class Utils(BaseUtils):
     # ! HARD REFERENCE RECONSTRUCTION
     # !##############################################
 
-    def _recompute_bss_dependency_fields(self, bss_schema: dict, root_labels: set[str] | None = None) -> dict:
+    def _recompute_bss_dependency_fields(
+        self,
+        bss_schema: dict | BssGraph,
+        root_labels: set[str] | None = None,
+        referencing: dict[str, list[str]] | None = None,
+    ) -> dict:
+        """
+        Rebuild the dependencies / dependants fields from the references in
+        the items' text; with root_labels, only the edges touching them.
+        referencing ({label_key(root): [labels]}, see load_bss_referencing())
+        names the nodes that may mention each root; without it every node is
+        scanned.
+        """
         # Type-level permission graph:
         # X depends on Y  =>  X -> Y
         # Anything not allowed here will be dropped (no edge) even if present in text.
@@ -775,22 +852,15 @@ class Utils(BaseUtils):
             "NFR":  {"PROC", "COMP", "API", "UI"},
         }
 
-        # 1) flatten + normalize
-        flat: dict[str, dict] = {}
-        label_types: dict[str, str] = {}
-
-        for label, item in self._iter_bss_items(bss_schema):
-            norm = self._normalize_bss_item(item)
-            if norm.get("cancelled") is True:
-                continue
-            flat[label] = norm
-            t = self._bss_label_type(label)
-            if t:
-                label_types[label] = t
+        # 1) flatten + normalize (copies: the dependency fields are rewritten below)
+        graph = self._bss_graph(bss_schema)
+        flat: dict[str, dict] = {label: dict(node.item) for label, node in graph.active.items()}
+        label_types = graph.label_types
+        sort_key = graph.sort_key
 
         all_labels = set(flat.keys())
         # Map for case-insensitive canonicalization: "ROLE-1_CUSTOMER" -> "ROLE-1_Customer"
-        canonical_by_upper = {lbl.upper(): lbl for lbl in all_labels}
+        canonical_by_upper = graph.canonical_by_upper
 
         def _comp_edge_allowed(src: str, dst: str) -> bool:
             """
@@ -811,9 +881,7 @@ class Utils(BaseUtils):
                 comp_label, other_label = dst, src
 
             # Enforce COMP kind → ownership constraints
-            comp_def = (flat.get(comp_label, {}) or {}).get("definition") or ""
-            segs = self._split_definition_segments(comp_def)
-            kind = (segs.get("kind") or "").strip().lower()
+            kind = graph.active[comp_label].tokens.kind
             other_type = label_types.get(other_label)
 
             if kind:
@@ -826,7 +894,7 @@ class Utils(BaseUtils):
                     return False
 
             # Only allow if the COMP node itself references the other label
-            return other_label in (refs_by_label.get(comp_label) or [])
+            return other_label in refs_of(comp_label)
 
         def _int_kind_for_label(lbl: str) -> str | None:
             """
@@ -835,9 +903,7 @@ class Utils(BaseUtils):
             """
             if label_types.get(lbl) != "INT":
                 return None
-            definition = (flat.get(lbl, {}) or {}).get("definition") or ""
-            segs = self._split_definition_segments(definition)
-            raw = (segs.get("kind") or "").strip().lower()
+            raw = graph.active[lbl].tokens.kind
             if not raw:
                 return None
             if "inbound" in raw:
@@ -869,19 +935,13 @@ class Utils(BaseUtils):
             # All other pairs rely purely on allowed_deps type matrix.
             return ct in allowed_deps.get(pt, set())
 
-        # 2) collect refs per label
+        # 2) refs per label
         #    - from free-text (definition + open_items)
         #    - plus any explicit user_defined_relationships
-        refs_by_label: dict[str, list[str]] = {}
-
-        for label, item in flat.items():
-            refs_text = self._extract_reference_labels_from_definition(
-                (item.get("definition") or ""),
-                (item.get("open_items") or ""),
-            )
-            refs_udr = self._extract_reference_labels_from_definition(
-                (item.get("user_defined_relationships") or "")
-            )
+        def raw_refs(label: str) -> list[str]:
+            refs_text = graph.active[label].refs
+            udr = graph.active[label].item.get("user_defined_relationships") or ""
+            refs_udr = self._extract_reference_labels_from_definition(udr) if udr else []
 
             # Union + preserve order: textual refs first, then user-defined
             seen_local: set[str] = set()
@@ -894,17 +954,24 @@ class Utils(BaseUtils):
                     continue
                 seen_local.add(r)
                 refs_all.append(r)
+            return refs_all
 
-            resolved: list[str] = []
-            for r in refs_all:
-                if not r:
-                    continue
+        refs_by_label: dict[str, list[str]] = {}
+
+        def refs_of(label: str) -> list[str]:
+            resolved = refs_by_label.get(label)
+            if resolved is not None:
+                return resolved
+
+            resolved = []
+            for r in raw_refs(label):
                 # avoid self-dependency (case-insensitive)
-                if r.upper() == label.upper():
+                key = label_key(r)
+                if key == label_key(label):
                     continue
 
                 # Map to canonical label if it exists in the schema
-                canon = canonical_by_upper.get(r.upper())
+                canon = canonical_by_upper.get(key)
                 if not canon:
                     # no such item in the schema → ignore
                     continue
@@ -912,6 +979,7 @@ class Utils(BaseUtils):
                 resolved.append(canon)
 
             refs_by_label[label] = resolved
+            return resolved
 
         # 3) full vs partial recompute
         roots: set[str] = set()
@@ -919,15 +987,15 @@ class Utils(BaseUtils):
             for lbl in root_labels:
                 if not isinstance(lbl, str):
                     continue
-                canon = canonical_by_upper.get(lbl.strip().upper())
+                canon = canonical_by_upper.get(label_key(lbl))
                 if canon:
                     roots.add(canon)
 
         if not roots:
             # GLOBAL recompute (previous behaviour)
             pair_set: set[frozenset[str]] = set()
-            for src, refs in refs_by_label.items():
-                for dst in refs:
+            for src in flat.keys():
+                for dst in refs_of(src):
                     if dst not in all_labels:
                         continue
                     if not _comp_edge_allowed(src, dst):
@@ -940,7 +1008,7 @@ class Utils(BaseUtils):
                 a, b = tuple(pair)  # exactly 2 elements
 
                 # stable order for tie-breaks
-                if self._bss_label_sort_key(b) < self._bss_label_sort_key(a):
+                if sort_key(b) < sort_key(a):
                     a, b = b, a
 
                 can_a = can_have_child(a, b)  # a can have b as dependency
@@ -956,8 +1024,8 @@ class Utils(BaseUtils):
                     parent, child = b, a
                 else:
                     # symmetric or both disallowed -> textual direction, else stable
-                    a_refs_b = b in refs_by_label.get(a, ())
-                    b_refs_a = a in refs_by_label.get(b, ())
+                    a_refs_b = b in refs_of(a)
+                    b_refs_a = a in refs_of(b)
                     if a_refs_b and not b_refs_a:
                         parent, child = a, b
                     elif b_refs_a and not a_refs_b:
@@ -975,22 +1043,15 @@ class Utils(BaseUtils):
             children: dict[str, set[str]] = {lbl: set() for lbl in flat.keys()}
 
             # Baseline from existing dependencies
-            for label, item in flat.items():
-                deps_raw = (item.get("dependencies") or "").strip()
-                if not deps_raw:
-                    continue
-                for tok in deps_raw.split(","):
-                    t = tok.strip()
-                    if not t:
-                        continue
-                    canon = canonical_by_upper.get(t.upper())
-                    if canon and canon in all_labels and canon.upper() != label.upper():
+            for label in flat.keys():
+                for canon in graph.active[label].dependencies:
+                    if label_key(canon) != label_key(label):
                         children[label].add(canon)
 
-            roots_upper = {r.upper() for r in roots}
+            roots_upper = {label_key(r) for r in roots}
 
             def is_root(label: str) -> bool:
-                return label.upper() in roots_upper
+                return label_key(label) in roots_upper
 
             # Remove all edges that touch any root label; they will be recomputed.
             for parent in list(children.keys()):
@@ -999,14 +1060,22 @@ class Utils(BaseUtils):
                 else:
                     children[parent] = {c for c in children[parent] if not is_root(c)}
 
-            # Pairs only where at least one endpoint is a root.
+            # Pairs only where at least one endpoint is a root:
+            # the roots' own refs, plus the nodes referencing a root (among
+            # the candidates `referencing` names, or among all of them).
             pair_set: set[frozenset[str]] = set()
-            for src, refs in refs_by_label.items():
-                for dst in refs:
+            for root in roots:
+                edges = [(root, dst) for dst in refs_of(root)]
+                if referencing is None:
+                    candidates = flat.keys()
+                else:
+                    candidates = set(referencing.get(label_key(root), ())) | roots
+                for src in candidates:
+                    if src in all_labels and root in refs_of(src):
+                        edges.append((src, root))
+                for src, dst in edges:
                     if dst not in all_labels:
                         continue
-                    if not (is_root(src) or is_root(dst)):
-                        continue
                     if not _comp_edge_allowed(src, dst):
                         continue
                     pair_set.add(frozenset((src, dst)))
@@ -1015,7 +1084,7 @@ class Utils(BaseUtils):
             for pair in pair_set:
                 a, b = tuple(pair)
 
-                if self._bss_label_sort_key(b) < self._bss_label_sort_key(a):
+                if sort_key(b) < sort_key(a):
                     a, b = b, a
 
                 can_a = can_have_child(a, b)
@@ -1030,8 +1099,8 @@ class Utils(BaseUtils):
                 elif can_b and not can_a:
                     parent, child = b, a
                 else:
-                    a_refs_b = b in refs_by_label.get(a, ())
-                    b_refs_a = a in refs_by_label.get(b, ())
+                    a_refs_b = b in refs_of(a)
+                    b_refs_a = a in refs_of(b)
                     if a_refs_b and not b_refs_a:
                         parent, child = a, b
                     elif b_refs_a and not a_refs_b:
@@ -1050,8 +1119,8 @@ class Utils(BaseUtils):
 
         # 6) write CSV fields
         for label in flat.keys():
-            deps_sorted = sorted(children[label], key=self._bss_label_sort_key)
-            depants_sorted = sorted(parents[label], key=self._bss_label_sort_key)
+            deps_sorted = sorted(children[label], key=sort_key)
+            depants_sorted = sorted(parents[label], key=sort_key)
             flat[label]["dependencies"] = ",".join(deps_sorted)
             flat[label]["dependants"] = ",".join(depants_sorted)
 
@@ -1061,15 +1130,15 @@ class Utils(BaseUtils):
             out[section] = {}
 
         for label, item in flat.items():
-            section = self._bss_section_for_label(label) or "A"
+            section = graph.active[label].section or "A"
             out.setdefault(section, {})
             out[section][label] = item
 
         result = {k: v for k, v in out.items() if isinstance(v, dict) and v}
 
         # carry-through auxiliary metadata section unchanged
-        if isinstance(bss_schema, dict) and "metadata" in bss_schema:
-            result["metadata"] = bss_schema["metadata"]
+        if graph.has_metadata:
+            result["metadata"] = graph.metadata
 
         return result
 
@@ -1078,26 +1147,10 @@ class Utils(BaseUtils):
         if not isinstance(definition, str) or not definition.strip():
             return definition or ""
 
-        segment_names = [
-            "Definition",
-            "Flow",
-            "Contract",
-            "Contracts",
-            "Snippets",
-            "Outcomes",
-            "Decision",
-            "Notes",
-            "References",
-        ]
-
         # Segment headers start either at beginning, or at an *unescaped* pipe.
         # This prevents "\| Notes:" inside code from being treated as a real delimiter.
-        header_re = re.compile(
-            r"(^|(?<!\\)\|)\s*(" + "|".join(segment_names) + r")\s*:\s*",
-            flags=re.IGNORECASE,
-        )
-
-        matches = list(header_re.finditer(definition))
+        # Kind: is not a delimiter here (it stays inside the preceding segment).
+        matches = tokenize_definition(definition).segment_headers(exclude=("kind",))
         if not matches:
             return definition
 
@@ -1105,9 +1158,9 @@ class Utils(BaseUtils):
         pos = 0
 
         for i, m in enumerate(matches):
-            start = m.start()
-            end_header = m.end()
-            seg_name = (m.group(2) or "").strip().lower()
+            start = m.start
+            end_header = m.end
+            seg_name = m.name
 
             if start > pos:
                 out.append(definition[pos:start])
@@ -1116,7 +1169,7 @@ class Utils(BaseUtils):
             out.append(definition[start:end_header])
 
             body_start = end_header
-            body_end = matches[i + 1].start() if i + 1 < len(matches) else len(definition)
+            body_end = matches[i + 1].start if i + 1 < len(matches) else len(definition)
             body = definition[body_start:body_end]
 
             if seg_name in ("contract", "contracts", "snippets"):
@@ -1143,12 +1196,12 @@ class Utils(BaseUtils):
 
         # Remove the whole "References:" segment (with all its XYZ=[...] arrays),
         # starting either at beginning or at a preceding pipe.
-        m = re.search(r"(^|\|)\s*References\s*:\s*", definition, flags=re.IGNORECASE)
+        m = tokenize_definition(definition).references_header()
         if not m:
             return definition
 
-        start = m.start()  # includes the preceding '|' when present
-        end_pipe = definition.find("|", m.end())
+        start = m.start  # includes the preceding '|' when present
+        end_pipe = definition.find("|", m.end)
 
         # If no trailing pipe, delete to end-of-string
         if end_pipe < 0:
@@ -1170,23 +1223,44 @@ class Utils(BaseUtils):
         if not isinstance(bss_schema, dict):
             return {}
 
-        out: dict[str, dict] = {}
-
+        items = {}
         for label, item in self._iter_bss_items(bss_schema):
-            norm = self._normalize_bss_item(item)
+            redacted = self._redact_bss_item_for_ui(item)
+            if redacted is not None:
+                items[label] = redacted
+        return self._bss_ui_sections(items)
 
+    def _redact_bss_item_for_ui(self, item) -> dict | None:
+        """
+        Normalized item with its definition redacted; None for a cancelled
+        one. Memoized per item content (BSS_REDACTION_CACHE).
+        """
+        key = item_hash(item)
+        redacted = BSS_REDACTION_CACHE.get(key)
+        if redacted is MISSING:
+            norm = self._normalize_bss_item(item)
             # 2) Do not send back nodes where cancelled = true
             if norm.get("cancelled") is True:
-                continue
-
-            norm["definition"] = self._redact_bss_definition_for_ui(norm.get("definition", ""))
+                redacted = None
+            else:
+                norm["definition"] = self._redact_bss_definition_for_ui(norm.get("definition", ""))
+                redacted = norm
+            BSS_REDACTION_CACHE.put(key, redacted)
+        # callers own what they get; the cached item stays as it is
+        return dict(redacted) if redacted is not None else None
 
+    def _bss_ui_sections(self, items: dict) -> dict:
+        """
+        {label: redacted item or None} -> {section: {label: item}}, without
+        cancelled items and empty sections.
+        """
+        out: dict[str, dict] = {}
+        for label, item in items.items():
+            if item is None:
+                continue
             section = self._bss_section_for_label(label) or "A"
             out.setdefault(section, {})
-            out[section][label] = norm
-
-        # drop empty sections
-        out = {k: v for k, v in out.items() if v}
+            out[section][label] = item
         return out
 
 
@@ -1199,18 +1273,11 @@ class Utils(BaseUtils):
                 deleted.add(label)
         return deleted
 
-    def _bss_any_item_references_labels(self, bss_schema: dict, labels: set[str]) -> bool:
+    def _bss_any_item_references_labels(self, bss_schema: dict | BssGraph, labels: set[str]) -> bool:
         if not labels:
             return False
-        for _, item in self._iter_bss_items(bss_schema):
-            norm = self._normalize_bss_item(item)
-            if norm.get("cancelled") is True:
-                continue
-            refs = self._extract_reference_labels_from_definition(
-                norm.get("definition", ""),
-                norm.get("open_items", ""),
-            )
-            if any(r in labels for r in refs):
+        for node in self._bss_graph(bss_schema).active.values():
+            if any(r in labels for r in node.refs):
                 return True
         return False
 
@@ -1223,17 +1290,17 @@ class Utils(BaseUtils):
         if not isinstance(definition, str) or not definition.strip() or not labels_to_remove:
             return definition or ""
 
-        m = re.search(r"(^|\|)\s*References\s*:\s*", definition, flags=re.IGNORECASE)
+        m = tokenize_definition(definition).references_header()
         if not m:
             return definition
 
         # boundaries: start at 'References:' (not including preceding pipe), end at next pipe or EoS
-        start_refs = m.start(0)
+        start_refs = m.start
         # keep the exact prefix before the marker
         prefix = definition[:start_refs]
 
         # locate end of references segment content
-        seg_start = m.end()
+        seg_start = m.end
         next_pipe = definition.find("|", seg_start)
         if next_pipe < 0:
             refs_body = definition[seg_start:]
@@ -5,6 +5,9 @@ import json
 import logging
 import re
 
+from classes.bss_graph import BssGraph
+from classes.bss_definition_tokens import tokenize_definition
+from classes.bss_label import label_key, parse_label
 from classes.google_helpers import PROJECT_ID, REGION
 from classes.llm_client import ChatLlmClient, LlmClient
 
@@ -176,64 +179,34 @@ class BaseUtils():
 
         return out
 
+    def _bss_graph(self, bss_schema) -> BssGraph:
+        """
+        The document as a BssGraph (as is if it already is one); build it once
+        when several helpers read the same document.
+        """
+        if isinstance(bss_schema, BssGraph):
+            return bss_schema
+        return BssGraph(bss_schema if isinstance(bss_schema, dict) else {}, self)
+
+    # Label parsing lives in classes/bss_label.py (compiled patterns, cached per string).
+
     def _bss_section_for_label(self, label: str) -> str | None:
-        t = self._bss_label_type(label)
-        if not t:
+        if not isinstance(label, str):
             return None
-
-        mapping = {
-            "A": "A",
-            "UC": "UseCases",
-            "PROC": "Processes",
-            "COMP": "Components",
-            "ROLE": "Actors",
-            "UI": "UI",
-            "ENT": "Entities",
-            "INT": "Integrations",
-            "API": "APIs",
-            "NFR": "NFRs",
-        }
-        return mapping.get(t)
+        return parse_label(label).section
 
     def _is_bss_label(self, label: str) -> bool:
-        if not isinstance(label, str) or not label.strip():
+        if not isinstance(label, str):
             return False
-        s = label.strip()
-        if re.match(r"^A\d+_[A-Z0-9_]+$", s, flags=re.IGNORECASE):
-            return True
-        return re.match(r"^(UC|PROC|COMP|ROLE|UI|ENT|INT|API|NFR)-?\d+_[A-Z0-9_]+$", s, flags=re.IGNORECASE) is not None
+        return parse_label(label).is_label
 
     def _bss_label_type(self, label: str) -> str | None:
         if not isinstance(label, str):
             return None
-        s = label.strip()
-
-        if re.match(r"^A\d+_", s, flags=re.IGNORECASE):
-            return "A"
-
-        m = re.match(r"^(UC|PROC|COMP|ROLE|UI|ENT|INT|API|NFR)-?\d+_", s, flags=re.IGNORECASE)
-        if not m:
-            return None
-        return m.group(1).upper()
+        return parse_label(label).family
 
     def _bss_label_sort_key(self, label: str):
-        t = self._bss_label_type(label) or "ZZZ"
-        type_order = {
-            "A": 0,
-            "UC": 1,
-            "PROC": 2,
-            "COMP": 3,
-            "ROLE": 4,
-            "UI": 5,
-            "ENT": 6,
-            "INT": 7,
-            "API": 8,
-            "NFR": 9,
-            "ZZZ": 99,
-        }
-        m = re.match(r"^(A|UC|PROC|COMP|ROLE|UI|ENT|INT|API|NFR)-?(\d+)_", label.strip(), flags=re.IGNORECASE)
-        n = int(m.group(2)) if m else 10**9
-        return (type_order.get(t, 99), n, label)
+        return parse_label(label).sort_key
 
 
     def _extract_reference_labels_from_definition(self, definition: str, open_items: str = "") -> list[str]:
@@ -246,18 +219,10 @@ class BaseUtils():
         if not isinstance(open_items, str):
             open_items = "" if open_items is None else str(open_items)
 
-        text = f"{definition}\n{open_items}"
-
-        label_pattern = re.compile(
-            r"\b("
-            r"A\d+_[A-Z0-9_]+"
-            r"|(?:UC|PROC|COMP|ROLE|UI|ENT|INT|API|NFR)-?\d+_[A-Z0-9_]+"
-            r")\b",
-            flags=re.IGNORECASE,
-        )
-
-        # findall always returns a list, but we also guard with `or []`
-        found = label_pattern.findall(text)
+        # each text is scanned once per process (classes/bss_definition_tokens.py)
+        found = tokenize_definition(definition).refs
+        if open_items:
+            found += tokenize_definition(open_items).refs
         if not found:
             return []
 
@@ -265,14 +230,8 @@ class BaseUtils():
         seen: set[str] = set()
         out: list[str] = []
 
-        for raw in found:
-            label = raw.strip()
-            if not label:
-                continue
-            if not self._is_bss_label(label):
-                continue
-
-            key = label.upper()
+        for label in found:
+            key = label_key(label)
             if key in seen:
                 continue
             seen.add(key)
@@ -294,30 +253,8 @@ class BaseUtils():
         if not isinstance(definition, str) or not definition.strip():
             return {}
 
-        text = definition
-        header_re = re.compile(
-            r"(^|(?<!\\)\|)\s*("
-            r"Definition|Flow|Contract|Contracts|Snippets|Outcomes|Decision|Notes|References|Kind"
-            r")\s*:\s*",
-            flags=re.IGNORECASE,
-        )
-
-        matches = list(header_re.finditer(text))
-        if not matches:
-            # No structured segments → treat whole thing as 'definition'
-            return {"definition": text.strip()}
-
-        segments: dict[str, str] = {}
-        for i, m in enumerate(matches):
-            name_raw = (m.group(2) or "").strip()
-            key = name_raw.lower()
-            start = m.end()
-            end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
-            body = text[start:end].strip()
-            if body:
-                segments[key] = body
-
-        return segments
+        # headers: start of text or an *unescaped* pipe (see DefinitionTokens)
+        return dict(tokenize_definition(definition).segments)
 
     # -----------------------
     # LLM base plumbing
@@ -0,0 +1,516 @@
+# classes/bss_blob.py
+"""
+Project.bss_schema (BSS_STORAGE=blob) with partial writes.
+
+load() remembers a fingerprint per section entry (per label, per metadata
+key) of what it read. save() compares the document with it and sends one
+UPDATE of only what changed:
+
+    bss_schema = jsonb_set(bss_schema, '{Processes}',
+                           (bss_schema->'Processes' || <changed labels>) - <removed labels>)
+
+so a one-node edit, a new chat_queue or a ui_state change writes (and
+WAL-logs) a few KB instead of the whole document. Without a complete
+fingerprint for the project (nothing loaded yet in this process, or it was
+evicted) save() writes the whole document as before.
+
+The fingerprints describe the stored document only while the project's
+version is the one they were taken at: with expected_version (see
+classes/bss_cache.py) a concurrent write turns into BssVersionConflict
+instead of a patch applied to a different document.
+
+With BSS_UI_VIEW, project.bss_ui holds the redacted items of the document
+({"format": ..., "items": {label: item}}), current while bss_ui_version is
+the project's version. Every save patches it with the changed labels only,
+in the same UPDATE; a metadata write keeps it current.
+
+The reference index (bss_ref, see classes/bss_ref_index.py) follows the same
+way: a partial write replaces the rows of the changed labels, a whole write
+(or a save over an index that is not current) rebuilds them, in the same
+transaction.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from classes.base_utils import BaseUtils
+from classes.bss_cache import BssVersionConflict
+from classes.bss_ref_index import load_bss_referencing, write_bss_refs
+from classes.bss_ui_view import UI_VIEW_FORMAT, blob_ui_view
+
+
+BSS_BLOB_SNAPSHOT_PROJECTS = int(os.getenv("BSS_BLOB_SNAPSHOT_PROJECTS", "256"))
+
+METADATA_KEY = "metadata"
+
+# label syntax and _iter_bss_items only; no state
+_LABELS = BaseUtils()
+
+# top-level key -> ("d", {sub key: fingerprint}) for dicts, ("v", fingerprint) otherwise
+Entry = Tuple[str, Any]
+
+
+def _fp(value: Any) -> str:
+    blob = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+def _entry(value: Any) -> Entry:
+    if isinstance(value, dict):
+        return ("d", {k: _fp(v) for k, v in value.items()})
+    return ("v", _fp(value))
+
+
+class _Snapshot:
+    __slots__ = ("complete", "entries", "version", "ui_valid", "refs_valid")
+
+    def __init__(
+        self,
+        complete: bool,
+        entries: Dict[str, Entry],
+        version: int,
+        ui_valid: bool = False,
+        refs_valid: bool = False,
+    ):
+        # complete: entries cover every top-level key of the stored document
+        self.complete = complete
+        self.entries = entries
+        # project.version the entries describe
+        self.version = version
+        # bss_ui was current at that version
+        self.ui_valid = ui_valid
+        # so were the bss_ref rows
+        self.refs_valid = refs_valid
+
+
+class _SnapshotCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, _Snapshot]" = OrderedDict()
+
+    def get(self, project_id: str) -> Optional[_Snapshot]:
+        with self._lock:
+            snap = self._items.get(project_id)
+            if snap is not None:
+                self._items.move_to_end(project_id)
+            return snap
+
+    def put(self, project_id: str, snap: _Snapshot) -> None:
+        with self._lock:
+            self._items[project_id] = snap
+            self._items.move_to_end(project_id)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def drop(self, project_id: str) -> None:
+        with self._lock:
+            self._items.pop(project_id, None)
+
+
+_SNAPSHOTS = _SnapshotCache(BSS_BLOB_SNAPSHOT_PROJECTS)
+
+
+def _patch_expression(
+    entries: Dict[str, Entry], content: Dict[str, Any], removed: List[str]
+) -> Tuple[str, Dict[str, Any], Dict[str, Entry]]:
+    """
+    SQL expression turning the stored bss_schema (as fingerprinted in
+    `entries`) into `content`, for the keys of `content` plus the top-level
+    keys in `removed`. Returns (expression, params, new entries); the
+    expression is "bss_schema" when nothing changed.
+    Every key is touched once, so each step can read the old value from the
+    column itself.
+    """
+    expr = "bss_schema"
+    params: Dict[str, Any] = {}
+    new_entries: Dict[str, Entry] = {}
+
+    for i, (key, value) in enumerate(content.items()):
+        old = entries.get(key)
+        new = _entry(value)
+        new_entries[key] = new
+        if old == new:
+            continue
+        k = f"k{i}"
+        params[k] = key
+        if old is not None and old[0] == "d" and new[0] == "d":
+            changed = {sub: value[sub] for sub, fp in new[1].items() if old[1].get(sub) != fp}
+            gone = [sub for sub in old[1] if sub not in new[1]]
+            params[f"v{i}"] = json.dumps(changed, ensure_ascii=False)
+            params[f"d{i}"] = json.dumps(gone, ensure_ascii=False)
+            current = (
+                f"(CASE WHEN jsonb_typeof(bss_schema -> CAST(:{k} AS text)) = 'object' "
+                f"THEN bss_schema -> CAST(:{k} AS text) ELSE '{{}}'::jsonb END)"
+            )
+            merged = (
+                f"(({current} || CAST(:v{i} AS jsonb)) "
+                f"- ARRAY(SELECT jsonb_array_elements_text(CAST(:d{i} AS jsonb))))"
+            )
+            expr = f"jsonb_set({expr}, ARRAY[CAST(:{k} AS text)], {merged}, true)"
+        else:
+            params[f"v{i}"] = json.dumps(value, ensure_ascii=False)
+            expr = f"jsonb_set({expr}, ARRAY[CAST(:{k} AS text)], CAST(:v{i} AS jsonb), true)"
+
+    for j, key in enumerate(removed):
+        params[f"r{j}"] = key
+        expr = f"({expr}) - CAST(:r{j} AS text)"
+
+    return expr, params, new_entries
+
+
+def _item_changes(
+    entries: Dict[str, Entry], new_entries: Dict[str, Entry], content: Dict[str, Any], removed: List[str]
+) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Items (by label) whose fingerprint changed between the stored document
+    (`entries`) and `content`, and labels no longer in `content`; items
+    are found the way _iter_bss_items() walks a document.
+    """
+    changed: Dict[str, Any] = {}
+    dropped = set()
+    present = set()
+    for key in list(content) + removed:
+        if key.lower() == METADATA_KEY:
+            continue
+        old, new = entries.get(key), new_entries.get(key)
+        if _LABELS._is_bss_label(key):
+            if new is None:
+                dropped.add(key)
+            else:
+                present.add(key)
+                if old != new:
+                    changed[key] = content[key]
+            continue
+        old_subs = old[1] if old is not None and old[0] == "d" else {}
+        new_subs = new[1] if new is not None and new[0] == "d" else {}
+        for label, fp in new_subs.items():
+            if _LABELS._is_bss_label(label):
+                present.add(label)
+                if old_subs.get(label) != fp:
+                    changed[label] = content[key][label]
+        dropped.update(label for label in old_subs if label not in new_subs and _LABELS._is_bss_label(label))
+    # a label moved to another section is still there
+    return changed, sorted(dropped - present)
+
+
+class BssBlobStore:
+    def __init__(
+        self,
+        SessionFactory: Callable[[], Session],
+        redact_item: Optional[Callable[[Any], Optional[dict]]] = None,
+    ):
+        self.SessionFactory = SessionFactory
+        # item -> redacted item (None: not shown); None: no UI view is kept
+        self.redact_item = redact_item
+
+    # ---- reads ----
+
+    def load(self, project_id: str) -> dict:
+        return self.load_versioned(project_id)[0]
+
+    def load_versioned(self, project_id: str) -> Tuple[dict, int]:
+        project_id = str(project_id)
+        session = self.SessionFactory()
+        try:
+            row = session.execute(
+                text(
+                    "SELECT bss_schema, version, "
+                    "COALESCE(bss_ui_version = version AND bss_ui ->> 'format' = :fmt, false), "
+                    "COALESCE(bss_ref_version = version, false) "
+                    "FROM project WHERE project_id = CAST(:pid AS uuid)"
+                ),
+                {"pid": project_id, "fmt": str(UI_VIEW_FORMAT)},
+            ).one_or_none()
+        finally:
+            session.close()
+        if row is None:
+            raise ValueError(f"Project not found: {project_id}")
+        content = row[0] if isinstance(row[0], dict) else {}
+        _SNAPSHOTS.put(
+            project_id, _Snapshot(True, {k: _entry(v) for k, v in content.items()}, row[1], row[2], row[3])
+        )
+        return content or {}, row[1]
+
+    def load_ui(self, project_id: str) -> Optional[Dict[str, Optional[dict]]]:
+        """
+        {label: redacted item} from bss_ui. When it is not current (written
+        before BSS_UI_VIEW, by an older UI_VIEW_FORMAT, or by another writer)
+        it is rebuilt from the document and stored, without a new version.
+        None without a redactor.
+        """
+        if self.redact_item is None:
+            return None
+        project_id = str(project_id)
+        session = self.SessionFactory()
+        try:
+            row = session.execute(
+                text(
+                    "SELECT version, bss_ui_version, bss_ui -> 'format', bss_ui -> 'items' "
+                    "FROM project WHERE project_id = CAST(:pid AS uuid)"
+                ),
+                {"pid": project_id},
+            ).one_or_none()
+        finally:
+            session.close()
+        if row is None:
+            raise ValueError(f"Project not found: {project_id}")
+        if row[1] == row[0] and row[2] == UI_VIEW_FORMAT and isinstance(row[3], dict):
+            return row[3]
+
+        content, version = self.load_versioned(project_id)
+        items = self._ui_items(content)
+        session = self.SessionFactory()
+        try:
+            stored = session.execute(
+                text(
+                    "UPDATE project SET bss_ui = CAST(:ui AS jsonb), bss_ui_version = version "
+                    "WHERE project_id = CAST(:pid AS uuid) AND version = :version RETURNING version"
+                ),
+                {"pid": project_id, "ui": json.dumps(blob_ui_view(items), ensure_ascii=False), "version": version},
+            ).scalar()
+            session.commit()
+        finally:
+            session.close()
+        snap = _SNAPSHOTS.get(project_id)
+        if stored is not None and snap is not None and snap.version == version:
+            snap.ui_valid = True
+        return items
+
+    def current_version(self, project_id: str) -> int:
+        project_id = str(project_id)
+        session = self.SessionFactory()
+        try:
+            version = session.execute(
+                text("SELECT version FROM project WHERE project_id = CAST(:pid AS uuid)"),
+                {"pid": project_id},
+            ).scalar()
+        finally:
+            session.close()
+        if version is None:
+            raise ValueError(f"Project not found: {project_id}")
+        return version
+
+    def load_referencing(self, project_id: str, version: int, labels: Iterable[str]) -> Optional[Dict[str, List[str]]]:
+        """
+        bss_ref rows of `labels` at `version` (see classes/bss_ref_index.py).
+        """
+        session = self.SessionFactory()
+        try:
+            return load_bss_referencing(session, str(project_id), version, labels)
+        finally:
+            session.close()
+
+    def load_metadata(self, project_id: str) -> dict:
+        """
+        {"metadata": {...}} (or {}), reading only that key.
+        """
+        project_id = str(project_id)
+        session = self.SessionFactory()
+        try:
+            row = session.execute(
+                text(
+                    "SELECT bss_schema ? 'metadata', bss_schema -> 'metadata', version "
+                    "FROM project WHERE project_id = CAST(:pid AS uuid)"
+                ),
+                {"pid": project_id},
+            ).one_or_none()
+        finally:
+            session.close()
+        if row is None:
+            raise ValueError(f"Project not found: {project_id}")
+
+        snap = _SNAPSHOTS.get(project_id)
+        if snap is None or snap.version != row[2]:
+            snap = _Snapshot(False, {}, row[2])
+            _SNAPSHOTS.put(project_id, snap)
+        if row[0]:
+            snap.entries[METADATA_KEY] = _entry(row[1])
+            return {METADATA_KEY: row[1]}
+        snap.entries.pop(METADATA_KEY, None)
+        return {}
+
+    # ---- writes ----
+
+    def save(self, project_id: str, content: dict, expected_version: Optional[int] = None) -> int:
+        """
+        Replace the document with `content` (top-level keys it lacks are
+        removed). With expected_version, only if the stored version is still
+        that one (else BssVersionConflict). Returns the new version.
+        A partial write always checks the version its fingerprints are from.
+        """
+        project_id = str(project_id)
+        snap = _SNAPSHOTS.get(project_id)
+        if snap is None or not snap.complete:
+            return self._write_whole(project_id, content, expected_version)
+        if expected_version is not None and expected_version != snap.version:
+            _SNAPSHOTS.drop(project_id)
+            return self._write_whole(project_id, content, expected_version)
+
+        removed = [key for key in snap.entries if key not in content]
+        expr, params, new_entries = _patch_expression(snap.entries, content, removed)
+        if expr == "bss_schema":
+            # nothing to write; the version still has to match
+            version = self.current_version(project_id)
+            if version != snap.version:
+                _SNAPSHOTS.drop(project_id)
+                raise BssVersionConflict(f"Project {project_id} is at version {version}, not {snap.version}")
+            return version
+
+        changed, dropped = _item_changes(snap.entries, new_entries, content, removed)
+        if self.redact_item is not None and snap.ui_valid:
+            ui_assignment, ui_params = self._ui_patch(changed, dropped)
+        else:
+            ui_assignment, ui_params = self._ui_whole(content)
+        # bss_ref rows of the changed labels, or all of them when they were not current
+        refs = (changed, dropped, False) if snap.refs_valid else (dict(_LABELS._iter_bss_items(content)), [], True)
+        version = self._execute(
+            project_id,
+            f"bss_schema = {expr}, {ui_assignment}, bss_ref_version = version + 1",
+            {**params, **ui_params},
+            snap.version,
+            refs,
+        )
+        _SNAPSHOTS.put(project_id, _Snapshot(True, new_entries, version, self.redact_item is not None, True))
+        return version
+
+    def save_metadata(self, project_id: str, content: dict) -> int:
+        """
+        Persist the "metadata" key of `content` only, whatever the version.
+        Returns the new version.
+        """
+        project_id = str(project_id)
+        snap = _SNAPSHOTS.get(project_id) or _Snapshot(False, {}, -1)
+        if METADATA_KEY in content:
+            expr, params, new_entries = _patch_expression(snap.entries, {METADATA_KEY: content[METADATA_KEY]}, [])
+        else:
+            expr, params, new_entries = _patch_expression(snap.entries, {}, [METADATA_KEY])
+        if expr == "bss_schema":
+            return self.current_version(project_id)
+
+        # the items did not change: a current bss_ui stays current
+        version = self._execute(
+            project_id,
+            f"bss_schema = {expr}, "
+            "bss_ui_version = CASE WHEN bss_ui_version = version THEN version + 1 END, "
+            "bss_ref_version = CASE WHEN bss_ref_version = version THEN version + 1 END",
+            params,
+            None,
+        )
+        entries = dict(snap.entries)
+        entries.pop(METADATA_KEY, None)
+        entries.update(new_entries)
+        if version == snap.version + 1:
+            _SNAPSHOTS.put(project_id, _Snapshot(snap.complete, entries, version, snap.ui_valid, snap.refs_valid))
+        else:
+            # someone else wrote in between: only the metadata entry is known
+            _SNAPSHOTS.put(project_id, _Snapshot(False, new_entries, version))
+        return version
+
+    # ---- helpers ----
+
+    def _write_whole(self, project_id: str, content: dict, expected_version: Optional[int]) -> int:
+        ui_assignment, ui_params = self._ui_whole(content)
+        version = self._execute(
+            project_id,
+            f"bss_schema = CAST(:content AS jsonb), {ui_assignment}, bss_ref_version = version + 1",
+            {"content": json.dumps(content, ensure_ascii=False), **ui_params},
+            expected_version,
+            (dict(_LABELS._iter_bss_items(content)), [], True),
+        )
+        _SNAPSHOTS.put(
+            project_id,
+            _Snapshot(True, {k: _entry(v) for k, v in content.items()}, version, self.redact_item is not None, True),
+        )
+        return version
+
+    def _ui_items(self, content: dict) -> Dict[str, dict]:
+        items: Dict[str, dict] = {}
+        for label, item in _LABELS._iter_bss_items(content):
+            redacted = self.redact_item(item)
+            if redacted is not None:
+                items[label] = redacted
+        return items
+
+    def _ui_whole(self, content: dict) -> Tuple[str, Dict[str, Any]]:
+        """
+        Assignment writing the whole bss_ui of `content` (clearing it
+        without a redactor, so it never outlives the document).
+        """
+        if self.redact_item is None:
+            return "bss_ui = NULL, bss_ui_version = NULL", {}
+        return (
+            "bss_ui = CAST(:ui AS jsonb), bss_ui_version = version + 1",
+            {"ui": json.dumps(blob_ui_view(self._ui_items(content)), ensure_ascii=False)},
+        )
+
+    def _ui_patch(self, changed: Dict[str, Any], dropped: List[str]) -> Tuple[str, Dict[str, Any]]:
+        """
+        Assignment applying changed/dropped labels to a current bss_ui.
+        """
+        current = "bss_ui_version = version"
+        version = f"bss_ui_version = CASE WHEN {current} THEN version + 1 END"
+        items: Dict[str, dict] = {}
+        gone = list(dropped)
+        for label, item in changed.items():
+            redacted = self.redact_item(item)
+            if redacted is None:
+                gone.append(label)
+            else:
+                items[label] = redacted
+        if not items and not gone:
+            return version, {}
+        merged = (
+            "((bss_ui -> 'items') || CAST(:ui_set AS jsonb)) "
+            "- ARRAY(SELECT jsonb_array_elements_text(CAST(:ui_del AS jsonb)))"
+        )
+        return (
+            f"bss_ui = CASE WHEN {current} THEN jsonb_set(bss_ui, '{{items}}', {merged}) END, {version}",
+            {"ui_set": json.dumps(items, ensure_ascii=False), "ui_del": json.dumps(gone, ensure_ascii=False)},
+        )
+
+    def _execute(
+        self,
+        project_id: str,
+        assignment: str,
+        params: Dict[str, Any],
+        expected_version: Optional[int],
+        refs: Optional[Tuple[Dict[str, Any], List[str], bool]] = None,
+    ) -> int:
+        """
+        Run the UPDATE. refs: (items, gone, whole) for write_bss_refs(), in
+        the same transaction once the UPDATE went through.
+        """
+        sql = (
+            f"UPDATE project SET {assignment}, version = version + 1, updated_at = now() "
+            "WHERE project_id = CAST(:pid AS uuid)"
+        )
+        params = {"pid": project_id, **params}
+        if expected_version is not None:
+            sql += " AND version = :expected"
+            params["expected"] = expected_version
+        session = self.SessionFactory()
+        try:
+            try:
+                version = session.execute(text(sql + " RETURNING version"), params).scalar()
+                if version is not None and refs is not None:
+                    write_bss_refs(session, project_id, *refs)
+                session.commit()
+            except Exception:
+                # the stored document is unknown now: next save writes it whole
+                _SNAPSHOTS.drop(project_id)
+                raise
+        finally:
+            session.close()
+        if version is None:
+            _SNAPSHOTS.drop(project_id)
+            current = self.current_version(project_id)   # ValueError if the project is gone
+            raise BssVersionConflict(f"Project {project_id} is at version {current}, not {expected_version}")
+        return version
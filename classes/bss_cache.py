@@ -0,0 +1,217 @@
+# classes/bss_cache.py
+"""
+In-process cache of parsed BSS documents, with optimistic concurrency.
+
+  - project.version is bumped by every BSS write (blob or nodes storage).
+  - BssSchemaCache keeps the last loaded/saved document of the
+    BSS_SCHEMA_CACHE_PROJECTS most recently used projects, with its version.
+  - CachedBssStore.load() serves the cached document when the stored
+    version is still the cached one: one tiny SELECT instead of reading and
+    parsing the whole document (BSS_SCHEMA_CACHE_VERIFY=false skips even
+    that, for a single worker owning the database).
+  - CachedBssStore.load_versioned() returns the version with the document,
+    and save() is a compare-and-swap on the version the caller passes back
+    (the one its own copy was loaded at, never the cache's: the entry may be
+    evicted or reloaded by another job meanwhile). If the project was written
+    in between, the cache entry is dropped and BssVersionConflict is raised;
+    the caller reloads and re-applies its change (see Backend._with_cas_retry).
+
+Handlers mutate the documents they get, so the cache hands out copies and
+keeps a copy of what is saved.
+"""
+
+import copy
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger("kahuna_backend")
+
+BSS_SCHEMA_CACHE_PROJECTS = int(os.getenv("BSS_SCHEMA_CACHE_PROJECTS", "64"))
+BSS_SCHEMA_CACHE_VERIFY = os.getenv("BSS_SCHEMA_CACHE_VERIFY", "true").strip().lower() in ("1", "true", "yes")
+# Attempts of a cheap edit handler whose save lost the race
+BSS_CAS_RETRIES = int(os.getenv("BSS_CAS_RETRIES", "3"))
+
+PROJECT_VERSION_DDL = [
+    "ALTER TABLE project ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0",
+]
+
+
+class BssVersionConflict(Exception):
+    """
+    The project's BSS document changed since it was loaded.
+    """
+
+
+def migrate_project_version_column(engine: Engine) -> None:
+    with engine.begin() as conn:
+        for stmt in PROJECT_VERSION_DDL:
+            conn.execute(text(stmt))
+
+
+_SCALARS = (str, bool, int, float, type(None))
+
+
+def copy_document(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Deep copy of a BSS document; items holding only scalar fields (nearly all
+    of them) are copied with dict(), which is much cheaper than deepcopy.
+    """
+    out: Dict[str, Any] = {}
+    for key, value in doc.items():
+        if isinstance(value, dict) and key != "metadata":
+            out[key] = {
+                label: dict(item)
+                if isinstance(item, dict) and all(isinstance(v, _SCALARS) for v in item.values())
+                else copy.deepcopy(item)
+                for label, item in value.items()
+            }
+        else:
+            out[key] = copy.deepcopy(value)
+    return out
+
+
+class BssSchemaCache:
+    def __init__(self, max_projects: int = BSS_SCHEMA_CACHE_PROJECTS):
+        self.max_projects = max_projects
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, Tuple[int, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+
+    def get(self, project_id: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        with self._lock:
+            item = self._items.get(project_id)
+            if item is not None:
+                self._items.move_to_end(project_id)
+            return item
+
+    def put(self, project_id: str, version: int, doc: Dict[str, Any]) -> None:
+        if self.max_projects <= 0:
+            return
+        with self._lock:
+            self._items[project_id] = (version, doc)
+            self._items.move_to_end(project_id)
+            while len(self._items) > self.max_projects:
+                self._items.popitem(last=False)
+
+    def drop(self, project_id: str) -> None:
+        with self._lock:
+            self._items.pop(project_id, None)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "projects": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "conflicts": self.conflicts,
+            }
+
+
+BSS_SCHEMA_CACHE = BssSchemaCache()
+
+
+class CachedBssStore:
+    """
+    Same interface as BssBlobStore / BssNodeStore (load, save, load_ui,
+    load_referencing, load_metadata, save_metadata), in front of one of them.
+    """
+
+    def __init__(self, store, cache: BssSchemaCache = BSS_SCHEMA_CACHE, verify: bool = BSS_SCHEMA_CACHE_VERIFY):
+        self.store = store
+        self.cache = cache
+        self.verify = verify
+
+    def load(self, project_id: str) -> dict:
+        return self.load_versioned(project_id)[0]
+
+    def load_versioned(self, project_id: str) -> Tuple[dict, int]:
+        """
+        (document, version it was loaded at); pass the version to save().
+        """
+        project_id = str(project_id)
+        cached = self.cache.get(project_id)
+        if cached is not None and (not self.verify or self.store.current_version(project_id) == cached[0]):
+            self.cache.hits += 1
+            return copy_document(cached[1]), cached[0]
+
+        self.cache.misses += 1
+        doc, version = self.store.load_versioned(project_id)
+        self.cache.put(project_id, version, copy_document(doc))
+        return doc, version
+
+    def save(self, project_id: str, content: dict, expected_version: int) -> int:
+        """
+        Write `content` if the project is still at expected_version; returns
+        the new version.
+        """
+        project_id = str(project_id)
+        if expected_version is None:
+            raise ValueError(f"Saving project {project_id} needs the version its document was loaded at")
+        try:
+            version = self.store.save(project_id, content, expected_version=expected_version)
+        except BssVersionConflict:
+            self.cache.conflicts += 1
+            self.cache.drop(project_id)
+            raise
+        except Exception:
+            self.cache.drop(project_id)
+            raise
+        self.cache.put(project_id, version, copy_document(content))
+        return version
+
+    def load_ui(self, project_id: str) -> Optional[dict]:
+        """
+        {label: redacted item} from the store's persisted UI view, or None
+        when it has none that is current (see classes/bss_ui_view.py).
+        """
+        return self.store.load_ui(str(project_id))
+
+    def load_referencing(self, project_id: str, version: int, labels) -> Optional[Dict[str, list]]:
+        """
+        Labels mentioning each of `labels`, from the stored reference index at
+        `version`; None when it is not current (see classes/bss_ref_index.py).
+        """
+        return self.store.load_referencing(str(project_id), version, labels)
+
+    def load_metadata(self, project_id: str) -> dict:
+        project_id = str(project_id)
+        cached = self.cache.get(project_id)
+        if cached is not None and "metadata" in cached[1] and (
+            not self.verify or self.store.current_version(project_id) == cached[0]
+        ):
+            self.cache.hits += 1
+            return {"metadata": copy.deepcopy(cached[1]["metadata"])}
+        return self.store.load_metadata(project_id)
+
+    def save_metadata(self, project_id: str, content: dict) -> None:
+        """
+        Not a compare-and-swap (it only replaces metadata keys), but it bumps
+        the version; the cached document follows if nobody else wrote.
+        """
+        project_id = str(project_id)
+        cached = self.cache.get(project_id)
+        try:
+            version = self.store.save_metadata(project_id, content)
+        except Exception:
+            self.cache.drop(project_id)
+            raise
+        if cached is None or version == cached[0]:
+            return   # nothing cached, or nothing written
+        if version != cached[0] + 1:
+            self.cache.drop(project_id)
+            return
+        doc = dict(cached[1])
+        if "metadata" in content:
+            doc["metadata"] = copy.deepcopy(content["metadata"])
+        else:
+            doc.pop("metadata", None)
+        self.cache.put(project_id, version, doc)
@@ -2,6 +2,7 @@
 
 
 from classes.base_utils import BaseUtils
+from classes.bss_graph import BssGraph
 from chat_prompts.chat_prompts import ASK_LOG_SYNTH_PROMPT, CALL_SEQUENCE_EXTRACTOR_PROMPT, COMP_OWNERSHIP_PROMPT, ENT_ENT_DEP_EXTRACTOR_PROMPT, PROC_PROC_DEP_EXTRACTOR_PROMPT, UI_UI_DEP_EXTRACTOR_PROMPT
 
 
@@ -260,11 +261,10 @@ class BssChatSupport(BaseUtils):
             (("ENT",  "ENT"),  ENT_ENT_DEP_EXTRACTOR_PROMPT),
         ]
 
-        import copy
         import asyncio
 
-        # Read-only snapshot shared by all analysis steps
-        schema_snapshot = copy.deepcopy(bss_schema)
+        # Read-only snapshot shared by all analysis steps, parsed once
+        schema_snapshot = self._bss_graph(bss_schema)
 
         # ------------------------------------------------------------------
         # Parallel analysis on the snapshot (LLM calls in threads)
@@ -469,7 +469,7 @@ class BssChatSupport(BaseUtils):
 
     def _refine_int_proc_ui_api_cross_relationships(
         self,
-        bss_schema: dict,
+        bss_schema: dict | BssGraph,
         draft_roots: set[str],
         model_name: str | None = None,
     ) -> tuple[list[tuple[str, str]], set[str], set[str], float, list[str]]:
@@ -495,29 +495,19 @@ class BssChatSupport(BaseUtils):
         - unknown_callers: labels for which the LLM emitted `LABEL,UNKNOWN`
           (we create sys: open_items for these later; no edges are added)
         """
-        if not isinstance(bss_schema, dict) or not draft_roots:
+        if not isinstance(bss_schema, (dict, BssGraph)) or not draft_roots:
             return [], set(), set(), 0.0, []
 
         # 1) Flatten + type map
-        flat: dict[str, dict] = {}
-        label_types: dict[str, str] = {}
-
-        for label, item in self._iter_bss_items(bss_schema):
-            norm = self._normalize_bss_item(item)
-            if norm.get("cancelled") is True:
-                continue
-            flat[label] = norm
-            t = self._bss_label_type(label)
-            if t:
-                label_types[label] = t
+        graph = self._bss_graph(bss_schema)
+        flat = graph.flat()
+        label_types = graph.label_types
 
         if not flat:
             return [], set(), set(), 0.0, []
 
         core_families = {"INT", "PROC", "UI", "API"}
-        core_labels: set[str] = {
-            lbl for lbl, t in label_types.items() if t in core_families
-        }
+        core_labels: set[str] = graph.labels_of_type(*core_families)
         if not core_labels:
              return [], set(), set(), 0.0, []
 
@@ -526,26 +516,13 @@ class BssChatSupport(BaseUtils):
         if not modified_core:
              return [], set(), set(), 0.0, []
 
-        canonical_by_upper = {lbl.upper(): lbl for lbl in flat.keys()}
-
-        def _parse_csv_labels(csv_str: str) -> set[str]:
-            out: set[str] = set()
-            for part in (csv_str or "").split(","):
-                p = (part or "").strip()
-                if not p:
-                    continue
-                canon = canonical_by_upper.get(p.upper())
-                if canon:
-                    out.add(canon)
-            return out
+        canonical_by_upper = graph.canonical_by_upper
 
         # 2) Neighbours within INT/PROC/UI/API
         neighbours: dict[str, set[str]] = {lbl: set() for lbl in core_labels}
         for lbl in core_labels:
-            norm = flat[lbl]
-            deps = _parse_csv_labels(norm.get("dependencies", ""))
-            depants = _parse_csv_labels(norm.get("dependants", ""))
-            for other in deps | depants:
+            node = graph.active[lbl]
+            for other in node.dependencies | node.dependants:
                 if other in core_labels and other != lbl:
                     neighbours[lbl].add(other)
 
@@ -573,16 +550,9 @@ class BssChatSupport(BaseUtils):
         info_a_labels: set[str] = set()
         info_comp_labels: set[str] = set()
 
-        for label, norm in flat.items():
+        for label in graph.labels_of_type("A", "COMP"):
             t = label_types.get(label)
-            if t not in {"A", "COMP"}:
-                continue
-            refs = set(
-                self._extract_reference_labels_from_definition(
-                    norm.get("definition", ""),
-                    norm.get("open_items", ""),
-                )
-            )
+            refs = set(graph.active[label].refs)
             if not refs & data_label_set:
                 continue
             if t == "A":
@@ -607,7 +577,7 @@ class BssChatSupport(BaseUtils):
             return "\n".join(kept).strip()
 
         info_lines: list[str] = []
-        for lbl in sorted(info_a_labels, key=self._bss_label_sort_key):
+        for lbl in graph.sorted_labels(info_a_labels):
             defn = (flat[lbl].get("definition") or "").strip()
             open_items = (flat[lbl].get("open_items") or "").strip()
             snippet_def = _extract_relevant_snippets(defn, data_label_set)
@@ -619,7 +589,7 @@ class BssChatSupport(BaseUtils):
             info_lines.append(combined)
             info_lines.append("")
 
-        for lbl in sorted(info_comp_labels, key=self._bss_label_sort_key):
+        for lbl in graph.sorted_labels(info_comp_labels):
             defn = (flat[lbl].get("definition") or "").strip()
             open_items = (flat[lbl].get("open_items") or "").strip()
             snippet_def = _extract_relevant_snippets(defn, data_label_set)
@@ -636,10 +606,9 @@ class BssChatSupport(BaseUtils):
         # 6) Build Section B data (INT/PROC/UI/API nodes)
         data_lines: list[str] = []
 
-        for lbl in sorted(data_labels, key=self._bss_label_sort_key):
+        for lbl in graph.sorted_labels(data_labels):
             t = label_types.get(lbl, "")
-            norm = flat.get(lbl, {})
-            segs = self._split_definition_segments(norm.get("definition", ""))
+            segs = graph.active[lbl].segments
 
             data_lines.append(lbl)
             data_lines.append(f"Type: {t}")
@@ -740,7 +709,7 @@ class BssChatSupport(BaseUtils):
 
     def _reorient_internal_relationships_for_family_pair(
         self,
-        bss_schema: dict,
+        bss_schema: dict | BssGraph,
         draft_roots: set[str],
         family: tuple[str, str],
         prompt_template: str,
@@ -758,7 +727,7 @@ class BssChatSupport(BaseUtils):
 
         This function does NOT mutate bss_schema; orientation is applied later.
         """
-        if not isinstance(bss_schema, dict) or not draft_roots:
+        if not isinstance(bss_schema, (dict, BssGraph)) or not draft_roots:
             return [], [], 0.0
 
         fam_a, fam_b = family
@@ -766,26 +735,15 @@ class BssChatSupport(BaseUtils):
         fam_b = (fam_b or "").upper()
 
         # 1) Flatten + type map
-        flat: dict[str, dict] = {}
-        label_types: dict[str, str] = {}
-
-        for label, item in self._iter_bss_items(bss_schema):
-            norm = self._normalize_bss_item(item)
-            if norm.get("cancelled") is True:
-                continue
-            flat[label] = norm
-            t = self._bss_label_type(label)
-            if t:
-                label_types[label] = t
+        graph = self._bss_graph(bss_schema)
+        flat = graph.flat()
+        label_types = graph.label_types
 
         if not flat:
             return [], [], 0.0
 
         # Labels belonging to either family
-        family_labels: set[str] = {
-            lbl for lbl, t in label_types.items()
-            if t in (fam_a, fam_b)
-        }
+        family_labels: set[str] = graph.labels_of_type(fam_a, fam_b)
         if not family_labels:
             return [], [], 0.0
 
@@ -793,26 +751,13 @@ class BssChatSupport(BaseUtils):
         if not modified_family:
             return [], [], 0.0
 
-        canonical_by_upper = {lbl.upper(): lbl for lbl in flat.keys()}
-
-        def _parse_csv_labels(csv_str: str) -> set[str]:
-            out: set[str] = set()
-            for part in (csv_str or "").split(","):
-                p = (part or "").strip()
-                if not p:
-                    continue
-                canon = canonical_by_upper.get(p.upper())
-                if canon:
-                    out.add(canon)
-            return out
+        canonical_by_upper = graph.canonical_by_upper
 
         # Neighbours restricted to family_labels
         neighbours: dict[str, set[str]] = {lbl: set() for lbl in family_labels}
         for lbl in family_labels:
-            norm = flat[lbl]
-            deps = _parse_csv_labels(norm.get("dependencies", ""))
-            depants = _parse_csv_labels(norm.get("dependants", ""))
-            for other in deps | depants:
+            node = graph.active[lbl]
+            for other in node.dependencies | node.dependants:
                 if other in family_labels and other != lbl:
                     neighbours[lbl].add(other)
 
@@ -827,8 +772,7 @@ class BssChatSupport(BaseUtils):
             seg_refs_by_seg,
             label_refs,
         ) = self._collect_segment_refs_for_family_labels(
-            flat,
-            label_types,
+            graph,
             family_labels,
         )
 
@@ -866,10 +810,10 @@ class BssChatSupport(BaseUtils):
         for pair in sorted(
             decision_pairs,
             key=lambda p: tuple(
-                sorted(tuple(p), key=self._bss_label_sort_key)
+                sorted(tuple(p), key=graph.sort_key)
             ),
         ):
-            a, b = sorted(tuple(pair), key=self._bss_label_sort_key)
+            a, b = graph.sorted_labels(pair)
             lines.append(f"{a}, {b}")
 
         # 3.b) Full descriptions for all labels involved in any pair
@@ -881,7 +825,7 @@ class BssChatSupport(BaseUtils):
         lines.append("")
         lines.append("### Items descriptions:")
 
-        for lbl in sorted(involved_labels, key=self._bss_label_sort_key):
+        for lbl in graph.sorted_labels(involved_labels):
             t = label_types.get(lbl)
             if t not in (fam_a, fam_b):
                 continue
@@ -978,8 +922,7 @@ class BssChatSupport(BaseUtils):
 
     def _collect_segment_refs_for_family_labels(
         self,
-        flat: dict[str, dict],
-        label_types: dict[str, str],
+        graph: BssGraph,
         family_labels: set[str],
     ) -> tuple[dict, dict, dict]:
         """
@@ -1000,10 +943,10 @@ class BssChatSupport(BaseUtils):
         label_refs: dict[str, set] = {}
 
         for lbl in family_labels:
-            norm = flat.get(lbl) or {}
-            definition = (norm.get("definition") or "").strip()
+            node = graph.active.get(lbl)
+            definition = ((node.item.get("definition") if node else "") or "").strip()
 
-            segs = self._split_definition_segments(definition)
+            segs = node.segments if node else {}
             if not segs:
                 segs = {"definition": definition}
 
@@ -1338,7 +1281,7 @@ class BssChatSupport(BaseUtils):
 
     def _resolve_duplicate_comp_ownership(
         self,
-        bss_schema: dict,
+        bss_schema: dict | BssGraph,
         draft_roots: set[str],
         model_name: str | None = None,
     ) -> tuple[list[tuple[str, str]], float]:
@@ -1355,26 +1298,18 @@ class BssChatSupport(BaseUtils):
 
         Returns: (ownership_rows, extra_cost) and does NOT mutate bss_schema.
         """
-        if not isinstance(bss_schema, dict):
+        if not isinstance(bss_schema, (dict, BssGraph)):
             return [], 0.0
 
         # 1) Flatten + type map
-        flat: dict[str, dict] = {}
-        label_types: dict[str, str] = {}
-
-        for label, item in self._iter_bss_items(bss_schema):
-            norm = self._normalize_bss_item(item)
-            if norm.get("cancelled") is True:
-                continue
-            flat[label] = norm
-            t = self._bss_label_type(label)
-            if t:
-                label_types[label] = t
+        graph = self._bss_graph(bss_schema)
+        flat = graph.flat()
+        label_types = graph.label_types
 
         if not flat:
             return [], 0.0
 
-        comp_labels: set[str] = {lbl for lbl, t in label_types.items() if t == "COMP"}
+        comp_labels: set[str] = graph.labels_of_type("COMP")
         if not comp_labels:
             return [], 0.0
 
@@ -1384,16 +1319,7 @@ class BssChatSupport(BaseUtils):
         elems_to_comps: dict[str, set[str]] = {}
 
         for comp_lbl in comp_labels:
-            norm = flat[comp_lbl]
-            definition = norm.get("definition", "") or ""
-            open_items = norm.get("open_items", "") or ""
-
-            refs = self._extract_reference_labels_from_definition(
-                definition,
-                open_items,
-            )
-
-            for ref in refs:
+            for ref in graph.active[comp_lbl].refs:
                 t = label_types.get(ref)
                 if t not in core_families:
                     continue
@@ -1407,12 +1333,12 @@ class BssChatSupport(BaseUtils):
             return [], 0.0
 
         # (Optional) you could restrict to ones touching draft_roots; for now we run on all.
-        canonical_by_upper = {lbl.upper(): lbl for lbl in flat.keys()}
+        canonical_by_upper = graph.canonical_by_upper
 
         # 3) Build data_block for the LLM
         lines: list[str] = []
 
-        for elem in sorted(candidate_elems, key=self._bss_label_sort_key):
+        for elem in graph.sorted_labels(candidate_elems):
             elem_norm = flat.get(elem, {})
             elem_type = label_types.get(elem, "")
             elem_def = (elem_norm.get("definition") or "").strip()
@@ -1429,12 +1355,12 @@ class BssChatSupport(BaseUtils):
             lines.append("")
 
             lines.append("### Referenced_by:")
-            for comp in sorted(elems_to_comps[elem], key=self._bss_label_sort_key):
+            for comp in graph.sorted_labels(elems_to_comps[elem]):
                 comp_norm = flat.get(comp, {})
                 comp_def = (comp_norm.get("definition") or "").strip()
                 comp_open = (comp_norm.get("open_items") or "").strip()
 
-                segs = self._split_definition_segments(comp_def)
+                segs = graph.active[comp].segments
                 kind = (segs.get("kind") or "").strip()
 
                 header = f"- {comp}"
@@ -1539,17 +1465,9 @@ class BssChatSupport(BaseUtils):
             return
 
         # 1) Flatten + type map
-        flat: dict[str, dict] = {}
-        label_types: dict[str, str] = {}
-
-        for label, item in self._iter_bss_items(bss_schema):
-            norm = self._normalize_bss_item(item)
-            if norm.get("cancelled") is True:
-                continue
-            flat[label] = norm
-            t = self._bss_label_type(label)
-            if t:
-                label_types[label] = t
+        graph = self._bss_graph(bss_schema)
+        flat = graph.flat()
+        label_types = graph.label_types
 
         if not flat:
             return
@@ -1668,7 +1586,7 @@ class BssChatSupport(BaseUtils):
 
     def _summarize_asked_question(
         self,
-        schema_snapshot: dict,
+        schema_snapshot: dict | BssGraph,
         labels: set[str],
         project_id: str | None,
         user_text: str | None,
@@ -1690,7 +1608,7 @@ class BssChatSupport(BaseUtils):
         from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 
         if (
-            not isinstance(schema_snapshot, dict)
+            not isinstance(schema_snapshot, (dict, BssGraph))
             or not labels
             or not project_id
             or not user_text
@@ -1724,16 +1642,13 @@ class BssChatSupport(BaseUtils):
 
         # Build CURRENT_ASK_LOG block for the labels of interest
         # (labels are BSS labels, we only include ones present in the snapshot)
+        graph = self._bss_graph(schema_snapshot)
         current_ask_lines: list[str] = []
-        for lbl in sorted(labels, key=self._bss_label_sort_key):
-            section = self._bss_section_for_label(lbl)
-            if not section:
-                continue
-            item = (schema_snapshot.get(section) or {}).get(lbl)
-            if item is None:
+        for lbl in graph.sorted_labels(labels):
+            node = graph.nodes.get(lbl)
+            if node is None:
                 continue
-            norm = self._normalize_bss_item(item)
-            ask_log = (norm.get("ask_log") or "").strip()
+            ask_log = (node.item.get("ask_log") or "").strip()
             current_ask_lines.append(f"{lbl}:{ask_log}")
 
         if not current_ask_lines:
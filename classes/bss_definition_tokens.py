@@ -0,0 +1,126 @@
+# classes/bss_definition_tokens.py
+"""
+One scan of a definition string, shared by the helpers that read it.
+
+A definition ("Definition: ... | Flow: ... | Kind: ... | References: ...")
+used to be re-scanned by each of _split_definition_segments,
+_extract_reference_labels_from_definition, _escape_bss_freeform_segments_for_ui,
+_redact_bss_definition_for_ui, _remove_labels_from_references_segment and the
+COMP / INT kind checks of the dependency recompute. tokenize_definition()
+finds, in one pass per pattern:
+
+  - headers:  every "<Segment>:" header at the start or after a pipe, with
+              whether that pipe is escaped ("\\|", code inside a segment);
+  - segments: {lowercase name: body} as _split_definition_segments() returns;
+  - labels:   (label, start, end) of every label mentioned, in order;
+  - refs:     those labels, de-duplicated case-insensitively;
+  - kind:     the Kind segment, lowercased.
+
+Results are cached per definition text (LRU of BSS_DEFINITION_CACHE_SIZE
+strings; the key is the string, i.e. its hash plus an equality check), so an
+unchanged node is parsed once per process. They are shared: read, never
+mutate them.
+"""
+
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+from classes.bss_label import LABEL_IN_TEXT_RE, label_key, parse_label
+
+
+BSS_DEFINITION_CACHE_SIZE = int(os.getenv("BSS_DEFINITION_CACHE_SIZE", "10000"))
+
+SEGMENT_NAMES = (
+    "Definition",
+    "Flow",
+    "Contract",
+    "Contracts",
+    "Snippets",
+    "Outcomes",
+    "Decision",
+    "Notes",
+    "References",
+    "Kind",
+)
+
+# escaped pipes are matched too (and flagged): the References lookups accept them
+_HEADER_RE = re.compile(r"(^|\|)\s*(" + "|".join(SEGMENT_NAMES) + r")\s*:\s*", re.IGNORECASE)
+
+
+class SegmentHeader:
+    __slots__ = ("start", "end", "name", "escaped")
+
+    def __init__(self, start: int, end: int, name: str, escaped: bool):
+        # start includes the leading pipe when there is one; end is where the body starts
+        self.start = start
+        self.end = end
+        self.name = name
+        self.escaped = escaped
+
+    def __repr__(self) -> str:
+        return f"SegmentHeader({self.name!r}, {self.start}, {self.end})"
+
+
+class DefinitionTokens:
+    __slots__ = ("text", "headers", "segments", "labels", "refs", "kind")
+
+    def __init__(self, text: str):
+        self.text = text
+
+        headers = []
+        for m in _HEADER_RE.finditer(text):
+            start = m.start()
+            escaped = m.group(1) == "|" and start > 0 and text[start - 1] == "\\"
+            headers.append(SegmentHeader(start, m.end(), m.group(2).strip().lower(), escaped))
+        self.headers: Tuple[SegmentHeader, ...] = tuple(headers)
+
+        self.segments: Dict[str, str] = {}
+        if text.strip():
+            real = self.segment_headers()
+            if not real:
+                # No structured segments → treat whole thing as 'definition'
+                self.segments["definition"] = text.strip()
+            for i, h in enumerate(real):
+                end = real[i + 1].start if i + 1 < len(real) else len(text)
+                body = text[h.end:end].strip()
+                if body:
+                    self.segments[h.name] = body
+
+        labels = []
+        seen = set()
+        refs = []
+        for m in LABEL_IN_TEXT_RE.finditer(text):
+            label = m.group(1).strip()
+            if not label or not parse_label(label).is_label:
+                continue
+            labels.append((label, m.start(1), m.end(1)))
+            key = label_key(label)
+            if key not in seen:
+                seen.add(key)
+                refs.append(label)
+        self.labels: Tuple[Tuple[str, int, int], ...] = tuple(labels)
+        self.refs: Tuple[str, ...] = tuple(refs)
+
+        self.kind = (self.segments.get("kind") or "").strip().lower()
+
+    def segment_headers(self, exclude: Tuple[str, ...] = ()) -> Tuple[SegmentHeader, ...]:
+        """
+        Headers that delimit segments (unescaped pipe), minus `exclude` names.
+        """
+        return tuple(h for h in self.headers if not h.escaped and h.name not in exclude)
+
+    def references_header(self) -> Optional[SegmentHeader]:
+        """
+        The first "References:" header, escaped pipe or not.
+        """
+        for h in self.headers:
+            if h.name == "references":
+                return h
+        return None
+
+
+@lru_cache(maxsize=BSS_DEFINITION_CACHE_SIZE)
+def tokenize_definition(text: str) -> DefinitionTokens:
+    return DefinitionTokens(text)
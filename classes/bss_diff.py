@@ -0,0 +1,101 @@
+# classes/bss_diff.py
+"""
+Label-level differences between two BSS documents, for the UI.
+
+A client that already holds the document at some version sends it as
+payload.base_version; if that is the version the server changed, the
+response carries a delta instead of the whole redacted document:
+
+    "bss_delta": {
+        "base_version": 41,              # the client's document
+        "version": 42,                   # after applying this delta
+        "added":   {section: {label: item}},
+        "changed": {section: {label: {field: new value}}},   # changed fields only
+        "removed": [label, ...],         # deleted or cancelled
+    }
+
+Any other base_version (or none) gets the whole "bss_schema" as before,
+with "bss_version" so the client can ask for deltas next time.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from classes.bss_nodes import TOP_LEVEL_SECTION, split_bss_schema
+
+
+def parse_base_version(payload: Any) -> Optional[int]:
+    if not isinstance(payload, dict):
+        return None
+    value = payload.get("base_version")
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def changed_labels(before: Dict[str, Any], after: Dict[str, Any]) -> Tuple[Set[str], Set[str]]:
+    """
+    (labels added or modified, labels removed) between two raw documents.
+    """
+    old = split_bss_schema(before)[1]
+    new = split_bss_schema(after)[1]
+    changed = {label for label, entry in new.items() if old.get(label) != entry}
+    return changed, set(old) - set(new)
+
+
+def subdocument(doc: Dict[str, Any], labels: Iterable[str]) -> Dict[str, Any]:
+    """
+    Only `labels` of `doc`, in the same shape (for redacting a few items).
+    """
+    wanted = set(labels)
+    out: Dict[str, Any] = {}
+    for label, (section, item) in split_bss_schema(doc)[1].items():
+        if label not in wanted:
+            continue
+        if section == TOP_LEVEL_SECTION:
+            out[label] = item
+        else:
+            out.setdefault(section, {})[label] = item
+    return out
+
+
+def ui_delta(
+    before_ui: Dict[str, Any],
+    after_ui: Dict[str, Any],
+    base_version: Optional[int],
+    version: Optional[int],
+    removed: Iterable[str] = (),
+) -> Dict[str, Any]:
+    """
+    Delta between two redacted (UI) documents; `removed` adds labels known
+    to be gone that before_ui may not hold.
+    """
+    old = split_bss_schema(before_ui)[1]
+    new = split_bss_schema(after_ui)[1]
+
+    added: Dict[str, Dict[str, Any]] = {}
+    changed: Dict[str, Dict[str, Any]] = {}
+    for label, (section, item) in new.items():
+        if label not in old:
+            added.setdefault(section, {})[label] = item
+            continue
+        old_item = old[label][1]
+        if not isinstance(item, dict) or not isinstance(old_item, dict):
+            if item != old_item:
+                added.setdefault(section, {})[label] = item
+            continue
+        fields = {k: v for k, v in item.items() if old_item.get(k) != v}
+        fields.update({k: None for k in old_item if k not in item})
+        if fields:
+            changed.setdefault(section, {})[label] = fields
+
+    gone: List[str] = sorted((set(old) - set(new)) | set(removed))
+    return {
+        "base_version": base_version,
+        "version": version,
+        "added": added,
+        "changed": changed,
+        "removed": gone,
+    }
@@ -0,0 +1,169 @@
+# classes/bss_graph.py
+"""
+A BSS document parsed once, for the helpers that used to flatten it
+themselves.
+
+Most helpers of Utils / BssChatSupport start with
+
+    for label, item in self._iter_bss_items(bss_schema):
+        norm = self._normalize_bss_item(item)
+        ...
+        label_types[label] = self._bss_label_type(label)
+
+and one chat turn runs about ten of them over the same document. They take
+either a document or a BssGraph (BaseUtils._bss_graph() returns a graph as
+is), so a caller passing one document to several helpers builds it once:
+
+    graph = self._bss_graph(bss_schema)
+    self._build_registry_ledger(graph)
+    self._collect_open_items_by_gravity(graph)
+
+A graph is a snapshot: nodes hold normalized copies of the items and do not
+follow later changes of the document. Helpers read node.item, never write
+it. Definitions are tokenized on first use (and cached per text).
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from classes.bss_definition_tokens import DefinitionTokens, tokenize_definition
+from classes.bss_label import label_key
+
+
+class BssGraphNode:
+    __slots__ = (
+        "label",
+        "type",
+        "section",
+        "sort_key",
+        "item",
+        "cancelled",
+        "dependencies",
+        "dependants",
+        "_utils",
+        "_refs",
+    )
+
+    def __init__(self, label: str, item: Dict[str, Any], utils):
+        self.label = label
+        self.type: Optional[str] = utils._bss_label_type(label)
+        self.section: Optional[str] = utils._bss_section_for_label(label)
+        self.sort_key = utils._bss_label_sort_key(label)
+        # _normalize_bss_item() result
+        self.item = item
+        self.cancelled = item.get("cancelled") is True
+        # canonical labels of the graph's active nodes (see BssGraph)
+        self.dependencies: Set[str] = set()
+        self.dependants: Set[str] = set()
+        self._utils = utils
+        self._refs: Optional[List[str]] = None
+
+    @property
+    def tokens(self) -> DefinitionTokens:
+        """
+        The definition, tokenized (cached per text, see classes/bss_definition_tokens.py).
+        """
+        return tokenize_definition(self.item.get("definition") or "")
+
+    @property
+    def segments(self) -> Dict[str, str]:
+        """
+        _split_definition_segments() of the definition (shared: read only).
+        """
+        return self.tokens.segments
+
+    @property
+    def refs(self) -> List[str]:
+        """
+        Labels mentioned in definition + open_items, as written
+        (_extract_reference_labels_from_definition()).
+        """
+        if self._refs is None:
+            self._refs = self._utils._extract_reference_labels_from_definition(
+                self.item.get("definition") or "",
+                self.item.get("open_items") or "",
+            )
+        return self._refs
+
+    def __repr__(self) -> str:
+        return f"BssGraphNode({self.label!r})"
+
+
+class BssGraph:
+    def __init__(self, bss_schema: Dict[str, Any], utils):
+        self.utils = utils
+        self.has_metadata = isinstance(bss_schema, dict) and "metadata" in bss_schema
+        self.metadata = bss_schema["metadata"] if self.has_metadata else None
+
+        # every item, in document order (a label seen twice keeps the last item)
+        self.nodes: Dict[str, BssGraphNode] = {}
+        for label, item in utils._iter_bss_items(bss_schema):
+            self.nodes[label] = BssGraphNode(label, utils._normalize_bss_item(item), utils)
+
+        # not cancelled: what the dependency helpers work on
+        self.active: Dict[str, BssGraphNode] = {
+            label: node for label, node in self.nodes.items() if not node.cancelled
+        }
+        self.label_types: Dict[str, str] = {label: node.type for label, node in self.active.items() if node.type}
+        # "ROLE-1_CUSTOMER" -> "ROLE-1_Customer" (keys are label_key())
+        self.canonical_by_upper: Dict[str, str] = {label_key(label): label for label in self.active}
+        self.by_type: Dict[str, List[str]] = {}
+        for label, label_type in self.label_types.items():
+            self.by_type.setdefault(label_type, []).append(label)
+
+        # adjacency from the stored CSV fields
+        for node in self.nodes.values():
+            node.dependencies = self.canonical_set(node.item.get("dependencies"))
+            node.dependants = self.canonical_set(node.item.get("dependants"))
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def canonical(self, label: Any) -> Optional[str]:
+        if not isinstance(label, str):
+            return None
+        return self.canonical_by_upper.get(label_key(label))
+
+    def canonical_set(self, csv: Any) -> Set[str]:
+        """
+        Active labels named in a comma-separated field.
+        """
+        out: Set[str] = set()
+        for part in (csv or "").split(","):
+            canon = self.canonical_by_upper.get(label_key(part)) if part.strip() else None
+            if canon:
+                out.add(canon)
+        return out
+
+    def labels_of_type(self, *types: str) -> Set[str]:
+        out: Set[str] = set()
+        for label_type in types:
+            out.update(self.by_type.get(label_type, ()))
+        return out
+
+    def sort_key(self, label: str):
+        node = self.nodes.get(label)
+        return node.sort_key if node is not None else self.utils._bss_label_sort_key(label)
+
+    def sorted_labels(self, labels: Iterable[str]) -> List[str]:
+        return sorted(labels, key=self.sort_key)
+
+    def flat(self, include_cancelled: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        {label: normalized item}; the items are the nodes' own (read only).
+        """
+        nodes = self.nodes if include_cancelled else self.active
+        return {label: node.item for label, node in nodes.items()}
+
+    def to_schema(self, include_cancelled: bool = True) -> Dict[str, Any]:
+        """
+        Back to the stored JSON shape: {section: {label: item}} in section
+        order, plus metadata. Items are copies.
+        """
+        out: Dict[str, Dict[str, Any]] = {section: {} for section in self.utils._bss_section_order()}
+        nodes = self.nodes if include_cancelled else self.active
+        for label, node in nodes.items():
+            out.setdefault(node.section or "A", {})[label] = dict(node.item)
+        result: Dict[str, Any] = {k: v for k, v in out.items() if v}
+        if self.has_metadata:
+            result["metadata"] = self.metadata
+        return result
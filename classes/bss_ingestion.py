@@ -6,12 +6,13 @@ from typing import Any, Callable, Mapping
 
 from classes.backend_utils import Utils
 from classes.bss_chat_refinement import BssChatSupport
+from classes.cpu_pool import CpuOffload
 from chat_prompts.ingestion_prompts import BSS_CANONICALIZER_PROMPT, BSS_UC_EXTRACTOR_PROMPT, UC_COVERAGE_AUDITOR_PROMPT, epistemic_2_rules
 from classes.llm_client import LlmClient
 from classes.model_props import get_model_max_threshold
 
 
-class BSSIngestion(Utils, BssChatSupport):
+class BSSIngestion(CpuOffload, Utils, BssChatSupport):
     emit:Callable[[str, dict[str, Any]], None]
     def handle_ingestion(
         self,
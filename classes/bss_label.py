@@ -0,0 +1,100 @@
+# classes/bss_label.py
+"""
+BSS label parsing, compiled once and cached per raw string.
+
+_is_bss_label / _bss_label_type / _bss_label_sort_key / _bss_section_for_label
+(BaseUtils) are called for every label of every helper, and as sort keys,
+many thousand times per request. parse_label() matches a raw string once and
+keeps the result in a bounded LRU (BSS_LABEL_CACHE_SIZE strings): the same
+label seen again costs a dict lookup.
+
+label_key() is the case-insensitive form labels are compared by
+("ROLE-1_Customer" and " role-1_CUSTOMER" are the same label).
+
+benchmarks/bss_label_bench.py compares it with the inline re.match version.
+"""
+
+import os
+import re
+from functools import lru_cache
+from typing import Optional, Tuple
+
+
+BSS_LABEL_CACHE_SIZE = int(os.getenv("BSS_LABEL_CACHE_SIZE", "65536"))
+
+FAMILIES = ("A", "UC", "PROC", "COMP", "ROLE", "UI", "ENT", "INT", "API", "NFR")
+
+FAMILY_ORDER = {family: n for n, family in enumerate(FAMILIES)}
+
+FAMILY_SECTIONS = {
+    "A": "A",
+    "UC": "UseCases",
+    "PROC": "Processes",
+    "COMP": "Components",
+    "ROLE": "Actors",
+    "UI": "UI",
+    "ENT": "Entities",
+    "INT": "Integrations",
+    "API": "APIs",
+    "NFR": "NFRs",
+}
+
+_CANVAS_LABEL_RE = re.compile(r"^A\d+_[A-Z0-9_]+$", re.IGNORECASE)
+_FAMILY_LABEL_RE = re.compile(r"^(UC|PROC|COMP|ROLE|UI|ENT|INT|API|NFR)-?\d+_[A-Z0-9_]+$", re.IGNORECASE)
+_CANVAS_PREFIX_RE = re.compile(r"^A\d+_", re.IGNORECASE)
+_FAMILY_PREFIX_RE = re.compile(r"^(UC|PROC|COMP|ROLE|UI|ENT|INT|API|NFR)-?\d+_", re.IGNORECASE)
+_INDEX_RE = re.compile(r"^(A|UC|PROC|COMP|ROLE|UI|ENT|INT|API|NFR)-?(\d+)_", re.IGNORECASE)
+
+# labels mentioned in free text (_extract_reference_labels_from_definition)
+LABEL_IN_TEXT_RE = re.compile(
+    r"\b("
+    r"A\d+_[A-Z0-9_]+"
+    r"|(?:UC|PROC|COMP|ROLE|UI|ENT|INT|API|NFR)-?\d+_[A-Z0-9_]+"
+    r")\b",
+    re.IGNORECASE,
+)
+
+
+class ParsedLabel:
+    __slots__ = ("raw", "is_label", "family", "index", "key", "section", "sort_key")
+
+    def __init__(self, raw: str):
+        s = raw.strip()
+        self.raw = raw
+        # a full label ("PROC-3_Checkout"), not just a label-like prefix
+        self.is_label = bool(s) and (
+            _CANVAS_LABEL_RE.match(s) is not None or _FAMILY_LABEL_RE.match(s) is not None
+        )
+
+        self.family: Optional[str] = None
+        if _CANVAS_PREFIX_RE.match(s):
+            self.family = "A"
+        else:
+            m = _FAMILY_PREFIX_RE.match(s)
+            if m:
+                self.family = m.group(1).upper()
+
+        m = _INDEX_RE.match(s)
+        self.index: Optional[int] = int(m.group(2)) if m else None
+        self.key = label_key(s)
+        self.section: Optional[str] = FAMILY_SECTIONS.get(self.family) if self.family else None
+        self.sort_key: Tuple[int, int, str] = (
+            FAMILY_ORDER.get(self.family, 99) if self.family else 99,
+            self.index if self.index is not None else 10**9,
+            raw,
+        )
+
+    def __repr__(self) -> str:
+        return f"ParsedLabel({self.raw!r})"
+
+
+@lru_cache(maxsize=BSS_LABEL_CACHE_SIZE)
+def parse_label(raw: str) -> ParsedLabel:
+    return ParsedLabel(raw)
+
+
+def label_key(label: str) -> str:
+    """
+    Case-insensitive comparison key of a label.
+    """
+    return label.strip().upper()
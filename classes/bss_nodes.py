@@ -0,0 +1,555 @@
+# classes/bss_nodes.py
+"""
+Per-node storage of the BSS document (BSS_STORAGE=nodes).
+
+With BSS_STORAGE=blob (the default) the whole document lives in
+Project.bss_schema and every save rewrites all of it. With
+BSS_STORAGE=nodes:
+
+  - every item is one bss_node row (project_id, label), its known fields in
+    columns and any other keys in `extra`;
+  - Project.bss_schema only keeps {"metadata": {...}} (chat_queue, ui_state);
+  - save() compares each item's fingerprint with the stored one and upserts
+    only the items that changed (their `version` goes up), deletes the ones
+    that are gone, and rewrites metadata only when it changed;
+  - metadata-only operations (save_state) never read or write a node;
+  - with BSS_UI_VIEW, every written node also gets its redacted item in
+    ui_item, and load_ui() serves the editor from that column alone;
+  - the bss_ref rows (reference index, classes/bss_ref_index.py) of the
+    written and deleted nodes are replaced in the same transaction.
+
+load() / save() take and return the same dict shape as the blob, so the
+handlers do not know which storage is in use.
+
+A project still stored as a blob is migrated the first time it is loaded
+or saved. Command line:
+    python -m classes.bss_nodes migrate             # table + every project
+    python -m classes.bss_nodes export <project_id> # back into the blob
+    python -m classes.bss_nodes export all
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, case, delete, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from classes.base_utils import BaseUtils
+from classes.bss_cache import BssVersionConflict, migrate_project_version_column
+from classes.bss_ref_index import load_bss_referencing, migrate_bss_ref_schema, write_bss_refs
+from classes.bss_ui_view import UI_VIEW_FORMAT, migrate_ui_view_columns, node_ui_item
+from classes.entities import BssNode, Project
+
+
+logger = logging.getLogger("kahuna_backend")
+
+BSS_STORAGE = os.getenv("BSS_STORAGE", "blob").strip().lower()
+if BSS_STORAGE not in ("blob", "nodes"):
+    raise RuntimeError(f"Unknown BSS_STORAGE: {BSS_STORAGE} (expected blob | nodes)")
+
+METADATA_KEY = "metadata"
+TOP_LEVEL_SECTION = ""
+
+TEXT_FIELDS = ("status", "definition", "open_items", "ask_log", "dependencies", "dependants")
+
+BSS_NODE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS bss_node (
+        project_id UUID NOT NULL REFERENCES project (project_id) ON DELETE CASCADE,
+        label TEXT NOT NULL,
+        section TEXT NOT NULL DEFAULT '',
+        status TEXT,
+        definition TEXT,
+        open_items TEXT,
+        ask_log TEXT,
+        dependencies TEXT,
+        dependants TEXT,
+        cancelled BOOLEAN,
+        extra JSONB,
+        fingerprint TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 1,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        ui_item JSONB,
+        PRIMARY KEY (project_id, label)
+    )
+    """,
+]
+
+_COLUMNS = ("section",) + TEXT_FIELDS + ("cancelled", "extra")
+_UPSERT_CHUNK = 1000
+
+# label syntax only (_is_bss_label); no state
+_LABELS = BaseUtils()
+
+
+def migrate_bss_node_schema(engine: Engine) -> None:
+    with engine.begin() as conn:
+        for stmt in BSS_NODE_DDL:
+            conn.execute(text(stmt))
+
+
+# ---------------------------------------------------------------------------
+# item <-> row
+# ---------------------------------------------------------------------------
+
+def node_values(section: str, item: Any) -> Dict[str, Any]:
+    """
+    Column values (plus fingerprint) for one item. Fields of an unexpected
+    type are kept in `extra`, so row_item() gives back the same item.
+    """
+    if not isinstance(item, dict):
+        item = {"definition": item}
+    values: Dict[str, Any] = {"section": section}
+    extra: Dict[str, Any] = {}
+    for key, value in item.items():
+        if key in TEXT_FIELDS and isinstance(value, str):
+            values[key] = value
+        elif key == "cancelled" and isinstance(value, bool):
+            values[key] = value
+        else:
+            extra[key] = value
+    for column in _COLUMNS:
+        values.setdefault(column, None)
+    values["extra"] = extra or None
+    values["fingerprint"] = _fingerprint(values)
+    return values
+
+
+def _fingerprint(values: Dict[str, Any]) -> str:
+    blob = json.dumps([values[c] for c in _COLUMNS], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+def row_item(row: Any) -> Dict[str, Any]:
+    item: Dict[str, Any] = {}
+    for field in TEXT_FIELDS:
+        value = getattr(row, field)
+        if value is not None:
+            item[field] = value
+    if row.cancelled is not None:
+        item["cancelled"] = row.cancelled
+    if row.extra:
+        item.update(row.extra)
+    return item
+
+
+def split_bss_schema(content: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Tuple[str, Any]]]:
+    """
+    {section: {label: item}, "metadata": {...}} ->
+        ({"metadata": {...}} or {}, {label: (section, item)})
+    Items at the top level (legacy flat documents) get section "".
+    """
+    blob: Dict[str, Any] = {}
+    nodes: Dict[str, Tuple[str, Any]] = {}
+    for key, value in (content or {}).items():
+        if key == METADATA_KEY:
+            blob[key] = value
+        elif isinstance(value, dict) and not _LABELS._is_bss_label(key):
+            for label, item in value.items():
+                if label in nodes:
+                    logger.info("BSS label %s found in sections %s and %s; keeping the latter", label, nodes[label][0], key)
+                nodes[label] = (key, item)
+        else:
+            nodes[key] = (TOP_LEVEL_SECTION, value)
+    return blob, nodes
+
+
+def _has_nodes(blob: Any) -> bool:
+    return isinstance(blob, dict) and any(key != METADATA_KEY for key in blob)
+
+
+# ---------------------------------------------------------------------------
+# Repository
+# ---------------------------------------------------------------------------
+
+class BssNodeStore:
+    def __init__(
+        self,
+        SessionFactory: Callable[[], Session],
+        redact_item: Optional[Callable[[Any], Optional[dict]]] = None,
+    ):
+        self.SessionFactory = SessionFactory
+        # item -> redacted item (None: not shown); None: no UI view is kept
+        self.redact_item = redact_item
+
+    # ---- reads ----
+
+    def load(self, project_id: str, labels: Optional[Iterable[str]] = None) -> dict:
+        """
+        The document as Project.bss_schema used to hold it. With `labels`,
+        only those items (and metadata).
+        """
+        return self.load_versioned(project_id, labels)[0]
+
+    def load_versioned(self, project_id: str, labels: Optional[Iterable[str]] = None) -> Tuple[dict, int]:
+        project_id = str(project_id)
+        session = self.SessionFactory()
+        try:
+            blob, version = self._project_row(session, project_id)
+            if _has_nodes(blob):
+                blob = self._migrate_locked(session, project_id)
+                session.commit()
+
+            stmt = select(BssNode).where(BssNode.project_id == project_id)
+            if labels is not None:
+                stmt = stmt.where(BssNode.label.in_(list(labels)))
+            rows = session.execute(stmt.order_by(BssNode.section, BssNode.label)).scalars().all()
+
+            out: Dict[str, Any] = {}
+            for row in rows:
+                if row.section == TOP_LEVEL_SECTION:
+                    out[row.label] = row_item(row)
+                else:
+                    out.setdefault(row.section, {})[row.label] = row_item(row)
+            if METADATA_KEY in blob:
+                out[METADATA_KEY] = blob[METADATA_KEY]
+            return out, version
+        finally:
+            session.close()
+
+    def current_version(self, project_id: str) -> int:
+        session = self.SessionFactory()
+        try:
+            return self._project_row(session, str(project_id))[1]
+        finally:
+            session.close()
+
+    def load_ui(self, project_id: str) -> Optional[Dict[str, Optional[dict]]]:
+        """
+        {label: redacted item or None} from ui_item; nodes without a current
+        one (written before BSS_UI_VIEW or UI_VIEW_FORMAT changed) are
+        redacted now and their ui_item stored. None without a redactor.
+        """
+        if self.redact_item is None:
+            return None
+        project_id = str(project_id)
+        session = self.SessionFactory()
+        try:
+            blob = self._project_row(session, project_id)[0]
+            if _has_nodes(blob):
+                self._migrate_locked(session, project_id)
+                session.commit()
+
+            rows = session.execute(
+                select(BssNode.label, BssNode.ui_item)
+                .where(BssNode.project_id == project_id)
+                .order_by(BssNode.section, BssNode.label)
+            ).all()
+            items: Dict[str, Optional[dict]] = {}
+            stale = []
+            for label, ui_item in rows:
+                if isinstance(ui_item, dict) and ui_item.get("format") == UI_VIEW_FORMAT:
+                    items[label] = ui_item.get("item")
+                else:
+                    items[label] = None
+                    stale.append(label)
+
+            if stale:
+                updates = []
+                for row in session.execute(
+                    select(BssNode).where(BssNode.project_id == project_id).where(BssNode.label.in_(stale))
+                ).scalars():
+                    ui_item = node_ui_item(self.redact_item(row_item(row)))
+                    items[row.label] = ui_item["item"]
+                    updates.append({"b_label": row.label, "b_fp": row.fingerprint, "ui_item": ui_item})
+                # the fingerprint guard leaves alone a node saved meanwhile
+                session.execute(
+                    update(BssNode.__table__)
+                    .where(BssNode.project_id == project_id)
+                    .where(BssNode.label == bindparam("b_label"))
+                    .where(BssNode.fingerprint == bindparam("b_fp"))
+                    .values(ui_item=bindparam("ui_item")),
+                    updates,
+                )
+                session.commit()
+            return items
+        finally:
+            session.close()
+
+    def load_referencing(self, project_id: str, version: int, labels: Iterable[str]) -> Optional[Dict[str, List[str]]]:
+        """
+        bss_ref rows of `labels` at `version` (see classes/bss_ref_index.py).
+        """
+        session = self.SessionFactory()
+        try:
+            return load_bss_referencing(session, str(project_id), version, labels)
+        finally:
+            session.close()
+
+    def load_metadata(self, project_id: str) -> dict:
+        """
+        {"metadata": {...}} (or {}) without reading any node.
+        """
+        session = self.SessionFactory()
+        try:
+            blob = self._project_row(session, str(project_id))[0]
+            return {METADATA_KEY: blob[METADATA_KEY]} if METADATA_KEY in blob else {}
+        finally:
+            session.close()
+
+    # ---- writes ----
+
+    def save(self, project_id: str, content: dict, expected_version: Optional[int] = None) -> int:
+        """
+        Persist `content` as a whole (items missing from it are deleted), in
+        one transaction, writing only what differs from what is stored.
+        With expected_version, only if the project is still at that version
+        (else BssVersionConflict). Returns the new version.
+        """
+        project_id = str(project_id)
+        new_blob, nodes = split_bss_schema(content)
+
+        session = self.SessionFactory()
+        try:
+            blob, version = self._project_row(session, project_id, for_update=True)
+            if expected_version is not None and version != expected_version:
+                raise BssVersionConflict(f"Project {project_id} is at version {version}, not {expected_version}")
+            if _has_nodes(blob):
+                blob = self._migrate_locked(session, project_id)
+
+            stored = dict(
+                session.execute(
+                    select(BssNode.label, BssNode.fingerprint).where(BssNode.project_id == project_id)
+                ).all()
+            )
+            changed = []
+            changed_items: Dict[str, Any] = {}
+            for label, (section, item) in nodes.items():
+                values = node_values(section, item)
+                if stored.get(label) != values["fingerprint"]:
+                    changed.append(self._row(project_id, label, values, item))
+                    changed_items[label] = item
+            gone = [label for label in stored if label not in nodes]
+
+            if changed:
+                self._upsert(session, changed)
+            if gone:
+                session.execute(
+                    delete(BssNode)
+                    .where(BssNode.project_id == project_id)
+                    .where(BssNode.label.in_(gone))
+                    .execution_options(synchronize_session=False)
+                )
+            if changed or gone or new_blob != blob:
+                if self._refs_current(session, project_id, version):
+                    write_bss_refs(session, project_id, changed_items, gone)
+                else:
+                    write_bss_refs(session, project_id, {label: item for label, (_, item) in nodes.items()}, whole=True)
+                version = self._set_blob(session, project_id, new_blob if new_blob != blob else None, refs=True)
+            session.commit()
+            logger.debug(
+                "BSS save %s: %d node(s) written, %d deleted, %d unchanged",
+                project_id, len(changed), len(gone), len(nodes) - len(changed),
+            )
+            return version
+        finally:
+            session.close()
+
+    def save_metadata(self, project_id: str, content: dict) -> int:
+        """
+        Persist the "metadata" section of `content` only; nodes are untouched.
+        """
+        new_blob = {METADATA_KEY: content[METADATA_KEY]} if METADATA_KEY in (content or {}) else {}
+        session = self.SessionFactory()
+        try:
+            blob, version = self._project_row(session, str(project_id), for_update=True)
+            if _has_nodes(blob):
+                blob = self._migrate_locked(session, str(project_id))
+            if new_blob != blob:
+                version = self._set_blob(session, str(project_id), new_blob)
+            session.commit()
+            return version
+        finally:
+            session.close()
+
+    # ---- migration ----
+
+    def migrate_all(self, batch_size: int = 100) -> Tuple[int, int]:
+        """
+        Move every project still stored as a blob into bss_node, one
+        transaction per project. Returns (projects, nodes).
+        """
+        projects = nodes = 0
+        last_id = None
+        while True:
+            session = self.SessionFactory()
+            try:
+                stmt = select(Project.project_id).order_by(Project.project_id).limit(batch_size)
+                if last_id is not None:
+                    stmt = stmt.where(Project.project_id > last_id)
+                ids = session.execute(stmt).scalars().all()
+            finally:
+                session.close()
+            if not ids:
+                return projects, nodes
+            last_id = ids[-1]
+
+            for project_id in ids:
+                session = self.SessionFactory()
+                try:
+                    blob = self._project_row(session, project_id, for_update=True)[0]
+                    if _has_nodes(blob):
+                        _, items = split_bss_schema(blob)
+                        self._migrate_locked(session, project_id)
+                        session.commit()
+                        projects += 1
+                        nodes += len(items)
+                finally:
+                    session.close()
+
+    def export(self, project_id: str) -> int:
+        """
+        Write the nodes back into Project.bss_schema and delete them (to return
+        a project to BSS_STORAGE=blob). Returns the number of nodes moved.
+        """
+        project_id = str(project_id)
+        session = self.SessionFactory()
+        try:
+            blob = self._project_row(session, project_id, for_update=True)[0]
+            rows = session.execute(
+                select(BssNode).where(BssNode.project_id == project_id).order_by(BssNode.section, BssNode.label)
+            ).scalars().all()
+            if not rows:
+                return 0
+            content = dict(blob)
+            for row in rows:
+                if row.section == TOP_LEVEL_SECTION:
+                    content[row.label] = row_item(row)
+                else:
+                    content.setdefault(row.section, {})[row.label] = row_item(row)
+            self._set_blob(session, project_id, content)
+            session.execute(
+                delete(BssNode).where(BssNode.project_id == project_id).execution_options(synchronize_session=False)
+            )
+            session.commit()
+            return len(rows)
+        finally:
+            session.close()
+
+    # ---- helpers (caller commits) ----
+
+    def _project_row(self, session: Session, project_id: str, for_update: bool = False) -> Tuple[dict, int]:
+        stmt = select(Project.bss_schema, Project.version).where(Project.project_id == project_id)
+        if for_update:
+            stmt = stmt.with_for_update()
+        row = session.execute(stmt).one_or_none()
+        if row is None:
+            raise ValueError(f"Project not found: {project_id}")
+        return (row[0] if isinstance(row[0], dict) else {}), row[1]
+
+    def _refs_current(self, session: Session, project_id: str, version: int) -> bool:
+        stored = session.execute(select(Project.bss_ref_version).where(Project.project_id == project_id)).scalar()
+        return stored == version
+
+    def _set_blob(
+        self, session: Session, project_id: str, blob: Optional[dict], bump: bool = True, refs: bool = False
+    ) -> Optional[int]:
+        """
+        Bump the project's version, replacing bss_schema with `blob` unless None.
+        refs: the bss_ref rows were written for the new version; otherwise they
+        stay current only if they were. Returns the new version.
+        """
+        values: Dict[str, Any] = {"updated_at": func.now()}
+        if bump:
+            values["version"] = Project.version + 1
+            values["bss_ref_version"] = (
+                Project.version + 1
+                if refs
+                else case((Project.bss_ref_version == Project.version, Project.version + 1), else_=None)
+            )
+        if blob is not None:
+            values["bss_schema"] = blob
+        return session.execute(
+            update(Project)
+            .where(Project.project_id == project_id)
+            .values(**values)
+            .returning(Project.version)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+
+    def _migrate_locked(self, session: Session, project_id: str) -> dict:
+        """
+        Blob items -> bss_node rows (replacing any stale rows), blob -> metadata
+        only. Locks the project row; re-reads the blob under the lock so two
+        processes migrating the same project do not both copy it.
+        """
+        blob = self._project_row(session, project_id, for_update=True)[0]
+        if not _has_nodes(blob):
+            return blob
+        new_blob, nodes = split_bss_schema(blob)
+        session.execute(
+            delete(BssNode).where(BssNode.project_id == project_id).execution_options(synchronize_session=False)
+        )
+        if nodes:
+            self._upsert(
+                session,
+                [
+                    self._row(project_id, label, node_values(section, item), item)
+                    for label, (section, item) in nodes.items()
+                ],
+            )
+        # same document, other storage: the version stays
+        self._set_blob(session, project_id, new_blob, bump=False)
+        logger.info("BSS of project %s moved to bss_node (%d nodes)", project_id, len(nodes))
+        return new_blob
+
+    def _row(self, project_id: str, label: str, values: Dict[str, Any], item: Any) -> Dict[str, Any]:
+        # without a redactor ui_item is cleared, so it can never outlive its item
+        ui_item = node_ui_item(self.redact_item(item)) if self.redact_item is not None else None
+        return {"project_id": project_id, "label": label, **values, "ui_item": ui_item}
+
+    def _upsert(self, session: Session, rows: List[Dict[str, Any]]) -> None:
+        # chunks keep each statement well under the bind parameter limit
+        for start in range(0, len(rows), _UPSERT_CHUNK):
+            stmt = insert(BssNode).values(rows[start:start + _UPSERT_CHUNK])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[BssNode.project_id, BssNode.label],
+                set_={
+                    **{column: stmt.excluded[column] for column in _COLUMNS},
+                    "fingerprint": stmt.excluded.fingerprint,
+                    "ui_item": stmt.excluded.ui_item,
+                    "version": BssNode.version + 1,
+                    "updated_at": func.now(),
+                },
+            )
+            session.execute(stmt)
+
+
+def main() -> None:
+    from classes.GCConnection_hlpr import get_db_engine, get_session_factory
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    store = BssNodeStore(get_session_factory())
+
+    if command == "migrate":
+        migrate_project_version_column(get_db_engine())
+        migrate_bss_node_schema(get_db_engine())
+        migrate_ui_view_columns(get_db_engine())
+        migrate_bss_ref_schema(get_db_engine())
+        projects, nodes = store.migrate_all()
+        logger.info("Moved %d project(s), %d node(s) to bss_node", projects, nodes)
+    elif command == "export":
+        if len(sys.argv) < 3:
+            raise SystemExit("Usage: python -m classes.bss_nodes export <project_id> | all")
+        if sys.argv[2] == "all":
+            session = get_session_factory()()
+            try:
+                ids = session.execute(select(BssNode.project_id).distinct()).scalars().all()
+            finally:
+                session.close()
+        else:
+            ids = [sys.argv[2]]
+        for project_id in ids:
+            logger.info("Project %s: %d node(s) moved back to the blob", project_id, store.export(project_id))
+    else:
+        raise SystemExit(f"Unknown command: {command} (expected migrate | export)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# classes/bss_ref_index.py
+"""
+Persisted reverse-reference index of the BSS documents (table bss_ref).
+
+A partial dependency recompute (_recompute_bss_dependency_fields with
+root_labels) needs the nodes whose text mentions a root. Without an index
+that means extracting the references of every node of the document. bss_ref
+keeps one row per (project, referenced label key, referencing label), for
+the labels found in definition + open_items + user_defined_relationships of
+every active item:
+
+  - the stores write it in the transaction of each save, only for the items
+    that save writes (changed, added, removed), or for the whole document
+    when they write it whole;
+  - project.bss_ref_version is the project version the rows describe. A
+    writer that does not maintain them leaves it behind, and the next save
+    rebuilds the project's rows;
+  - load_bss_referencing() reads the rows of a few roots, only if they
+    describe the version the caller loaded (None otherwise: the recompute
+    then scans the document as before).
+
+Rows are candidates: the recompute checks each one against the node's
+current text, so an item edited since the load only has to be added to them.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from classes.base_utils import BaseUtils
+from classes.bss_label import label_key
+
+
+BSS_REF_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS bss_ref (
+        project_id UUID NOT NULL REFERENCES project (project_id) ON DELETE CASCADE,
+        ref_key TEXT NOT NULL,
+        label TEXT NOT NULL,
+        PRIMARY KEY (project_id, ref_key, label)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_bss_ref_project_label ON bss_ref (project_id, label)",
+    "ALTER TABLE project ADD COLUMN IF NOT EXISTS bss_ref_version BIGINT",
+]
+
+_INSERT_CHUNK = 1000
+
+# normalization + reference extraction only; no state
+_UTILS = BaseUtils()
+
+
+def migrate_bss_ref_schema(engine: Engine) -> None:
+    with engine.begin() as conn:
+        for stmt in BSS_REF_DDL:
+            conn.execute(text(stmt))
+
+
+def item_ref_keys(item: Any) -> Set[str]:
+    """
+    label_key() of every label an item mentions, as the recompute reads them
+    (none for a cancelled item).
+    """
+    norm = _UTILS._normalize_bss_item(item)
+    if norm.get("cancelled") is True:
+        return set()
+    refs = _UTILS._extract_reference_labels_from_definition(norm.get("definition") or "", norm.get("open_items") or "")
+    udr = norm.get("user_defined_relationships") or ""
+    if udr:
+        refs = refs + _UTILS._extract_reference_labels_from_definition(udr)
+    return {label_key(r) for r in refs if r.strip()}
+
+
+def write_bss_refs(
+    session: Session,
+    project_id: str,
+    items: Dict[str, Any],
+    gone: Iterable[str] = (),
+    whole: bool = False,
+) -> None:
+    """
+    Replace the rows of `items` ({label: item}) and drop those of `gone`.
+    whole: `items` is the entire document, every other row goes too.
+    Caller commits, and sets project.bss_ref_version.
+    """
+    params = {"pid": str(project_id)}
+    if whole:
+        session.execute(text("DELETE FROM bss_ref WHERE project_id = CAST(:pid AS uuid)"), params)
+    else:
+        labels = list(items) + [label for label in gone if label not in items]
+        if not labels:
+            return
+        session.execute(
+            text("DELETE FROM bss_ref WHERE project_id = CAST(:pid AS uuid) AND label = ANY(:labels)"),
+            {**params, "labels": labels},
+        )
+
+    rows = [
+        {"pid": str(project_id), "ref_key": key, "label": label}
+        for label, item in items.items()
+        for key in sorted(item_ref_keys(item))
+    ]
+    for start in range(0, len(rows), _INSERT_CHUNK):
+        session.execute(
+            text(
+                "INSERT INTO bss_ref (project_id, ref_key, label) "
+                "VALUES (CAST(:pid AS uuid), :ref_key, :label) ON CONFLICT DO NOTHING"
+            ),
+            rows[start:start + _INSERT_CHUNK],
+        )
+
+
+def load_bss_referencing(
+    session: Session, project_id: str, version: int, labels: Iterable[str]
+) -> Optional[Dict[str, List[str]]]:
+    """
+    {label_key(label): [labels mentioning it]} for `labels`, or None when
+    the rows do not describe `version` of the project.
+    """
+    keys = sorted({label_key(label) for label in labels})
+    rows = session.execute(
+        text(
+            "SELECT COALESCE(p.bss_ref_version = :version AND p.version = :version, false), r.ref_key, r.label "
+            "FROM project p LEFT JOIN bss_ref r "
+            "ON r.project_id = p.project_id AND r.ref_key = ANY(:keys) "
+            "WHERE p.project_id = CAST(:pid AS uuid)"
+        ),
+        {"pid": str(project_id), "version": version, "keys": keys},
+    ).all()
+    if not rows or not rows[0][0]:
+        return None
+    out: Dict[str, List[str]] = {key: [] for key in keys}
+    for _, key, label in rows:
+        if key is not None:
+            out[key].append(label)
+    return out
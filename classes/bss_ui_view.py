@@ -0,0 +1,107 @@
+# classes/bss_ui_view.py
+"""
+The redacted (UI) view of the BSS document, node by node.
+
+_redact_bss_schema_for_ui() normalizes every item and runs the segment
+regexes over its definition. Most items are unchanged between two calls, so:
+
+  - BSS_REDACTION_CACHE keeps the redacted item per item content hash
+    (LRU of BSS_REDACTION_CACHE_ITEMS); an unchanged item is redacted once
+    per process.
+  - With BSS_UI_VIEW=true the stores also persist the redacted item of every
+    node they write, next to the canonical one (bss_node.ui_item with
+    BSS_STORAGE=nodes, project.bss_ui with blob), and load_project reads
+    that view instead of loading and redacting the document.
+
+A stored view carries UI_VIEW_FORMAT: bump it whenever the redaction
+changes, and older views are ignored (then rewritten) instead of served.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+
+BSS_UI_VIEW = os.getenv("BSS_UI_VIEW", "false").strip().lower() in ("1", "true", "yes")
+BSS_REDACTION_CACHE_ITEMS = int(os.getenv("BSS_REDACTION_CACHE_ITEMS", "20000"))
+
+UI_VIEW_FORMAT = 1
+
+UI_VIEW_DDL = [
+    "ALTER TABLE project ADD COLUMN IF NOT EXISTS bss_ui JSONB",
+    "ALTER TABLE project ADD COLUMN IF NOT EXISTS bss_ui_version BIGINT",
+    "ALTER TABLE IF EXISTS bss_node ADD COLUMN IF NOT EXISTS ui_item JSONB",
+]
+
+
+def migrate_ui_view_columns(engine: Engine) -> None:
+    with engine.begin() as conn:
+        for stmt in UI_VIEW_DDL:
+            conn.execute(text(stmt))
+
+
+def item_hash(item: Any) -> str:
+    blob = json.dumps(item, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+def node_ui_item(redacted: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    bss_node.ui_item for a redacted item (None: cancelled, not shown).
+    """
+    return {"format": UI_VIEW_FORMAT, "item": redacted}
+
+
+def blob_ui_view(items: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    project.bss_ui for {label: redacted item} (cancelled items left out).
+    """
+    return {"format": UI_VIEW_FORMAT, "items": items}
+
+
+# RedactionCache.get() for an item not redacted yet (None is a cancelled item)
+MISSING = object()
+
+
+class RedactionCache:
+    def __init__(self, max_items: int = BSS_REDACTION_CACHE_ITEMS):
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, Optional[Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Any:
+        """
+        The redacted item (None for a cancelled one), or MISSING.
+        """
+        with self._lock:
+            value = self._items.get(key, MISSING)
+            if value is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Optional[Dict[str, Any]]) -> None:
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"items": len(self._items), "hits": self.hits, "misses": self.misses}
+
+
+BSS_REDACTION_CACHE = RedactionCache()
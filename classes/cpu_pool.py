@@ -0,0 +1,213 @@
+# classes/cpu_pool.py
+"""
+Optional process-pool lane for CPU-heavy, pure BSS graph work.
+
+Jobs run on threads (asyncio.to_thread), so pure-Python work over a big
+bss_schema (dependency recompute, prompt document, UI redaction, chat prompt
+inputs) holds the GIL and slows every other in-flight job on the worker.
+With BSS_CPU_POOL_WORKERS > 0, these calls are shipped to a spawn-based
+ProcessPoolExecutor instead:
+
+  - the schema travels as compact JSON, zlib-compressed when large;
+  - the child runs the very same Utils / BssChatSupport methods
+    (on a bare helper instance: no DB, no LLM clients);
+  - small schemas (< BSS_CPU_POOL_MIN_ITEMS labels) stay in-thread,
+    where the IPC would cost more than it saves;
+  - any pool failure falls back to running in-thread.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+
+from classes.bss_graph import BssGraph
+
+
+logger = logging.getLogger("kahuna_backend")
+
+BSS_CPU_POOL_WORKERS = int(os.getenv("BSS_CPU_POOL_WORKERS", "0"))
+BSS_CPU_POOL_MIN_ITEMS = int(os.getenv("BSS_CPU_POOL_MIN_ITEMS", "150"))
+BSS_CPU_POOL_TIMEOUT = float(os.getenv("BSS_CPU_POOL_TIMEOUT", "120"))
+
+_COMPRESS_ABOVE = 32 * 1024
+_RAW, _ZLIB = b"j", b"z"
+
+
+def pack(obj: Any) -> bytes:
+    data = json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if len(data) > _COMPRESS_ABOVE:
+        return _ZLIB + zlib.compress(data, 1)
+    return _RAW + data
+
+
+def unpack(blob: bytes) -> Any:
+    tag, data = blob[:1], blob[1:]
+    if tag == _ZLIB:
+        data = zlib.decompress(data)
+    return json.loads(data.decode("utf-8"))
+
+
+# ---------------------------------------------------------------------------
+# Child side
+# ---------------------------------------------------------------------------
+
+_helper = None
+
+
+def _get_helper():
+    global _helper
+    if _helper is None:
+        from classes.backend_utils import Utils
+        from classes.bss_chat_refinement import BssChatSupport
+
+        class _CpuHelper(Utils, BssChatSupport):
+            pass
+
+        # no __init__: Backend's one builds DB/LLM clients we do not need here
+        _helper = _CpuHelper.__new__(_CpuHelper)
+    return _helper
+
+
+def _run_op(op: str, packed_schema: bytes, kwargs: Dict[str, Any]) -> bytes:
+    helper = _get_helper()
+    schema = unpack(packed_schema)
+    if op == "recompute":
+        roots = kwargs.get("root_labels")
+        result = helper._recompute_bss_dependency_fields(
+            schema, set(roots) if roots else None, kwargs.get("referencing")
+        )
+    elif op == "document":
+        result = helper._bss_current_document_for_prompt(schema)
+    elif op == "redact":
+        result = helper._redact_bss_schema_for_ui(schema)
+    elif op == "chat_inputs":
+        result = helper._prepare_bss_chat_inputs(schema)
+    else:
+        raise ValueError(f"Unknown cpu pool op: {op}")
+    return pack(result)
+
+
+# ---------------------------------------------------------------------------
+# Parent side
+# ---------------------------------------------------------------------------
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_cpu_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Lazy per-process singleton; None when BSS_CPU_POOL_WORKERS <= 0.
+    """
+    global _pool
+    if BSS_CPU_POOL_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: never fork a process holding DB connections and threads
+                _pool = ProcessPoolExecutor(
+                    max_workers=BSS_CPU_POOL_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                logger.info("BSS CPU pool started with %d process(es)", BSS_CPU_POOL_WORKERS)
+    return _pool
+
+
+def shutdown_cpu_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def prewarm_cpu_pool() -> None:
+    """
+    Start the child processes and import the BSS helpers there now,
+    so the first offloaded call does not pay for it.
+    """
+    pool = get_cpu_pool()
+    if pool is None:
+        return
+    futures = [pool.submit(_run_op, "document", pack({}), {}) for _ in range(BSS_CPU_POOL_WORKERS)]
+    for f in futures:
+        f.result()
+
+
+def _label_count(bss_schema: Any) -> int:
+    if isinstance(bss_schema, BssGraph):
+        return len(bss_schema)
+    if not isinstance(bss_schema, dict):
+        return 0
+    return sum(len(v) for k, v in bss_schema.items() if k != "metadata" and isinstance(v, dict))
+
+
+class CpuOffload:
+    """
+    Mixin placed in front of Utils / BssChatSupport (see Backend): overrides the
+    pure CPU-heavy helpers to run in the process pool when it is enabled and the
+    schema is big enough; otherwise (or on any pool failure) it calls the
+    in-thread implementation via super().
+    """
+
+    def _cpu_offload(self, op: str, bss_schema: Any, **kwargs) -> Any:
+        pool = get_cpu_pool()
+        if pool is None or _label_count(bss_schema) < BSS_CPU_POOL_MIN_ITEMS:
+            raise _NotOffloaded()
+        if isinstance(bss_schema, BssGraph):
+            # the child builds its own graph from the document
+            bss_schema = bss_schema.to_schema()
+        try:
+            blob = pool.submit(_run_op, op, pack(bss_schema), kwargs).result(timeout=BSS_CPU_POOL_TIMEOUT)
+        except Exception as e:
+            logger.info("BSS CPU pool %s failed, running in-thread: %s", op, e)
+            if isinstance(e, BrokenProcessPool):
+                # a child died (e.g. OOM): start a fresh pool on the next call
+                shutdown_cpu_pool()
+            raise _NotOffloaded() from e
+        return unpack(blob)
+
+    def _recompute_bss_dependency_fields(
+        self,
+        bss_schema: dict | BssGraph,
+        root_labels: set[str] | None = None,
+        referencing: dict[str, list[str]] | None = None,
+    ) -> dict:
+        try:
+            return self._cpu_offload(
+                "recompute",
+                bss_schema,
+                root_labels=sorted(root_labels) if root_labels else None,
+                referencing=referencing,
+            )
+        except _NotOffloaded:
+            return super()._recompute_bss_dependency_fields(bss_schema, root_labels, referencing)
+
+    def _bss_current_document_for_prompt(self, bss_schema: dict | BssGraph) -> str:
+        try:
+            return self._cpu_offload("document", bss_schema)
+        except _NotOffloaded:
+            return super()._bss_current_document_for_prompt(bss_schema)
+
+    def _redact_bss_schema_for_ui(self, bss_schema: dict) -> dict:
+        try:
+            return self._cpu_offload("redact", bss_schema)
+        except _NotOffloaded:
+            return super()._redact_bss_schema_for_ui(bss_schema)
+
+    def _prepare_bss_chat_inputs(self, bss_schema: dict | BssGraph) -> dict:
+        try:
+            return self._cpu_offload("chat_inputs", bss_schema)
+        except _NotOffloaded:
+            return super()._prepare_bss_chat_inputs(bss_schema)
+
+
+class _NotOffloaded(Exception):
+    pass
@@ -6,7 +6,9 @@ from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey
 from sqlalchemy.orm import Mapped, declarative_base, mapped_column
 from sqlalchemy.dialects.postgresql import JSONB, UUID as PGUUID
 from sqlalchemy import (
+    BigInteger,
     Boolean,
+    SmallInteger,
     Column,
     DateTime,
     ForeignKey,
@@ -54,6 +56,20 @@ class QueueMessage(Base):
 
     created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
 
+    # Lease held by the worker that claimed the row (NULL = never claimed).
+    # The row is deleted on ack; an expired lease makes it claimable again.
+    leased_by = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+
+    # 0 = batch, 1 = normal, 2 = interactive (see classes/queue_priority.py)
+    priority = Column(SmallInteger, nullable=False, default=1, server_default=text("1"))
+
+    # Claims filter by receiver_id and take the highest priority, oldest rows first.
+    __table_args__ = (
+        Index("ix_queue_messages_receiver_created", "receiver_id", "created_at"),
+        Index("ix_queue_messages_receiver_priority_created", "receiver_id", priority.desc(), "created_at"),
+    )
+
 class Project(Base, TimestampMixin):
     __tablename__ = "project"
 
@@ -122,6 +138,13 @@ class Project(Base, TimestampMixin):
         server_default=text("false"),
     )
 
+    # bumped by every bss_schema / bss_node write (optimistic concurrency, see classes/bss_cache.py)
+    version: Mapped[int] = mapped_column(
+        BigInteger,
+        nullable=False,
+        server_default=text("0"),
+    )
+
     # NEW: structured JSON blobs
     preliminary_schema: Mapped[dict[str, object]] = mapped_column(
         JSONB,
@@ -133,6 +156,12 @@ class Project(Base, TimestampMixin):
         nullable=False,
         server_default=text("'{}'::jsonb"),
     )
+    # redacted copy of bss_schema for the editor, current while bss_ui_version = version
+    # (BSS_UI_VIEW, see classes/bss_ui_view.py)
+    bss_ui: Mapped[dict[str, object] | None] = mapped_column(JSONB(none_as_null=True))
+    bss_ui_version: Mapped[int | None] = mapped_column(BigInteger)
+    # bss_ref rows (reference index) describe this version (see classes/bss_ref_index.py)
+    bss_ref_version: Mapped[int | None] = mapped_column(BigInteger)
     pre_flight_data: Mapped[dict[str, object]] = mapped_column(
         JSONB,
         nullable=False,
@@ -160,6 +189,62 @@ class Project(Base, TimestampMixin):
     )
 
 
+class BssNode(Base):
+    """
+    One BSS item of a project when BSS_STORAGE=nodes (see classes/bss_nodes.py).
+    Project.bss_schema then only keeps the "metadata" section.
+    """
+    __tablename__ = "bss_node"
+
+    project_id: Mapped[UUID] = mapped_column(
+        PGUUID(as_uuid=False),
+        ForeignKey("project.project_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    label: Mapped[str] = mapped_column(Text, primary_key=True)
+    # key of the section dict holding the item ("" = top level, legacy flat documents)
+    section: Mapped[str] = mapped_column(Text, nullable=False, server_default=text("''"))
+
+    status: Mapped[str | None] = mapped_column(Text)
+    definition: Mapped[str | None] = mapped_column(Text)
+    open_items: Mapped[str | None] = mapped_column(Text)
+    ask_log: Mapped[str | None] = mapped_column(Text)
+    dependencies: Mapped[str | None] = mapped_column(Text)
+    dependants: Mapped[str | None] = mapped_column(Text)
+    cancelled: Mapped[bool | None] = mapped_column(Boolean)
+    # any other keys of the item, as they were
+    extra: Mapped[dict[str, object] | None] = mapped_column(JSONB(none_as_null=True))
+
+    # hash of all the above: a save rewrites only the nodes whose hash changed
+    fingerprint: Mapped[str] = mapped_column(Text, nullable=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text("1"))
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
+    # {"format": ..., "item": redacted item or null} (BSS_UI_VIEW, see classes/bss_ui_view.py)
+    ui_item: Mapped[dict[str, object] | None] = mapped_column(JSONB(none_as_null=True))
+
+
+class BssRef(Base):
+    """
+    Reverse-reference index of a project's BSS document: `label` mentions the
+    label whose label_key() is `ref_key` (see classes/bss_ref_index.py).
+    """
+    __tablename__ = "bss_ref"
+
+    project_id: Mapped[UUID] = mapped_column(
+        PGUUID(as_uuid=False),
+        ForeignKey("project.project_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    ref_key: Mapped[str] = mapped_column(Text, primary_key=True)
+    label: Mapped[str] = mapped_column(Text, primary_key=True)
+
+    __table_args__ = (
+        Index("ix_bss_ref_project_label", "project_id", "label"),
+    )
+
+
 class Job(Base):
     __tablename__ = "job"
 
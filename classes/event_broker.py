@@ -0,0 +1,560 @@
+# classes/event_broker.py
+"""
+Response delivery for server.py.
+
+Events for the browser are kept per key ("<username>__<project_name>", the same
+prefix the response files carry) in a broker. GET /events drains the caller's
+key, optionally long-polling until something arrives; /events/stream (SSE) and
+/events/ws (WebSocket) push them as they arrive, each with an event id the
+client can resume from after a dropped connection.
+
+  - MemoryEventBroker: per-key asyncio queues in this process. Enough for a
+    single server process.
+  - PostgresEventBroker: rows in server_events + NOTIFY, for several server
+    processes behind one load balancer (any of them may ingest an event,
+    any of them may serve the poll).
+  - ResponseDirIngestor: the one reader of events/response. One directory
+    scan per interval for the whole process (instead of one per client poll);
+    each file is claimed by an atomic rename, published, then deleted. A file
+    that does not parse yet (still being written) goes back and is retried,
+    until it is EVENT_RESPONSE_GRACE_SECONDS old.
+"""
+
+import abc
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+from uuid import uuid4
+
+
+logger = logging.getLogger("kahuna_backend")
+
+EVENT_BROKER = os.getenv("EVENT_BROKER", "memory").strip().lower()
+# Events kept per key before the oldest ones are dropped (nobody is polling)
+EVENT_BROKER_MAX_PENDING = int(os.getenv("EVENT_BROKER_MAX_PENDING", "1000"))
+# Keys nobody polled for this long are forgotten
+EVENT_BROKER_IDLE_SECONDS = float(os.getenv("EVENT_BROKER_IDLE_SECONDS", "3600"))
+# Postgres broker: delivered events stay this long for stream resumes
+EVENT_REPLAY_SECONDS = float(os.getenv("EVENT_REPLAY_SECONDS", "300"))
+# Response files that still do not parse after this long are dropped
+EVENT_RESPONSE_GRACE_SECONDS = float(os.getenv("EVENT_RESPONSE_GRACE_SECONDS", "60"))
+
+
+def event_key(safe_user: str, safe_project: str) -> str:
+    return f"{safe_user}__{safe_project}"
+
+
+class EventBroker(abc.ABC):
+    """
+    publish(key, event) / fetch(key, wait): fetch returns every pending event
+    for key, in publish order, waiting up to `wait` seconds for the first one.
+    """
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def publish(self, key: str, event: Any) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def fetch(self, key: str, wait: float = 0.0) -> List[Any]:
+        ...
+
+    @abc.abstractmethod
+    def stream(
+        self, key: str, after: Optional[str] = None, heartbeat: float = 15.0
+    ) -> AsyncIterator[Optional[Tuple[str, Any]]]:
+        """
+        Endless async iterator of (event_id, event) for key, starting after the
+        event id `after` (None: only what was not delivered yet is replayed, then
+        new events). Yields None when nothing arrived for `heartbeat` seconds.
+        Streamed events count as delivered: a later fetch() does not repeat them.
+        """
+
+    def metrics(self) -> Dict[str, Any]:
+        return {}
+
+
+class _Mailbox:
+    __slots__ = ("log", "next_seq", "delivered_seq", "arrived", "touched")
+
+    def __init__(self, max_pending: int):
+        # (seq, event), oldest first: undelivered events plus the replay window
+        self.log: Deque[Tuple[int, Any]] = deque(maxlen=max_pending)
+        self.next_seq = 1
+        self.delivered_seq = 0   # every seq <= this went out to a poll or a stream
+        self.arrived = asyncio.Event()
+        self.touched = time.monotonic()
+
+
+class MemoryEventBroker(EventBroker):
+    """
+    In-process broker. Must be used from one event loop (the server's).
+
+    Each key keeps its last max_pending events with a per-key sequence number.
+    Polls return what was not delivered yet; streams resume from a cursor
+    ("<boot>:<seq>") and replay whatever the log still holds after it. A cursor
+    from before a restart (other boot id) replays the whole log.
+    """
+
+    def __init__(
+        self,
+        max_pending: int = EVENT_BROKER_MAX_PENDING,
+        idle_seconds: float = EVENT_BROKER_IDLE_SECONDS,
+    ):
+        self.max_pending = max(1, max_pending)
+        self.idle_seconds = idle_seconds
+        self._boxes: Dict[str, _Mailbox] = {}
+        self._next_sweep = time.monotonic() + idle_seconds
+        self._boot = uuid4().hex[:8]
+        self.published = 0
+        self.dropped = 0
+
+    def _box(self, key: str) -> _Mailbox:
+        box = self._boxes.get(key)
+        if box is None:
+            box = self._boxes[key] = _Mailbox(self.max_pending)
+        box.touched = time.monotonic()
+        return box
+
+    def _sweep_if_due(self) -> None:
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.idle_seconds
+        for key in [k for k, b in self._boxes.items() if now - b.touched > self.idle_seconds]:
+            del self._boxes[key]
+
+    def _cursor(self, seq: int) -> str:
+        return f"{self._boot}:{seq}"
+
+    def _parse_cursor(self, cursor: Optional[str]) -> int:
+        boot, _, seq = (cursor or "").partition(":")
+        if boot != self._boot or not seq.isdigit():
+            return 0
+        return int(seq)
+
+    async def publish(self, key: str, event: Any) -> None:
+        box = self._boxes.get(key) or self._box(key)
+        if len(box.log) == box.log.maxlen and box.log[0][0] > box.delivered_seq:
+            self.dropped += 1   # nobody collected it in time
+        box.log.append((box.next_seq, event))
+        box.next_seq += 1
+        self.published += 1
+        # wake every poll and stream waiting on this key
+        box.arrived.set()
+        box.arrived = asyncio.Event()
+        self._sweep_if_due()
+
+    async def _wait(self, box: _Mailbox, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(box.arrived.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        box.touched = time.monotonic()
+
+    async def fetch(self, key: str, wait: float = 0.0) -> List[Any]:
+        box = self._box(key)
+        if box.next_seq - 1 <= box.delivered_seq and wait > 0:
+            await self._wait(box, wait)
+        events = [e for seq, e in box.log if seq > box.delivered_seq]
+        box.delivered_seq = box.next_seq - 1
+        return events
+
+    async def stream(
+        self, key: str, after: Optional[str] = None, heartbeat: float = 15.0
+    ) -> AsyncIterator[Optional[Tuple[str, Any]]]:
+        box = self._box(key)
+        last = self._parse_cursor(after) if after else box.delivered_seq
+        while True:
+            box = self._box(key)   # may have been swept and recreated
+            batch = [(seq, e) for seq, e in box.log if seq > last]
+            if not batch:
+                await self._wait(box, heartbeat)
+                if not any(seq > last for seq, _ in box.log):
+                    yield None
+                continue
+            for seq, event in batch:
+                yield self._cursor(seq), event
+                last = seq
+            box.delivered_seq = max(box.delivered_seq, last)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "broker": "memory",
+            "keys": len(self._boxes),
+            "pending": sum(
+                sum(1 for seq, _ in b.log if seq > b.delivered_seq) for b in self._boxes.values()
+            ),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+
+SERVER_EVENTS_CHANNEL = "server_events"
+
+SERVER_EVENTS_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS server_events (
+        id BIGSERIAL PRIMARY KEY,
+        event_key VARCHAR NOT NULL,
+        payload JSONB NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """,
+    "ALTER TABLE server_events ADD COLUMN IF NOT EXISTS delivered_at TIMESTAMPTZ",
+    "CREATE INDEX IF NOT EXISTS ix_server_events_key_id ON server_events (event_key, id)",
+]
+
+
+class PostgresEventBroker(EventBroker):
+    """
+    Shared broker: publish() inserts a row and NOTIFYs SERVER_EVENTS_CHANNEL with
+    the key; fetch() marks the key's undelivered rows delivered and returns them;
+    stream() follows the key by row id (the event id). Each process keeps one
+    LISTEN connection and wakes its local long-polls and streams for the
+    notified key. Without LISTEN (other driver, dropped connection) they
+    re-check every poll_interval seconds.
+
+    Delivered rows are kept EVENT_REPLAY_SECONDS for stream resumes, undelivered
+    ones EVENT_BROKER_IDLE_SECONDS; a sweep on the poll path deletes the rest.
+    """
+
+    LISTEN_RETRY_SECONDS = 30.0
+
+    def __init__(self, engine, poll_interval: float = 1.0):
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self._waiters: Dict[str, Set[asyncio.Event]] = {}
+        self._raw = None
+        self._conn = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._next_listen_attempt = 0.0
+        self._next_sweep = 0.0
+        self.published = 0
+
+    async def start(self) -> None:
+        from sqlalchemy import text
+
+        def _ddl() -> None:
+            with self.engine.begin() as conn:
+                for stmt in SERVER_EVENTS_DDL:
+                    conn.execute(text(stmt))
+
+        await asyncio.to_thread(_ddl)
+        self._loop = asyncio.get_running_loop()
+        self._listen()
+
+    async def stop(self) -> None:
+        self._unlisten()
+
+    def _listen(self) -> None:
+        self._next_listen_attempt = time.monotonic() + self.LISTEN_RETRY_SECONDS
+        raw = None
+        try:
+            raw = self.engine.raw_connection()
+            raw.detach()
+            conn = getattr(raw, "driver_connection", None) or raw.dbapi_connection
+            if not (hasattr(conn, "poll") and hasattr(conn, "notifies") and hasattr(conn, "fileno")):
+                raw.close()
+                return
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute(f'LISTEN "{SERVER_EVENTS_CHANNEL}"')
+            cur.close()
+            self._loop.add_reader(conn.fileno(), self._on_readable)
+        except Exception as e:
+            logger.info("server_events LISTEN setup failed, long-polls will re-check: %s", e)
+            if raw is not None:
+                try:
+                    raw.close()
+                except Exception:
+                    pass
+            return
+        self._raw, self._conn = raw, conn
+
+    def _unlisten(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            self._loop.remove_reader(conn.fileno())
+        except Exception:
+            pass
+        try:
+            self._raw.close()
+        except Exception:
+            pass
+        self._raw = None
+
+    def _on_readable(self) -> None:
+        conn = self._conn
+        try:
+            conn.poll()
+        except Exception as e:
+            logger.info("server_events LISTEN connection lost: %s", e)
+            self._unlisten()
+            for waiters in self._waiters.values():
+                for waiter in waiters:
+                    waiter.set()
+            return
+        while conn.notifies:
+            note = conn.notifies.pop(0)
+            for waiter in self._waiters.get(note.payload, ()):
+                waiter.set()
+
+    async def publish(self, key: str, event: Any) -> None:
+        from sqlalchemy import text
+
+        def _insert() -> None:
+            with self.engine.begin() as conn:
+                conn.execute(
+                    text(
+                        "INSERT INTO server_events (event_key, payload) VALUES (:k, CAST(:p AS JSONB))"
+                    ),
+                    {"k": key, "p": json.dumps(event, default=str)},
+                )
+                conn.execute(text("SELECT pg_notify(:c, :k)"), {"c": SERVER_EVENTS_CHANNEL, "k": key})
+
+        await asyncio.to_thread(_insert)
+        self.published += 1
+
+    def _take(self, key: str) -> List[Any]:
+        from sqlalchemy import text
+
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                text(
+                    "UPDATE server_events SET delivered_at = now() WHERE id IN ("
+                    "  SELECT id FROM server_events WHERE event_key = :k AND delivered_at IS NULL"
+                    "  ORDER BY id FOR UPDATE SKIP LOCKED"
+                    ") RETURNING id, payload"
+                ),
+                {"k": key},
+            ).all()
+        return [r.payload for r in sorted(rows, key=lambda r: r.id)]
+
+    def _read_after(self, key: str, after: Optional[int]) -> Tuple[List[Tuple[int, Any]], int]:
+        """
+        Rows of key with id > after (after=None: the undelivered ones), marked
+        delivered, and the id to continue after.
+        """
+        from sqlalchemy import text
+
+        cond = "delivered_at IS NULL" if after is None else "id > :after"
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                text(f"SELECT id, payload FROM server_events WHERE event_key = :k AND {cond} ORDER BY id LIMIT 500"),
+                {"k": key, "after": after},
+            ).all()
+            if not rows:
+                if after is None:
+                    after = conn.execute(
+                        text("SELECT coalesce(max(id), 0) FROM server_events WHERE event_key = :k"), {"k": key}
+                    ).scalar()
+                return [], after
+            conn.execute(
+                text(
+                    "UPDATE server_events SET delivered_at = now() "
+                    "WHERE event_key = :k AND id <= :last AND delivered_at IS NULL"
+                ),
+                {"k": key, "last": rows[-1].id},
+            )
+        return [(r.id, r.payload) for r in rows], rows[-1].id
+
+    def _sweep(self) -> None:
+        from sqlalchemy import text
+
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "DELETE FROM server_events WHERE "
+                    "(delivered_at IS NOT NULL AND delivered_at < now() - make_interval(secs => :replay)) "
+                    "OR created_at < now() - make_interval(secs => :idle)"
+                ),
+                {"replay": EVENT_REPLAY_SECONDS, "idle": EVENT_BROKER_IDLE_SECONDS},
+            )
+
+    def _keep_up(self) -> None:
+        now = time.monotonic()
+        if self._conn is None and self._loop is not None and now >= self._next_listen_attempt:
+            self._listen()
+        if now >= self._next_sweep:
+            self._next_sweep = now + max(10.0, EVENT_REPLAY_SECONDS / 5.0)
+            asyncio.create_task(asyncio.to_thread(self._sweep))
+
+    def _add_waiter(self, key: str) -> asyncio.Event:
+        waiter = asyncio.Event()
+        self._waiters.setdefault(key, set()).add(waiter)
+        return waiter
+
+    def _remove_waiter(self, key: str, waiter: asyncio.Event) -> None:
+        waiters = self._waiters.get(key)
+        if waiters is not None:
+            waiters.discard(waiter)
+            if not waiters:
+                del self._waiters[key]
+
+    async def _wait(self, waiter: asyncio.Event, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(waiter.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def fetch(self, key: str, wait: float = 0.0) -> List[Any]:
+        deadline = time.monotonic() + max(0.0, wait)
+        self._keep_up()
+        waiter = self._add_waiter(key)
+        try:
+            while True:
+                waiter.clear()
+                events = await asyncio.to_thread(self._take, key)
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                await self._wait(waiter, min(remaining, self.poll_interval))
+        finally:
+            self._remove_waiter(key, waiter)
+
+    async def stream(
+        self, key: str, after: Optional[str] = None, heartbeat: float = 15.0
+    ) -> AsyncIterator[Optional[Tuple[str, Any]]]:
+        last = int(after) if after and after.isdigit() else None
+        waiter = self._add_waiter(key)
+        try:
+            idle_since = time.monotonic()
+            while True:
+                self._keep_up()
+                waiter.clear()
+                rows, next_after = await asyncio.to_thread(self._read_after, key, last)
+                for row_id, event in rows:
+                    yield str(row_id), event
+                    last = row_id
+                last = next_after
+                if rows:
+                    idle_since = time.monotonic()
+                    continue
+                if time.monotonic() - idle_since >= heartbeat:
+                    idle_since = time.monotonic()
+                    yield None
+                await self._wait(waiter, min(heartbeat, self.poll_interval))
+        finally:
+            self._remove_waiter(key, waiter)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "broker": "postgres",
+            "listening": self._conn is not None,
+            "waiting_keys": len(self._waiters),
+            "published": self.published,
+        }
+
+
+def build_event_broker(kind: str = EVENT_BROKER) -> EventBroker:
+    if kind == "postgres":
+        from classes.GCConnection_hlpr import get_db_engine
+
+        return PostgresEventBroker(get_db_engine())
+    if kind != "memory":
+        raise ValueError(f"Unknown EVENT_BROKER: {kind} (expected memory | postgres)")
+    return MemoryEventBroker()
+
+
+class ResponseDirIngestor:
+    """
+    Moves response files ("<user>__<project>__<anything>.json") from
+    `directory` into the broker, in file name order.
+
+    A file is claimed by renaming it into `claim_dir` first, so with several
+    server processes each file is published exactly once.
+    """
+
+    def __init__(self, broker: EventBroker, directory: str, claim_dir: str, interval: float = 0.1):
+        self.broker = broker
+        self.directory = directory
+        self.claim_dir = claim_dir
+        self.interval = interval
+        self.ingested = 0
+        self._unpublished: List[tuple] = []   # claimed, publish failed: retried first
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _claim_batch(self) -> List[tuple]:
+        try:
+            names = sorted(e.name for e in os.scandir(self.directory) if e.is_file())
+        except FileNotFoundError:
+            return []
+
+        out = []
+        for name in names:
+            parts = name.split("__", 2)
+            if len(parts) < 3:
+                continue
+            claimed = os.path.join(self.claim_dir, name)
+            try:
+                os.replace(os.path.join(self.directory, name), claimed)
+            except FileNotFoundError:
+                continue   # another process took it
+            try:
+                with open(claimed, "r") as f:
+                    data = json.load(f)
+            except Exception as e:
+                self._unclaim(name, claimed, e)
+                continue
+            try:
+                os.remove(claimed)
+            except FileNotFoundError:
+                pass
+            out.append((event_key(parts[0], parts[1]), data))
+        return out
+
+    def _unclaim(self, name: str, claimed: str, error: Exception) -> None:
+        """
+        A file that does not parse may still be being written: put it back
+        for the next scan, unless it is older than the grace period.
+        """
+        try:
+            age = time.time() - os.stat(claimed).st_mtime
+            if age > EVENT_RESPONSE_GRACE_SECONDS:
+                logger.warning("Dropping unreadable response file %s (%.0f s old): %s", name, age, error)
+                os.remove(claimed)
+            else:
+                os.replace(claimed, os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if not self._unpublished:
+                    self._unpublished = await asyncio.to_thread(self._claim_batch)
+                while self._unpublished:
+                    key, data = self._unpublished[0]
+                    await self.broker.publish(key, data)
+                    self._unpublished.pop(0)
+                    self.ingested += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.info("Response ingest failed: %s", e)
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,311 @@
+# classes/fair_scheduler.py
+
+import os
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from classes.queue_priority import effective_priority
+
+
+def _parse_lane_map(raw: str) -> Dict[str, float]:
+    """
+    "chat=4,ingestion=1" -> {"chat": 4.0, "ingestion": 1.0}
+    """
+    out: Dict[str, float] = {}
+    for part in (raw or "").split(","):
+        if "=" not in part:
+            continue
+        name, value = part.split("=", 1)
+        try:
+            out[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return out
+
+
+# Per-lane overrides, e.g. QUEUE_LANE_CAPS="chat=6,ingestion=1"
+QUEUE_LANE_CAPS = _parse_lane_map(os.getenv("QUEUE_LANE_CAPS", ""))
+QUEUE_LANE_WEIGHTS = _parse_lane_map(os.getenv("QUEUE_LANE_WEIGHTS", ""))
+# Max jobs of one project (sender_id) leased and waiting in its mailbox;
+# more than one lets consecutive cheap edits be coalesced into a batch
+QUEUE_PROJECT_PREFETCH = int(os.getenv("QUEUE_PROJECT_PREFETCH", "8"))
+
+
+class Lane:
+    """
+    A class of request types sharing a concurrency cap and a scheduling weight.
+    types=None makes it the catch-all lane (every type no other lane lists).
+    """
+
+    def __init__(self, name: str, types: Optional[Iterable[str]], max_concurrent: int, weight: float):
+        self.name = name
+        self.types: Optional[Set[str]] = set(types) if types is not None else None
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.weight = max(0.1, float(weight))
+        self.buffer: Deque[Dict[str, Any]] = deque()
+        self.in_flight = 0
+        self.dispatched = 0
+        self._current = 0.0   # smooth weighted round-robin state
+        # queue age (created_at -> dispatch) of the last dispatched jobs, seconds
+        self.waits: Deque[float] = deque(maxlen=512)
+
+
+def default_lanes(max_concurrent: int) -> List[Lane]:
+    """
+    chat      – interactive turns, may use every slot, highest weight
+    edits     – everything else (loads, saves, manual edits): short, interactive
+    ingestion – dozens of sequential LLM calls, capped to a quarter of the slots
+    """
+    specs = [
+        ("chat", {"bss_chat"}, max_concurrent, 4),
+        ("ingestion", {"ingestion"}, max(1, max_concurrent // 4), 1),
+        ("edits", None, max_concurrent, 2),
+    ]
+    return [
+        Lane(
+            name,
+            types,
+            int(QUEUE_LANE_CAPS.get(name, cap)),
+            QUEUE_LANE_WEIGHTS.get(name, weight),
+        )
+        for name, types, cap, weight in specs
+    ]
+
+
+class FairScheduler:
+    """
+    Local dispatch policy of AsyncGuard.
+
+    - Each claimed job goes to its lane's buffer (by job type) and to its
+      project's mailbox (by sender_id, in claim order = created_at order).
+    - A project runs one thing at a time: only the head of an idle project's
+      mailbox is runnable, so two jobs never load-mutate-save the same
+      bss_schema concurrently, and a project's requests run in order.
+    - next_job() picks among lanes that have a free slot and a runnable job
+      using smooth weighted round-robin; within a lane the runnable job with
+      the highest aged priority (see queue_priority.effective_priority) wins,
+      the oldest one on ties. If the picked job is in coalesce_types, the consecutive
+      coalescible jobs behind it in the same mailbox are taken with it and
+      run as one batch (one slot).
+    - claim_specs() says how many rows to lease per lane, so a lane that is
+      full (e.g. ingestion) does not take buffer room from the others;
+      saturated_projects() lets the claim skip projects that already have
+      project_prefetch jobs waiting here.
+    - The global cap (max_concurrent) is still enforced by the caller.
+    """
+
+    BUFFER_FACTOR = 4
+
+    def __init__(
+        self,
+        lanes: List[Lane],
+        coalesce_types: Optional[Iterable[str]] = None,
+        project_prefetch: int = QUEUE_PROJECT_PREFETCH,
+        max_batch: int = 32,
+    ):
+        self.lanes = lanes
+        self.coalesce_types: Set[str] = set(coalesce_types or ())
+        self.project_prefetch = max(1, project_prefetch)
+        self.max_batch = max(1, max_batch)
+        self._by_type: Dict[str, Lane] = {}
+        self._catch_all: Optional[Lane] = None
+        for lane in lanes:
+            if lane.types is None:
+                self._catch_all = lane
+            else:
+                for t in lane.types:
+                    self._by_type[t] = lane
+        if self._catch_all is None:
+            raise ValueError("FairScheduler needs one catch-all lane (types=None)")
+        self._mailboxes: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._running_projects: Set[str] = set()
+        self._batch_lane: Dict[str, Lane] = {}   # head job id -> lane holding the slot
+        self.coalesced = 0
+
+    # ---------- routing ----------
+
+    def lane_for(self, msg_type: Optional[str]) -> Lane:
+        return self._by_type.get(msg_type or "", self._catch_all)
+
+    def claim_specs(self, prefetch: int) -> List[Tuple[Optional[Set[str]], Set[str], int]]:
+        """
+        [(include_types | None, exclude_types, limit), ...] for QueueLeaseStore.claim_lanes().
+        Each lane is topped up to max_concurrent + its share of prefetch runnable
+        jobs. Jobs queued behind their project's mailbox head do not count (one
+        busy project must not keep other projects from being claimed), but the
+        lane never buffers more than BUFFER_FACTOR times its target.
+        """
+        listed = set(self._by_type)
+        per_lane_prefetch = max(1, prefetch // max(1, len(self.lanes))) if prefetch else 0
+        specs = []
+        for lane in self.lanes:
+            target = lane.max_concurrent + per_lane_prefetch
+            ready = sum(1 for job in lane.buffer if self._is_head(job))
+            want = min(target - lane.in_flight - ready, self.BUFFER_FACTOR * target - len(lane.buffer))
+            if want <= 0:
+                continue
+            if lane.types is None:
+                specs.append((None, listed, want))
+            else:
+                specs.append((set(lane.types), set(), want))
+        return specs
+
+    def add(self, job: Dict[str, Any]) -> None:
+        self.lane_for(job.get("type")).buffer.append(job)
+        self._mailboxes.setdefault(_project_of(job), deque()).append(job)
+
+    # ---------- dispatch ----------
+
+    def _is_head(self, job: Dict[str, Any]) -> bool:
+        project = _project_of(job)
+        return project not in self._running_projects and self._mailboxes[project][0] is job
+
+    def _runnable(self, lane: Lane, now: datetime) -> Optional[Dict[str, Any]]:
+        if lane.in_flight >= lane.max_concurrent:
+            return None
+        best, best_priority = None, None
+        for job in lane.buffer:
+            if not self._is_head(job):
+                continue
+            priority = effective_priority(job.get("priority"), job.get("created_at"), now)
+            # buffer is in claim order, so the first one wins ties
+            if best is None or priority > best_priority:
+                best, best_priority = job, priority
+        return best
+
+    def _take_batch(self, head: Dict[str, Any]) -> List[Dict[str, Any]]:
+        mailbox = self._mailboxes[_project_of(head)]
+        batch = [mailbox.popleft()]
+        batch_id = _client_batch_of(head)
+        if batch_id is not None:
+            # rows of one client batch were inserted together: consecutive here
+            while mailbox and len(batch) < self.max_batch and _client_batch_of(mailbox[0]) == batch_id:
+                batch.append(mailbox.popleft())
+        elif head.get("type") in self.coalesce_types:
+            while mailbox and len(batch) < self.max_batch and mailbox[0].get("type") in self.coalesce_types:
+                batch.append(mailbox.popleft())
+        if not mailbox:
+            del self._mailboxes[_project_of(head)]
+
+        for job in batch:
+            self.lane_for(job.get("type")).buffer.remove(job)
+        self.coalesced += len(batch) - 1
+        return batch
+
+    def next_job(self) -> Optional[List[Dict[str, Any]]]:
+        """
+        Next batch to run (usually a single job), or None.
+        """
+        now = datetime.now(timezone.utc)
+        candidates = []
+        for lane in self.lanes:
+            job = self._runnable(lane, now)
+            if job is not None:
+                candidates.append((lane, job))
+        if not candidates:
+            return None
+
+        # smooth weighted round-robin (each eligible lane gains its weight,
+        # the winner pays back the total)
+        total = 0.0
+        for lane, _ in candidates:
+            lane._current += lane.weight
+            total += lane.weight
+        lane, head = max(candidates, key=lambda c: c[0]._current)
+        lane._current -= total
+
+        batch = self._take_batch(head)
+        lane.in_flight += 1
+        lane.dispatched += len(batch)
+        for job in batch:
+            age = _age_seconds(job, now)
+            if age is not None:
+                lane.waits.append(age)
+        self._running_projects.add(_project_of(head))
+        self._batch_lane[head["id"]] = lane
+        return batch
+
+    def finish(self, batch: List[Dict[str, Any]]) -> None:
+        lane = self._batch_lane.pop(batch[0]["id"], None)
+        if lane is None:
+            return
+        lane.in_flight = max(0, lane.in_flight - 1)
+        self._running_projects.discard(_project_of(batch[0]))
+
+    # ---------- buffer bookkeeping ----------
+
+    def saturated_projects(self) -> Set[str]:
+        return {p for p, mailbox in self._mailboxes.items() if len(mailbox) >= self.project_prefetch}
+
+    def buffered_ids(self) -> Set[str]:
+        return {j["id"] for lane in self.lanes for j in lane.buffer}
+
+    def buffered_count(self) -> int:
+        return sum(len(lane.buffer) for lane in self.lanes)
+
+    def ready_count(self) -> int:
+        """
+        Buffered jobs that could start as soon as a slot frees up.
+        """
+        return sum(1 for lane in self.lanes for job in lane.buffer if self._is_head(job))
+
+    def drop(self, ids: Set[str]) -> None:
+        for lane in self.lanes:
+            lane.buffer = deque(j for j in lane.buffer if j["id"] not in ids)
+        for project in list(self._mailboxes):
+            mailbox = deque(j for j in self._mailboxes[project] if j["id"] not in ids)
+            if mailbox:
+                self._mailboxes[project] = mailbox
+            else:
+                del self._mailboxes[project]
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Per lane: slots, buffer, and queue age (created_at -> dispatch) of the
+        recently dispatched jobs, plus the age of the oldest job still buffered.
+        """
+        now = datetime.now(timezone.utc)
+        lanes = {}
+        for lane in self.lanes:
+            waits = sorted(lane.waits)
+            buffered_ages = [a for a in (_age_seconds(j, now) for j in lane.buffer) if a is not None]
+            lanes[lane.name] = {
+                "in_flight": lane.in_flight,
+                "buffered": len(lane.buffer),
+                "dispatched": lane.dispatched,
+                "max_concurrent": lane.max_concurrent,
+                "weight": lane.weight,
+                "wait_p50_s": _percentile(waits, 0.50),
+                "wait_p95_s": _percentile(waits, 0.95),
+                "wait_max_s": round(waits[-1], 3) if waits else None,
+                "oldest_buffered_s": round(max(buffered_ages), 3) if buffered_ages else None,
+            }
+        return {"lanes": lanes, "mailboxes": len(self._mailboxes), "coalesced": self.coalesced}
+
+
+def _age_seconds(job: Dict[str, Any], now: datetime) -> Optional[float]:
+    created_at = job.get("created_at")
+    if created_at is None:
+        return None
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (now - created_at).total_seconds())
+
+
+def _percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))], 3)
+
+
+def _client_batch_of(job: Dict[str, Any]) -> Optional[str]:
+    payload = job.get("payload")
+    if isinstance(payload, dict) and payload.get("batch_id"):
+        return str(payload["batch_id"])
+    return None
+
+
+def _project_of(job: Dict[str, Any]) -> str:
+    # sender_id is "<app_key><delim><project_id>": unique per project and app
+    return str(job.get("sender_id"))
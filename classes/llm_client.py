@@ -1,4 +1,6 @@
 import asyncio
+import logging
+import os
 import threading
 import random
 import time
@@ -13,6 +15,11 @@ from classes.model_props import parse_model_name, is_openai_model, estimate_cost
 
 T = TypeVar("T")
 
+logger = logging.getLogger("kahuna_backend")
+
+# Comma-separated model names whose SDK clients are built at worker start
+LLM_PREWARM_MODELS = [m.strip() for m in os.getenv("LLM_PREWARM_MODELS", "").split(",") if m.strip()]
+
 
 class MaxRetryErrorsException(Exception):
     pass
@@ -103,6 +110,85 @@ def call_with_retries_sync(
     raise MaxRetryErrorsException(f"All {retries} retry attempts failed.") from last_exception
 
 
+# ---------------------------------------------------------------------------
+# Process-wide SDK client registry
+# ---------------------------------------------------------------------------
+#
+# LlmClient / ChatLlmClient are built per job (and per refinement step), but
+# the SDK objects behind them (VertexAI / ChatVertexAI / OpenAI) hold the HTTP
+# or gRPC channel and the credentials. Those are shared per process here, so
+# connection setup and auth happen once; the wrappers only keep per-job usage.
+# The SDK clients are safe to call from several threads at once, and the
+# request timeout is passed per call (Vertex) or is part of the key (OpenAI).
+
+_sdk_clients: Dict[Tuple[Any, ...], Any] = {}
+_sdk_clients_lock = threading.Lock()
+_sdk_client_stats = {"created": 0, "reused": 0}
+
+
+def _shared_sdk_client(key: Tuple[Any, ...], factory: Callable[[], T]) -> T:
+    client = _sdk_clients.get(key)
+    if client is not None:
+        _sdk_client_stats["reused"] += 1
+        return client
+    with _sdk_clients_lock:
+        client = _sdk_clients.get(key)
+        if client is None:
+            client = factory()
+            _sdk_clients[key] = client
+            _sdk_client_stats["created"] += 1
+        else:
+            _sdk_client_stats["reused"] += 1
+    return client
+
+
+def _shared_vertex(kind: str, model_name: str, vertex_project: str, vertex_region: str) -> Any:
+    cls = ChatVertexAI if kind == "chat" else VertexAI
+    return _shared_sdk_client(
+        ("vertex", kind, model_name, vertex_project, vertex_region),
+        lambda: cls(project=vertex_project, location=vertex_region, model_name=model_name),
+    )
+
+
+def _shared_openai(timeout: float | None) -> OpenAI:
+    def _build() -> OpenAI:
+        client_kwargs: Dict[str, Any] = {"max_retries": 0}
+        if timeout is not None:
+            client_kwargs["timeout"] = timeout
+        return OpenAI(**client_kwargs)
+
+    return _shared_sdk_client(("openai", timeout), _build)
+
+
+def prewarm_llm_clients(
+    model_names: List[str],
+    *,
+    vertex_project: str,
+    vertex_region: str,
+    timeout: float | None = None,
+) -> int:
+    """
+    Build the completion and chat SDK clients for each model now, so the first
+    job does not pay for client construction and auth. Models that fail are
+    logged and skipped (they are retried lazily on first use).
+    Returns the number of models warmed.
+    """
+    warmed = 0
+    for model_name in model_names:
+        try:
+            LlmClient(model_name, vertex_project=vertex_project, vertex_region=vertex_region, timeout=timeout)
+            ChatLlmClient(model_name, vertex_project=vertex_project, vertex_region=vertex_region, timeout=timeout)
+            warmed += 1
+        except Exception as e:
+            logger.info("LLM client prewarm for %s failed: %s", model_name, e)
+    return warmed
+
+
+def get_llm_registry_metrics() -> Dict[str, int]:
+    with _sdk_clients_lock:
+        return {"clients": len(_sdk_clients), **_sdk_client_stats}
+
+
 class BaseLlmClient:
     """
     Common usage accounting for both completion and chat clients.
@@ -189,6 +275,9 @@ class LlmClient(BaseLlmClient):
     Under the hood:
     - Vertex: VertexAI.invoke(prompt)
     - OpenAI: Responses API (client.responses.create)
+
+    Cheap to build: the SDK client comes from the process-wide registry,
+    this object only carries the usage of the job that built it.
     """
 
     def __init__(
@@ -206,20 +295,12 @@ class LlmClient(BaseLlmClient):
         self._openai_params = None
 
         if self.provider == "vertex":
-            self._vertex = VertexAI(
-                project=vertex_project,
-                location=vertex_region,
-                model_name=model_name,
-            )
+            self._vertex = _shared_vertex("completion", model_name, vertex_project, vertex_region)
             self._client = None
         elif self.provider == "openai":
             self._vertex = None
             self.model_name, self._openai_params = parse_model_name(self.model_name)
-            client_kwargs: Dict[str, Any] = {"max_retries": 0}
-            if timeout is not None:
-                client_kwargs["timeout"] = timeout
-
-            self._client = OpenAI(**client_kwargs)
+            self._client = _shared_openai(timeout)
         else:
             raise ValueError(f"Unknown LLM provider: {self.provider}")
 
@@ -276,6 +357,8 @@ class ChatLlmClient(BaseLlmClient):
     Under the hood:
     - Vertex: ChatVertexAI.invoke(messages)
     - OpenAI: Responses API with input=[{role, content}, ...]
+
+    Like LlmClient, shares its SDK client and keeps its own usage.
     """
 
     def __init__(
@@ -293,20 +376,12 @@ class ChatLlmClient(BaseLlmClient):
         self._openai_params = None
 
         if self.provider == "vertex":
-            self._vertex = ChatVertexAI(
-                project=vertex_project,
-                location=vertex_region,
-                model_name=model_name,
-            )
+            self._vertex = _shared_vertex("chat", model_name, vertex_project, vertex_region)
             self._client = None
         elif self.provider == "openai":
             self._vertex = None
             self.model_name, self._openai_params = parse_model_name(self.model_name)
-            client_kwargs: Dict[str, Any] = {"max_retries": 0}
-            if timeout is not None:
-                client_kwargs["timeout"] = timeout
-
-            self._client = OpenAI(**client_kwargs)
+            self._client = _shared_openai(timeout)
         else:
             raise ValueError(f"Unknown LLM provider: {self.provider}")
 
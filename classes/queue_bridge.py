@@ -0,0 +1,332 @@
+# classes/queue_bridge.py
+"""
+server.py <-> worker over queue_messages, without the file hop.
+
+  - Requests: POST /events inserts the row the worker claims:
+      sender_id   = "bss_chat::<project_id>"  (the reply address)
+      receiver_id = QUEUE_RECEIVER_ID
+      type / payload from the event, priority from the type.
+  - Replies: the worker addresses emits and responses to that same
+    "bss_chat::<project_id>". One QueueReplyReader task per server process
+    takes the rows for every project a client is following, in one DELETE …
+    RETURNING, and publishes them to the event broker; it wakes on the
+    insert trigger's NOTIFY (one LISTEN connection, one channel per project)
+    and falls back to polling.
+
+username / project_name are resolved to the project_id once and cached.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from classes.entities import Project, QueueMessage
+from classes.event_broker import EventBroker
+from classes.queue_notify import QueueNotifyListener
+from classes.queue_priority import queue_priority_for_type
+
+
+logger = logging.getLogger("kahuna_backend")
+
+QUEUE_RECEIVER_ID = os.getenv("QUEUE_RECEIVER_ID")
+# Worker app the server talks to (see ChatApp.key / key_delim in worker_main.py)
+QUEUE_BRIDGE_APP_PREFIX = os.getenv("QUEUE_BRIDGE_APP_PREFIX", "bss_chat::")
+QUEUE_BRIDGE_POLL_SECONDS = float(os.getenv("QUEUE_BRIDGE_POLL_SECONDS", "1.0"))
+# A project nobody polled / streamed for this long is no longer followed
+QUEUE_BRIDGE_IDLE_SECONDS = float(os.getenv("QUEUE_BRIDGE_IDLE_SECONDS", "3600"))
+
+
+class ProjectNotFound(LookupError):
+    pass
+
+
+class ProjectResolver:
+    """
+    (username, project_name) -> project_id, cached (bounded LRU, TTL).
+    username is the user id; project_name is the project's name, or its id.
+    """
+
+    def __init__(
+        self,
+        SessionFactory: Callable[[], Session],
+        ttl_seconds: float = 600.0,
+        max_entries: int = 10000,
+    ):
+        self.SessionFactory = SessionFactory
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+
+    def resolve(self, username: str, project_name: str) -> str:
+        key = (username, project_name)
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] > now:
+                self._items.move_to_end(key)
+                return item[0]
+
+        project_id = self._lookup(username, project_name)
+
+        with self._lock:
+            self._items[key] = (project_id, now + self.ttl_seconds)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return project_id
+
+    def _lookup(self, username: str, project_name: str) -> str:
+        project_id = None
+        if _is_uuid(username):
+            match = Project.name == project_name
+            if _is_uuid(project_name):
+                match = or_(match, Project.project_id == project_name)
+            session = self.SessionFactory()
+            try:
+                project_id = session.execute(
+                    select(Project.project_id)
+                    .where(Project.user_id == username)
+                    .where(match)
+                    .order_by((Project.name == project_name).desc())
+                    .limit(1)
+                ).scalar()
+            finally:
+                session.close()
+        if project_id is None:
+            raise ProjectNotFound(f"Project not found: {username}/{project_name}")
+        return str(project_id)
+
+
+def _is_uuid(value: str) -> bool:
+    try:
+        UUID(str(value))
+        return True
+    except ValueError:
+        return False
+
+
+class QueueReplyReader:
+    """
+    Moves reply rows for followed projects from queue_messages into the broker.
+    Must be started and used from the server's event loop.
+    """
+
+    LISTEN_RETRY_SECONDS = 30.0
+
+    def __init__(
+        self,
+        SessionFactory: Callable[[], Session],
+        engine: Engine,
+        broker: EventBroker,
+        poll_interval: float = QUEUE_BRIDGE_POLL_SECONDS,
+        idle_seconds: float = QUEUE_BRIDGE_IDLE_SECONDS,
+        max_batch: int = 500,
+    ):
+        self.SessionFactory = SessionFactory
+        self.engine = engine
+        self.broker = broker
+        self.poll_interval = poll_interval
+        self.idle_seconds = idle_seconds
+        self.max_batch = max_batch
+        # reply address -> (broker key, last touched)
+        self._followed: Dict[str, Tuple[str, float]] = {}
+        self._listener: Optional[QueueNotifyListener] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._next_listen_attempt = 0.0
+        self.delivered = 0
+
+    def follow(self, address: str, key: str) -> None:
+        is_new = address not in self._followed
+        self._followed[address] = (key, time.monotonic())
+        if is_new:
+            if self._listener is not None:
+                self._listener.add_receiver(address)
+            if self._wakeup is not None:
+                self._wakeup.set()   # replies may already be waiting
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        # no receiver of its own: projects are added by follow()
+        self._listener = QueueNotifyListener(self.engine, None)
+        for address in self._followed:
+            self._listener.add_receiver(address)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._listener is not None:
+            self._listener.stop()
+
+    def _ensure_listener(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._listener.active or not self._listener.supported:
+            return
+        now = time.monotonic()
+        if now < self._next_listen_attempt:
+            return
+        self._next_listen_attempt = now + self.LISTEN_RETRY_SECONDS
+        self._listener.start(loop, self._wakeup.set)
+
+    def _forget_idle(self) -> None:
+        cutoff = time.monotonic() - self.idle_seconds
+        for address in [a for a, (_, touched) in self._followed.items() if touched < cutoff]:
+            del self._followed[address]
+            if self._listener is not None:
+                self._listener.remove_receiver(address)
+
+    def _take(self, addresses: List[str]) -> List[Any]:
+        picked = (
+            select(QueueMessage.id)
+            .where(QueueMessage.receiver_id.in_(addresses))
+            .order_by(QueueMessage.created_at.asc())
+            .limit(self.max_batch)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = (
+            delete(QueueMessage)
+            .where(QueueMessage.id.in_(picked))
+            .returning(
+                QueueMessage.id,
+                QueueMessage.receiver_id,
+                QueueMessage.type,
+                QueueMessage.payload,
+                QueueMessage.created_at,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        session = self.SessionFactory()
+        try:
+            rows = session.execute(stmt).all()
+            session.commit()
+        finally:
+            session.close()
+        return sorted(rows, key=lambda r: (r.created_at, r.id))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                self._ensure_listener(loop)
+                self._forget_idle()
+                addresses = sorted(self._followed)
+                rows = await asyncio.to_thread(self._take, addresses) if addresses else []
+                for row in rows:
+                    key = self._followed.get(row.receiver_id, (None, 0.0))[0]
+                    if key is None:
+                        continue
+                    await self.broker.publish(key, _reply_event(row.type, row.payload))
+                self.delivered += len(rows)
+                if len(rows) >= self.max_batch:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.info("Queue reply read failed: %s", e)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+def _reply_event(msg_type: str, payload: Any) -> Dict[str, Any]:
+    # same shape the response files had: the worker payload plus its type
+    if isinstance(payload, dict):
+        event = dict(payload)
+        event.setdefault("type", msg_type)
+        return event
+    return {"type": msg_type, "data": payload}
+
+
+class QueueBridge:
+    """
+    What server.py needs in queue mode: send() a client event as a job row,
+    follow() a client's project so its replies reach the broker.
+    """
+
+    def __init__(
+        self,
+        SessionFactory: Callable[[], Session],
+        engine: Engine,
+        broker: EventBroker,
+        receiver_id: Optional[str] = QUEUE_RECEIVER_ID,
+        app_prefix: str = QUEUE_BRIDGE_APP_PREFIX,
+    ):
+        if not receiver_id:
+            raise RuntimeError("QUEUE_RECEIVER_ID env var is required for the queue bridge")
+        self.SessionFactory = SessionFactory
+        self.receiver_id = str(receiver_id)
+        self.app_prefix = app_prefix
+        self.projects = ProjectResolver(SessionFactory)
+        self.replies = QueueReplyReader(SessionFactory, engine, broker)
+
+    async def start(self) -> None:
+        self.replies.start()
+
+    async def stop(self) -> None:
+        await self.replies.stop()
+
+    async def follow(self, username: str, project_name: str, key: str) -> str:
+        """
+        Returns the reply address. Raises ProjectNotFound.
+        """
+        project_id = await asyncio.to_thread(self.projects.resolve, username, project_name)
+        address = f"{self.app_prefix}{project_id}"
+        self.replies.follow(address, key)
+        return address
+
+    def _insert(self, address: str, events: List[Tuple[str, Any]]) -> List[str]:
+        """
+        One transaction for all events. created_at steps by a microsecond so
+        the worker sees them in this order.
+        """
+        now = datetime.now(timezone.utc)
+        rows = [
+            QueueMessage(
+                id=str(uuid4()),
+                sender_id=address,
+                receiver_id=self.receiver_id,
+                type=msg_type,
+                payload=payload if payload is not None else {},
+                created_at=now + timedelta(microseconds=i),
+                priority=queue_priority_for_type(msg_type),
+            )
+            for i, (msg_type, payload) in enumerate(events)
+        ]
+        session = self.SessionFactory()
+        try:
+            session.add_all(rows)
+            session.commit()
+            return [row.id for row in rows]
+        finally:
+            session.close()
+
+    async def send(self, username: str, project_name: str, key: str, msg_type: str, payload: Any) -> str:
+        address = await self.follow(username, project_name, key)
+        return (await asyncio.to_thread(self._insert, address, [(msg_type, payload)]))[0]
+
+    async def send_batch(
+        self, username: str, project_name: str, key: str, events: List[Tuple[str, Any]]
+    ) -> List[str]:
+        address = await self.follow(username, project_name, key)
+        return await asyncio.to_thread(self._insert, address, events)
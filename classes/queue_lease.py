@@ -0,0 +1,298 @@
+# classes/queue_lease.py
+
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, func, or_, select, union_all, update
+from sqlalchemy.orm import Session
+
+from classes.entities import QueueMessage
+from classes.queue_priority import PRIORITY_LEVELS, effective_priority_sql
+
+
+QUEUE_LEASE_DDL = [
+    "ALTER TABLE queue_messages ADD COLUMN IF NOT EXISTS leased_by VARCHAR",
+    "ALTER TABLE queue_messages ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ",
+]
+
+
+class QueueLeaseStore:
+    """
+    Lease-based claiming of queue_messages rows for one worker.
+
+    - claim(): one UPDATE ... RETURNING that leases up to `limit` unleased
+      (or lease-expired) rows for receiver_id, highest (aged) priority first,
+      then oldest, skipping rows locked by concurrent claimers.
+      The aged priority is computed, so no index can order by it: each
+      stored level gives its oldest rows off ix_queue_messages_receiver_priority_created
+      and only those are ordered. Within a level aging never reorders rows
+      (older is always as high), so the top `limit` rows are among them.
+    - renew(): pushes lease_expires_at forward for rows we still hold;
+      returns the ids we actually still own.
+    - ack(): bulk-deletes finished rows (only if we still hold the lease).
+    - release(): drops our lease on rows we claimed but never ran.
+
+    A row is only deleted after its job finished, so a crashed worker's rows
+    become claimable again once their lease expires.
+    """
+
+    def __init__(
+        self,
+        SessionFactory: Callable[[], Session],
+        receiver_id: str,
+        worker_id: str,
+        lease_seconds: float = 120.0,
+    ):
+        self.SessionFactory = SessionFactory
+        self.receiver_id = str(receiver_id)
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+
+    def _lease_deadline(self):
+        return func.now() + timedelta(seconds=self.lease_seconds)
+
+    def _claimable(self):
+        return [
+            QueueMessage.receiver_id == self.receiver_id,
+            or_(
+                QueueMessage.lease_expires_at.is_(None),
+                QueueMessage.lease_expires_at < func.now(),
+            ),
+        ]
+
+    def _claim_order(self, table=QueueMessage.__table__):
+        return (
+            effective_priority_sql(table.c.priority, table.c.created_at).desc(),
+            table.c.created_at.asc(),
+        )
+
+    def _candidates(self, conds, limit: int, per_sender: Optional[int] = None):
+        """
+        Ids of up to `limit` rows matching `conds`, in claim order, locked
+        (skipping rows other claimers hold). With per_sender, at most that
+        many per sender_id, ranked in the same order; each level then offers
+        limit * per_sender rows, so a sender with a long backlog still leaves
+        room for the others.
+        """
+        pool = limit * per_sender if per_sender else limit
+        levels = [
+            select(QueueMessage.id, QueueMessage.sender_id, QueueMessage.priority, QueueMessage.created_at)
+            .where(*conds)
+            .where(QueueMessage.priority == level)
+            .order_by(QueueMessage.created_at)
+            .limit(pool)
+            for level in PRIORITY_LEVELS
+        ]
+        pooled = union_all(*levels).subquery()
+
+        if per_sender:
+            pooled = select(
+                pooled.c.id,
+                pooled.c.priority,
+                pooled.c.created_at,
+                func.row_number()
+                .over(partition_by=pooled.c.sender_id, order_by=self._claim_order(pooled))
+                .label("rn"),
+            ).subquery()
+            picked = select(pooled.c.id).where(pooled.c.rn <= per_sender)
+        else:
+            picked = select(pooled.c.id)
+        picked = picked.order_by(*self._claim_order(pooled)).limit(limit)
+
+        # FOR UPDATE cannot go with the window / UNION: lock the picked ids,
+        # re-checking the lease
+        return (
+            select(QueueMessage.id)
+            .where(QueueMessage.id.in_(picked))
+            .where(*self._claimable())
+            .with_for_update(skip_locked=True)
+        )
+
+    def claim(self, limit: int) -> List[Dict[str, Any]]:
+        if limit <= 0:
+            return []
+        return self._lease(self._candidates(self._claimable(), limit))
+
+    def claim_lanes(
+        self,
+        specs: List[Tuple[Optional[Set[str]], Set[str], int]],
+        per_sender: Optional[int] = None,
+        skip_senders: Optional[Set[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Lease rows for several lanes in one statement.
+        specs: [(include_types | None, exclude_types, limit), ...] (see FairScheduler.claim_specs)
+        per_sender: take at most this many rows per sender_id (project) per lane,
+                    so one project's backlog cannot fill a lane.
+        skip_senders: sender_ids not to claim at all (already saturated locally).
+        """
+        ctes = []
+        for i, (include, exclude, limit) in enumerate(specs):
+            if limit <= 0:
+                continue
+            conds = self._claimable()
+            if include is not None:
+                conds.append(QueueMessage.type.in_(sorted(include)))
+            if exclude:
+                conds.append(QueueMessage.type.not_in(sorted(exclude)))
+            if skip_senders:
+                conds.append(QueueMessage.sender_id.not_in(sorted(skip_senders)))
+
+            lane = self._candidates(conds, limit, per_sender)
+            ctes.append(lane.cte(f"lane_{i}"))
+
+        if not ctes:
+            return []
+        candidates = union_all(*[select(c.c.id) for c in ctes])
+        return self._lease(candidates)
+
+    def claim_batch_rest(self, jobs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Lease the not yet claimed rows of every client batch (payload batch_id,
+        see POST /events/batch) that `jobs` only partly hold, so the scheduler
+        gets the whole batch at once whatever the lane limits were.
+        """
+        have: Dict[Tuple[str, str], int] = {}
+        size: Dict[Tuple[str, str], int] = {}
+        for job in jobs:
+            payload = job.get("payload")
+            if not isinstance(payload, dict) or not payload.get("batch_id"):
+                continue
+            key = (str(job["sender_id"]), str(payload["batch_id"]))
+            have[key] = have.get(key, 0) + 1
+            size[key] = int(payload.get("batch_size") or 0)
+        missing = [key for key, n in have.items() if n < size[key]]
+        if not missing:
+            return []
+
+        batch_id = QueueMessage.payload.op("->>")("batch_id")
+        candidates = (
+            select(QueueMessage.id)
+            .where(*self._claimable())
+            .where(or_(*[(QueueMessage.sender_id == sender) & (batch_id == bid) for sender, bid in missing]))
+            .with_for_update(skip_locked=True)
+        )
+        return self._lease(candidates)
+
+    def _lease(self, candidates) -> List[Dict[str, Any]]:
+        stmt = (
+            update(QueueMessage)
+            .where(QueueMessage.id.in_(candidates))
+            .values(leased_by=self.worker_id, lease_expires_at=self._lease_deadline())
+            .returning(
+                QueueMessage.id,
+                QueueMessage.sender_id,
+                QueueMessage.receiver_id,
+                QueueMessage.type,
+                QueueMessage.payload,
+                QueueMessage.priority,
+                QueueMessage.created_at,
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+        session = self.SessionFactory()
+        try:
+            rows = session.execute(stmt).all()
+            session.commit()
+        finally:
+            session.close()
+
+        # RETURNING order is not guaranteed
+        rows = sorted(rows, key=lambda r: r.created_at)
+        return [
+            {
+                "id": r.id,
+                "sender_id": r.sender_id,
+                "receiver_id": r.receiver_id,
+                "type": r.type,
+                "payload": r.payload,
+                "priority": r.priority,
+                "created_at": r.created_at,
+            }
+            for r in rows
+        ]
+
+    def backlog_stats(self) -> Dict[int, Dict[str, Any]]:
+        """
+        Unclaimed rows for receiver_id per priority: {priority: {"count", "oldest_age_s"}}.
+        The age of the oldest waiting row is what the latency SLO is checked against.
+        """
+        stmt = (
+            select(
+                QueueMessage.priority,
+                func.count(),
+                func.extract("epoch", func.now() - func.min(QueueMessage.created_at)),
+            )
+            .where(*self._claimable())
+            .group_by(QueueMessage.priority)
+        )
+        session = self.SessionFactory()
+        try:
+            rows = session.execute(stmt).all()
+        finally:
+            session.close()
+        return {
+            int(priority): {"count": int(count), "oldest_age_s": round(float(age or 0.0), 1)}
+            for priority, count, age in rows
+        }
+
+    def renew(self, ids: Iterable[str]) -> set[str]:
+        ids = list(ids)
+        if not ids:
+            return set()
+
+        stmt = (
+            update(QueueMessage)
+            .where(QueueMessage.id.in_(ids))
+            .where(QueueMessage.leased_by == self.worker_id)
+            .values(lease_expires_at=self._lease_deadline())
+            .returning(QueueMessage.id)
+            .execution_options(synchronize_session=False)
+        )
+        session = self.SessionFactory()
+        try:
+            owned = {r.id for r in session.execute(stmt).all()}
+            session.commit()
+        finally:
+            session.close()
+        return owned
+
+    def ack(self, ids: Iterable[str]) -> int:
+        ids = list(ids)
+        if not ids:
+            return 0
+
+        stmt = (
+            delete(QueueMessage)
+            .where(QueueMessage.id.in_(ids))
+            .where(QueueMessage.leased_by == self.worker_id)
+            .execution_options(synchronize_session=False)
+        )
+        session = self.SessionFactory()
+        try:
+            deleted = session.execute(stmt).rowcount
+            session.commit()
+        finally:
+            session.close()
+        return deleted
+
+    def release(self, ids: Iterable[str]) -> int:
+        ids = list(ids)
+        if not ids:
+            return 0
+
+        stmt = (
+            update(QueueMessage)
+            .where(QueueMessage.id.in_(ids))
+            .where(QueueMessage.leased_by == self.worker_id)
+            .values(leased_by=None, lease_expires_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        session = self.SessionFactory()
+        try:
+            released = session.execute(stmt).rowcount
+            session.commit()
+        finally:
+            session.close()
+        return released
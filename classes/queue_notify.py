@@ -0,0 +1,182 @@
+# classes/queue_notify.py
+
+import asyncio
+import hashlib
+import logging
+from typing import Callable, Optional
+
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger("kahuna_worker")
+
+# Postgres channel names are identifiers (max 63 bytes), while receiver_id is an
+# arbitrary string, so both the trigger and the listener address the channel by
+# a hash of the receiver_id.
+QUEUE_NOTIFY_CHANNEL_PREFIX = "qm_"
+
+QUEUE_NOTIFY_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION queue_messages_notify() RETURNS trigger AS $$
+    BEGIN
+        -- rows moved between partitions (queue_schema) were announced already
+        IF current_setting('queue.skip_notify', true) = 'on' THEN
+            RETURN NEW;
+        END IF;
+        PERFORM pg_notify('qm_' || md5(NEW.receiver_id), NEW.id);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS queue_messages_notify_trg ON queue_messages",
+    """
+    CREATE TRIGGER queue_messages_notify_trg
+        AFTER INSERT ON queue_messages
+        FOR EACH ROW EXECUTE FUNCTION queue_messages_notify()
+    """,
+]
+
+
+def queue_notify_channel(receiver_id: str) -> str:
+    """
+    Channel the insert trigger NOTIFYs for rows addressed to receiver_id.
+    Must stay in sync with queue_messages_notify() above.
+    """
+    digest = hashlib.md5(str(receiver_id).encode("utf-8")).hexdigest()
+    return f"{QUEUE_NOTIFY_CHANNEL_PREFIX}{digest}"
+
+
+class QueueNotifyListener:
+    """
+    LISTENs on the receiver's channel over a dedicated connection and calls
+    on_notify() on the event loop whenever rows for that receiver are inserted.
+
+    - Needs a psycopg2 connection (non-blocking poll() + notifies).
+      With any other driver start() returns False and the caller keeps polling.
+    - The connection is detached from the engine pool: it lives as long as the
+      listener and never goes back to the pool in LISTEN state.
+    - If the connection drops, the listener marks itself dead; call start()
+      again to reconnect (AsyncGuard does it on the next cycle).
+    - add_receiver() LISTENs for more receivers on the same connection
+      (server.py follows every connected project this way; it starts with
+      receiver_id=None); remove_receiver() UNLISTENs once one goes idle.
+    """
+
+    def __init__(self, engine: Engine, receiver_id: Optional[str]):
+        self.engine = engine
+        self.receiver_id = receiver_id
+        self.channel = queue_notify_channel(receiver_id) if receiver_id is not None else None
+        self._channels = {self.channel} if self.channel else set()
+        self._raw = None
+        self._conn = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._on_notify: Optional[Callable[[], None]] = None
+        # False once we know the driver cannot LISTEN (no point retrying)
+        self.supported = True
+
+    @property
+    def active(self) -> bool:
+        return self._conn is not None
+
+    def start(self, loop: asyncio.AbstractEventLoop, on_notify: Callable[[], None]) -> bool:
+        if self._conn is not None:
+            return True
+
+        raw = None
+        try:
+            raw = self.engine.raw_connection()
+            raw.detach()
+            conn = getattr(raw, "driver_connection", None) or raw.dbapi_connection
+            if not (hasattr(conn, "poll") and hasattr(conn, "notifies") and hasattr(conn, "fileno")):
+                logger.info("Queue LISTEN/NOTIFY not supported by this DB driver; falling back to polling")
+                self.supported = False
+                raw.close()
+                return False
+
+            conn.autocommit = True
+            cur = conn.cursor()
+            for channel in sorted(self._channels):
+                cur.execute(f'LISTEN "{channel}"')
+            cur.close()
+
+            loop.add_reader(conn.fileno(), self._on_readable)
+        except Exception as e:
+            logger.info("Queue LISTEN setup failed (receiver_id=%s): %s; falling back to polling", self.receiver_id, e)
+            if raw is not None:
+                try:
+                    raw.close()
+                except Exception:
+                    pass
+            return False
+
+        self._raw = raw
+        self._conn = conn
+        self._loop = loop
+        self._on_notify = on_notify
+        logger.info("Queue LISTEN active – receiver_id=%s channel=%s", self.receiver_id, self.channel)
+        return True
+
+    def add_receiver(self, receiver_id: str) -> None:
+        channel = queue_notify_channel(receiver_id)
+        if channel in self._channels:
+            return
+        self._channels.add(channel)
+        if self._conn is None:
+            return   # LISTENed on the next start()
+        try:
+            cur = self._conn.cursor()
+            cur.execute(f'LISTEN "{channel}"')
+            cur.close()
+        except Exception as e:
+            logger.info("Queue LISTEN on %s failed: %s", channel, e)
+            self.stop()
+
+    def remove_receiver(self, receiver_id: str) -> None:
+        channel = queue_notify_channel(receiver_id)
+        if channel == self.channel or channel not in self._channels:
+            return
+        self._channels.discard(channel)
+        if self._conn is None:
+            return
+        try:
+            cur = self._conn.cursor()
+            cur.execute(f'UNLISTEN "{channel}"')
+            cur.close()
+        except Exception as e:
+            logger.info("Queue UNLISTEN on %s failed: %s", channel, e)
+            self.stop()
+
+    def _on_readable(self) -> None:
+        conn = self._conn
+        if conn is None:
+            return
+        try:
+            conn.poll()
+        except Exception as e:
+            logger.info("Queue LISTEN connection lost (receiver_id=%s): %s", self.receiver_id, e)
+            self.stop()
+            # wake the guard so it polls instead of waiting on a dead channel
+            if self._on_notify:
+                self._on_notify()
+            return
+
+        if conn.notifies:
+            conn.notifies.clear()
+            if self._on_notify:
+                self._on_notify()
+
+    def stop(self) -> None:
+        conn = self._conn
+        if conn is None:
+            return
+        self._conn = None
+        try:
+            if self._loop is not None:
+                self._loop.remove_reader(conn.fileno())
+        except Exception:
+            pass
+        try:
+            self._raw.close()
+        except Exception:
+            pass
+        self._raw = None
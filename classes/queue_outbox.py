@@ -0,0 +1,182 @@
+# classes/queue_outbox.py
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import JSON, Text, bindparam, cast, insert
+from sqlalchemy.orm import Session
+
+from classes.entities import QueueMessage
+from classes.queue_priority import queue_priority_for_type
+
+
+logger = logging.getLogger("kahuna_worker")
+
+# Progress notes where only the latest one per (receiver, correlation_id) matters.
+COALESCE_TYPES = {"ingestion_status"}
+
+
+class QueueOutbox:
+    """
+    In-process outbox for queue_messages written by the worker (emits + responses).
+
+    - enqueue() never touches the DB: the row gets its id and created_at right away
+      (so consumers ordering by created_at see emission order) and its payload is
+      serialized immediately (later mutation by the caller cannot leak in).
+    - A single background thread writes pending rows in multi-row INSERTs every
+      flush_interval seconds, or sooner when max_batch rows are waiting.
+      One writer + FIFO list = per-sender ordering is preserved.
+    - A pending COALESCE_TYPES row for the same receiver/type/correlation_id is
+      dropped when a newer one arrives (the newer one keeps its own position).
+    - flush() blocks until everything enqueued before the call is written;
+      AppHost uses it for the final response so a job is acked only after
+      its response is durable.
+    """
+
+    def __init__(
+        self,
+        SessionFactory: Callable[[], Session],
+        flush_interval: float = 0.05,
+        max_batch: int = 500,
+        retry_seconds: float = 1.0,
+    ):
+        self.SessionFactory = SessionFactory
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.retry_seconds = retry_seconds
+
+        self._cond = threading.Condition()
+        # (seq, coalesce key or None, row), FIFO by seq
+        self._pending: List[Tuple[int, Optional[Tuple[str, str, str]], Dict[str, Any]]] = []
+        self._coalesce_keys: Dict[Tuple[str, str, str], int] = {}
+        self._seq = 0            # last enqueued
+        self._written_seq = 0    # every row with seq <= this is written (or coalesced away)
+        self._flush_requested = False
+        self._last_error: Optional[BaseException] = None
+        self._closed = False
+
+        self._stmt = insert(QueueMessage.__table__).values(
+            id=bindparam("id"),
+            sender_id=bindparam("sender_id"),
+            receiver_id=bindparam("receiver_id"),
+            type=bindparam("type"),
+            payload=cast(bindparam("payload", type_=Text), JSON),
+            created_at=bindparam("created_at"),
+            priority=bindparam("priority"),
+        )
+
+        self._thread = threading.Thread(target=self._run, name="queue-outbox", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, sender_id: str, receiver_id: str, msg_type: str, payload: Dict[str, Any]) -> int:
+        row = {
+            "id": str(uuid4()),
+            "sender_id": str(sender_id),
+            "receiver_id": str(receiver_id),
+            "type": msg_type,
+            "payload": json.dumps(payload, default=str),
+            "created_at": datetime.now(timezone.utc),
+            "priority": queue_priority_for_type(msg_type),
+        }
+        correlation_id = (payload or {}).get("correlation_id")
+        key = None
+        if msg_type in COALESCE_TYPES and correlation_id is not None:
+            key = (row["receiver_id"], msg_type, str(correlation_id))
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("QueueOutbox is closed")
+            self._seq += 1
+            seq = self._seq
+
+            if key is not None:
+                superseded = self._coalesce_keys.get(key)
+                if superseded is not None:
+                    self._pending = [p for p in self._pending if p[0] != superseded]
+                self._coalesce_keys[key] = seq
+
+            self._pending.append((seq, key, row))
+            # first pending row starts the flush_interval window; a full batch ends it
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+        return seq
+
+    def flush(self, timeout: Optional[float] = 30.0) -> None:
+        """
+        Wait until every row enqueued so far is in the DB.
+        Raises TimeoutError (with the last write error) if that does not happen in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            target = self._seq
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._written_seq < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"Queue outbox flush timed out: {self._last_error}")
+                self._cond.wait(remaining)
+
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        try:
+            self.flush(timeout)
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            self._thread.join(timeout)
+
+    def _take_batch(self) -> List[Tuple[int, Optional[Tuple[str, str, str]], Dict[str, Any]]]:
+        batch = self._pending[: self.max_batch]
+        self._pending = self._pending[len(batch):]
+        # rows being written can no longer be superseded
+        for seq, key, _ in batch:
+            if key is not None and self._coalesce_keys.get(key) == seq:
+                del self._coalesce_keys[key]
+        return batch
+
+    def _write(self, rows: List[Dict[str, Any]]) -> None:
+        session = self.SessionFactory()
+        try:
+            session.execute(self._stmt, rows)
+            session.commit()
+        finally:
+            session.close()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._pending:
+                    # rows coalesced away count as written
+                    self._written_seq = self._seq
+                    self._cond.notify_all()
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                    continue
+                if len(self._pending) < self.max_batch and not self._flush_requested:
+                    # let a few more emits pile up into the same INSERT
+                    self._cond.wait(self.flush_interval)
+                self._flush_requested = False
+                batch = self._take_batch()
+
+            try:
+                self._write([row for _, _, row in batch])
+            except Exception as e:
+                logger.info("Queue outbox write of %d message(s) failed, retrying: %s", len(batch), e)
+                with self._cond:
+                    self._last_error = e
+                    self._pending = batch + self._pending
+                    self._cond.wait(self.retry_seconds)
+                continue
+
+            with self._cond:
+                self._last_error = None
+                # pending is FIFO by seq: everything up to this batch is done
+                self._written_seq = self._pending[0][0] - 1 if self._pending else self._seq
+                self._cond.notify_all()
@@ -0,0 +1,83 @@
+# classes/queue_priority.py
+"""
+Priority of queue_messages rows.
+
+Whoever inserts a row sets `priority` from the request type
+(queue_priority_for_type); rows inserted without it get PRIORITY_NORMAL.
+Claims serve higher priorities first, but a waiting row gains one level
+every QUEUE_PRIORITY_AGING_SECONDS (up to PRIORITY_INTERACTIVE), so batch
+work is delayed by a burst of interactive requests, never starved by it.
+
+Rows are claimed per stored level (PRIORITY_LEVELS), oldest first, off the
+receiver/priority/created_at index; only those few rows are then ordered by
+aged priority (see QueueLeaseStore).
+"""
+
+import os
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import Integer, cast, extract, func, literal
+
+
+PRIORITY_BATCH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_INTERACTIVE = 2
+# every value the priority column takes (queue_priority_for_type, column default)
+PRIORITY_LEVELS = (PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BATCH)
+
+# A user is waiting on the answer
+INTERACTIVE_TYPES = {
+    "bss_chat",
+    "edit_bss_node",
+    "edit_bss_document",
+    "create_bss_relationship",
+    "remove_bss_relationship",
+    "load_project",
+}
+# Long-running, submitted in bursts
+BATCH_TYPES = {"ingestion"}
+
+QUEUE_PRIORITY_AGING_SECONDS = float(os.getenv("QUEUE_PRIORITY_AGING_SECONDS", "30"))
+
+QUEUE_PRIORITY_DDL = [
+    "ALTER TABLE queue_messages ADD COLUMN IF NOT EXISTS priority SMALLINT NOT NULL DEFAULT 1",
+    "CREATE INDEX IF NOT EXISTS ix_queue_messages_receiver_priority_created "
+    "ON queue_messages (receiver_id, priority DESC, created_at)",
+]
+
+
+def queue_priority_for_type(msg_type: Optional[str]) -> int:
+    if msg_type in INTERACTIVE_TYPES:
+        return PRIORITY_INTERACTIVE
+    if msg_type in BATCH_TYPES:
+        return PRIORITY_BATCH
+    return PRIORITY_NORMAL
+
+
+def effective_priority_sql(priority_col, created_at_col):
+    """
+    priority + one level per QUEUE_PRIORITY_AGING_SECONDS waited, capped at
+    PRIORITY_INTERACTIVE. Ties are broken by created_at by the caller.
+    """
+    if QUEUE_PRIORITY_AGING_SECONDS <= 0:
+        return priority_col
+    aged = priority_col + cast(
+        func.floor(extract("epoch", func.now() - created_at_col) / QUEUE_PRIORITY_AGING_SECONDS),
+        Integer,
+    )
+    return func.least(aged, literal(PRIORITY_INTERACTIVE))
+
+
+def effective_priority(priority: Optional[int], created_at: Optional[datetime], now: Optional[datetime] = None) -> int:
+    """
+    Python twin of effective_priority_sql, for jobs already claimed.
+    """
+    base = PRIORITY_NORMAL if priority is None else int(priority)
+    if QUEUE_PRIORITY_AGING_SECONDS <= 0 or created_at is None:
+        return base
+    now = now or datetime.now(timezone.utc)
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    waited = max(0.0, (now - created_at).total_seconds())
+    return min(base + int(waited // QUEUE_PRIORITY_AGING_SECONDS), max(base, PRIORITY_INTERACTIVE))
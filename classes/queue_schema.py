@@ -0,0 +1,317 @@
+# classes/queue_schema.py
+"""
+Schema management for the queue_messages table.
+
+  - migrate_queue_schema(): idempotent DDL the worker applies at startup
+    (lease columns, priority column, claim indexes, notify trigger).
+  - partition_queue_messages(): one-time conversion of queue_messages into a
+    table RANGE-partitioned by created_at (one partition per UTC day, plus a
+    DEFAULT partition so inserts never fail).
+  - run_queue_partition_maintenance(): the retention job. Creates the next
+    days' partitions and DROPs partitions older than the retention window,
+    instead of DELETEing rows. A partition whose rows are still leased by a
+    worker is kept until the next run; unclaimed rows older than the window
+    go with it (their count is logged). One worker at a time runs it (advisory
+    lock); the others skip that round. The partition is DETACHed first
+    (CONCURRENTLY when there is no DEFAULT partition, otherwise under
+    QUEUE_PARTITION_LOCK_TIMEOUT_MS) so the DROP does not lock queue_messages.
+
+Command line:
+    python -m classes.queue_schema migrate
+    python -m classes.queue_schema partition
+    python -m classes.queue_schema maintain
+"""
+
+import logging
+import os
+import re
+import sys
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from classes.queue_lease import QUEUE_LEASE_DDL
+from classes.queue_notify import QUEUE_NOTIFY_DDL
+from classes.queue_priority import QUEUE_PRIORITY_DDL
+
+
+logger = logging.getLogger("kahuna_worker")
+
+QUEUE_PARTITION_DAYS_AHEAD = int(os.getenv("QUEUE_PARTITION_DAYS_AHEAD", "3"))
+QUEUE_RETENTION_DAYS = int(os.getenv("QUEUE_RETENTION_DAYS", "7"))
+QUEUE_PARTITION_LOCK_TIMEOUT_MS = int(os.getenv("QUEUE_PARTITION_LOCK_TIMEOUT_MS", "2000"))
+
+QUEUE_INDEX_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_queue_messages_receiver_created ON queue_messages (receiver_id, created_at)",
+]
+
+_PARTITION_PREFIX = "queue_messages_"
+_PARTITION_RE = re.compile(r"^queue_messages_(\d{8})$")
+_DEFAULT_PARTITION = "queue_messages_default"
+# one worker at a time runs the partition maintenance
+_MAINTENANCE_LOCK = "queue_messages_partitions"
+
+
+def _partition_name(day: date) -> str:
+    return f"{_PARTITION_PREFIX}{day.strftime('%Y%m%d')}"
+
+
+def _day_bound(day: date) -> str:
+    return f"{day.isoformat()} 00:00:00+00"
+
+
+def _utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def is_queue_partitioned(conn: Connection) -> bool:
+    relkind = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass('queue_messages')")
+    ).scalar()
+    return relkind == "p"
+
+
+def _list_day_partitions(conn: Connection) -> dict[date, str]:
+    rows = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass('queue_messages')"
+        )
+    ).scalars()
+    out: dict[date, str] = {}
+    for name in rows:
+        m = _PARTITION_RE.match(name)
+        if m:
+            out[datetime.strptime(m.group(1), "%Y%m%d").date()] = name
+    return out
+
+
+def _create_day_partition(conn: Connection, day: date) -> bool:
+    """
+    Create the partition for `day` (False if it already exists). Rows that
+    already landed in the DEFAULT partition for that range are moved into it
+    (Postgres refuses to attach a range that the default partition already
+    holds rows for). They were announced when first inserted, so the notify
+    trigger skips them (queue.skip_notify, set for this transaction only).
+    """
+    lo, hi = _day_bound(day), _day_bound(day + timedelta(days=1))
+    name = _partition_name(day)
+    if conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar():
+        return False
+
+    conn.execute(text("CREATE TEMP TABLE _queue_messages_move (LIKE queue_messages) ON COMMIT DROP"))
+    conn.execute(
+        text(
+            "WITH moved AS ("
+            f"  DELETE FROM {_DEFAULT_PARTITION} WHERE created_at >= :lo AND created_at < :hi RETURNING *"
+            ") INSERT INTO _queue_messages_move SELECT * FROM moved"
+        ),
+        {"lo": lo, "hi": hi},
+    )
+    conn.execute(
+        text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF queue_messages FOR VALUES FROM ('{lo}') TO ('{hi}')")
+    )
+    conn.execute(text("SET LOCAL queue.skip_notify = 'on'"))
+    conn.execute(text("INSERT INTO queue_messages SELECT * FROM _queue_messages_move"))
+    conn.execute(text("SET LOCAL queue.skip_notify = 'off'"))
+    conn.execute(text("DROP TABLE _queue_messages_move"))
+    return True
+
+
+def _drop_day_partition(engine: Engine, name: str) -> bool:
+    """
+    Detach and drop an expired partition. Returns False (kept for the next
+    run) while a worker still holds a lease on one of its rows, or when the
+    detach could not get its lock in time.
+    """
+    with engine.begin() as conn:
+        leased = conn.execute(
+            text(f"SELECT count(*) FROM {name} WHERE lease_expires_at > now()")
+        ).scalar()
+        pending = conn.execute(
+            text("SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = to_regclass(:name)"),
+            {"name": name},
+        ).scalar()
+        has_default = conn.execute(
+            text("SELECT to_regclass(:name) IS NOT NULL"), {"name": _DEFAULT_PARTITION}
+        ).scalar()
+    if leased:
+        logger.info("queue_messages partition %s kept: %d row(s) still leased", name, leased)
+        return False
+
+    if pending is not None:
+        try:
+            if pending:
+                # an earlier concurrent detach was interrupted
+                stmt = f"ALTER TABLE queue_messages DETACH PARTITION {name} FINALIZE"
+            elif has_default:
+                # Postgres refuses CONCURRENTLY while a DEFAULT partition exists
+                stmt = f"ALTER TABLE queue_messages DETACH PARTITION {name}"
+            else:
+                stmt = f"ALTER TABLE queue_messages DETACH PARTITION {name} CONCURRENTLY"
+            # CONCURRENTLY cannot run inside a transaction block
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text(f"SET lock_timeout = {QUEUE_PARTITION_LOCK_TIMEOUT_MS}"))
+                conn.execute(text(stmt))
+        except Exception as e:
+            logger.info("queue_messages partition %s not detached: %s", name, e)
+            return False
+
+    with engine.begin() as conn:
+        unclaimed = conn.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+        if unclaimed:
+            logger.warning("queue_messages partition %s dropped with %d unclaimed row(s)", name, unclaimed)
+        conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+    return True
+
+
+def migrate_queue_schema(engine: Engine, with_notify: bool = True) -> None:
+    """
+    Idempotent DDL for queue_messages. Each group runs in its own transaction
+    so a missing privilege on one (e.g. trigger) does not block the others.
+    """
+    groups = [
+        ("lease columns", QUEUE_LEASE_DDL),
+        ("priority column", QUEUE_PRIORITY_DDL),
+        ("indexes", QUEUE_INDEX_DDL),
+    ]
+    if with_notify:
+        groups.append(("notify trigger", QUEUE_NOTIFY_DDL))
+
+    for name, ddl in groups:
+        try:
+            with engine.begin() as conn:
+                for stmt in ddl:
+                    conn.execute(text(stmt))
+        except Exception as e:
+            # may already be in place while we lack DDL rights
+            logger.info("queue_messages %s not applied: %s", name, e)
+
+
+def partition_queue_messages(engine: Engine, days_ahead: int = QUEUE_PARTITION_DAYS_AHEAD) -> bool:
+    """
+    One-time conversion of a plain queue_messages table into a partitioned one.
+    Copies existing rows. Stop the workers first: the table is locked for the
+    duration of the copy. Returns False if it is already partitioned.
+    """
+    with engine.begin() as conn:
+        if is_queue_partitioned(conn):
+            return False
+
+        conn.execute(text("LOCK TABLE queue_messages IN ACCESS EXCLUSIVE MODE"))
+        first = conn.execute(text("SELECT min(created_at) FROM queue_messages")).scalar()
+
+        # the partition key must be part of the primary key
+        conn.execute(
+            text(
+                "CREATE TABLE queue_messages_partitioned "
+                "(LIKE queue_messages INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"
+            )
+        )
+        conn.execute(
+            text(
+                "ALTER TABLE queue_messages_partitioned "
+                "ADD CONSTRAINT queue_messages_partitioned_pkey PRIMARY KEY (id, created_at)"
+            )
+        )
+        conn.execute(
+            text(f"CREATE TABLE {_DEFAULT_PARTITION} PARTITION OF queue_messages_partitioned DEFAULT")
+        )
+
+        today = _utc_today()
+        start = min(first.astimezone(timezone.utc).date(), today) if first else today
+        day = start
+        while day <= today + timedelta(days=days_ahead):
+            lo, hi = _day_bound(day), _day_bound(day + timedelta(days=1))
+            conn.execute(
+                text(
+                    f"CREATE TABLE {_partition_name(day)} PARTITION OF queue_messages_partitioned "
+                    f"FOR VALUES FROM ('{lo}') TO ('{hi}')"
+                )
+            )
+            day += timedelta(days=1)
+
+        conn.execute(text("INSERT INTO queue_messages_partitioned SELECT * FROM queue_messages"))
+        conn.execute(text("DROP TABLE queue_messages"))
+        conn.execute(text("ALTER TABLE queue_messages_partitioned RENAME TO queue_messages"))
+        conn.execute(text("ALTER INDEX queue_messages_partitioned_pkey RENAME TO queue_messages_pkey"))
+
+    # indexes and trigger were dropped with the old table
+    migrate_queue_schema(engine)
+    logger.info("queue_messages partitioned by day starting %s", start.isoformat())
+    return True
+
+
+def run_queue_partition_maintenance(
+    engine: Engine,
+    days_ahead: int = QUEUE_PARTITION_DAYS_AHEAD,
+    retention_days: int = QUEUE_RETENTION_DAYS,
+) -> tuple[int, int]:
+    """
+    Retention job: create missing partitions up to `days_ahead` and drop the
+    ones that ended more than `retention_days` ago.
+    No-op (0, 0) if queue_messages is not partitioned, or while another worker
+    runs it (session advisory lock: the detach cannot run in a transaction).
+    Returns (created, dropped).
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        params = {"key": _MAINTENANCE_LOCK}
+        if not lock_conn.execute(text("SELECT pg_try_advisory_lock(hashtext(:key))"), params).scalar():
+            logger.info("queue_messages partition maintenance is running on another worker")
+            return 0, 0
+        try:
+            return _run_partition_maintenance(engine, days_ahead, retention_days)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(hashtext(:key))"), params)
+
+
+def _run_partition_maintenance(engine: Engine, days_ahead: int, retention_days: int) -> tuple[int, int]:
+    created = dropped = 0
+    today = _utc_today()
+
+    with engine.begin() as conn:
+        if not is_queue_partitioned(conn):
+            return 0, 0
+        existing = _list_day_partitions(conn)
+
+    for offset in range(0, days_ahead + 1):
+        day = today + timedelta(days=offset)
+        if day in existing:
+            continue
+        with engine.begin() as conn:
+            if _create_day_partition(conn, day):
+                created += 1
+
+    cutoff = today - timedelta(days=retention_days)
+    for day, name in sorted(existing.items()):
+        if day + timedelta(days=1) > cutoff:
+            continue
+        if _drop_day_partition(engine, name):
+            dropped += 1
+
+    if created or dropped:
+        logger.info("queue_messages partitions: created %d, dropped %d", created, dropped)
+    return created, dropped
+
+
+def main() -> None:
+    from classes.GCConnection_hlpr import get_db_engine
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    engine = get_db_engine()
+
+    if command == "migrate":
+        migrate_queue_schema(engine)
+    elif command == "partition":
+        if not partition_queue_messages(engine):
+            logger.info("queue_messages is already partitioned")
+    elif command == "maintain":
+        run_queue_partition_maintenance(engine)
+    else:
+        raise SystemExit(f"Unknown command: {command} (expected migrate | partition | maintain)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# classes/static_files.py
+"""
+Serving frontend/dist from server.py.
+
+  - PrecompressedStaticFiles: serves "<file>.br" / "<file>.gz" next to the
+    requested file when the client accepts that encoding (made at build time
+    by compress_dist(), never on the request path) and it is not older than
+    the file.
+    Hashed bundles (assets/index-DX6uWGB_.js) are cached forever
+    ("immutable"); everything else (index.html, images) is revalidated
+    every time with its ETag / Last-Modified (304 when unchanged).
+  - PathGZipMiddleware: gzip for selected API paths only (the JSON event
+    responses carry whole BSS documents); streams and static files are left
+    alone.
+
+Build step, after every `npm run build` (until then the rebuilt files are
+served uncompressed):
+    python -m classes.static_files frontend/dist
+"""
+
+import gzip
+import mimetypes
+import os
+import re
+import sys
+from typing import Iterable, List, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional: gzip variants only
+    brotli = None
+
+
+COMPRESSIBLE_EXTENSIONS = {".js", ".mjs", ".css", ".html", ".svg", ".json", ".map", ".txt", ".xml", ".wasm"}
+COMPRESS_MIN_BYTES = 1024
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Vite output: <name>-<8+ char content hash>.<ext>
+_HASHED_NAME_RE = re.compile(r"-[A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$")
+
+# (suffix, Content-Encoding), in order of preference
+_VARIANTS = ((".br", "br"), (".gz", "gzip"))
+
+
+def _accepted_encodings(headers: Headers) -> set:
+    accepted = set()
+    for part in headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = re.search(r"q\s*=\s*([0-9.]+)", params)
+        try:
+            if q is not None and float(q.group(1)) <= 0:
+                continue   # "br;q=0": explicitly refused
+        except ValueError:
+            pass
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        path = str(full_path)
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        cache_control = (
+            IMMUTABLE_CACHE_CONTROL if _HASHED_NAME_RE.search(os.path.basename(path)) else REVALIDATE_CACHE_CONTROL
+        )
+
+        served_path, served_stat, encoding = path, stat_result, None
+        accepted = _accepted_encodings(request_headers)
+        for suffix, name in _VARIANTS:
+            if name not in accepted:
+                continue
+            try:
+                variant_stat = os.stat(path + suffix)
+            except OSError:
+                continue
+            if variant_stat.st_mtime < stat_result.st_mtime:
+                continue   # stale: the source was rebuilt after it was compressed
+            served_path, served_stat, encoding = path + suffix, variant_stat, name
+            break
+
+        headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        response = FileResponse(
+            served_path,
+            status_code=status_code,
+            stat_result=served_stat,
+            media_type=media_type,
+            headers=headers,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+class PathGZipMiddleware:
+    """
+    GZipMiddleware for the listed paths only.
+    """
+
+    def __init__(self, app: ASGIApp, paths: Iterable[str], minimum_size: int = 1024):
+        self.app = app
+        self.paths = set(paths)
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope.get("path") in self.paths:
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+def compress_dist(directory: str, min_bytes: int = COMPRESS_MIN_BYTES) -> List[Tuple[str, int, Optional[int], int]]:
+    """
+    Write "<file>.gz" (and "<file>.br" when brotli is installed) for every
+    compressible file of `directory`. A variant that is not smaller than the
+    source is not kept. Returns [(path, size, br_size | None, gz_size), ...].
+    """
+    written = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) < min_bytes:
+                continue
+
+            # mtime=0: same input -> byte-identical .gz on every build
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            gz_size = _write_variant(path + ".gz", gz, len(data))
+            br_size = None
+            if brotli is not None:
+                br_size = _write_variant(path + ".br", brotli.compress(data, quality=11), len(data))
+            written.append((path, len(data), br_size, gz_size))
+    return written
+
+
+def _write_variant(path: str, data: bytes, source_size: int) -> Optional[int]:
+    if len(data) >= source_size:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
+
+
+def main() -> None:
+    directory = sys.argv[1] if len(sys.argv) > 1 else "frontend/dist"
+    if brotli is None:
+        print("brotli not installed: writing gzip variants only")
+    for path, size, br_size, gz_size in compress_dist(directory):
+        print(f"{path}: {size} -> br {br_size if br_size is not None else '-'}, gz {gz_size if gz_size is not None else '-'}")
+
+
+if __name__ == "__main__":
+    main()
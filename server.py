@@ -1,13 +1,22 @@
 import os
 import json
+import asyncio
+import logging
 import re
 import time
 import shutil
 from datetime import datetime
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, Any
+from typing import Optional, Any, List
+from uuid import uuid4
+
+from classes.event_broker import ResponseDirIngestor, build_event_broker, event_key
+from classes.static_files import PathGZipMiddleware, PrecompressedStaticFiles
+
+logger = logging.getLogger("kahuna_backend")
 
 app = FastAPI()
 
@@ -19,6 +28,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# JSON event responses only: the SSE stream must not be buffered by gzip, and
+# the frontend files come precompressed (see classes/static_files.py)
+app.add_middleware(PathGZipMiddleware, paths=["/events", "/events/batch"], minimum_size=1024)
 
 EVENTS_REQUEST_DIR = "events/request"
 EVENTS_RESPONSE_DIR = "events/response"
@@ -29,6 +41,58 @@ os.makedirs(EVENTS_REQUEST_DIR, exist_ok=True)
 os.makedirs(EVENTS_RESPONSE_DIR, exist_ok=True)
 os.makedirs(EVENTS_PROCESSED_DIR, exist_ok=True)
 
+# Longest a GET /events?wait= may hold the request open
+EVENTS_LONG_POLL_MAX_SECONDS = float(os.getenv("EVENTS_LONG_POLL_MAX_SECONDS", "25"))
+EVENTS_INGEST_INTERVAL_MS = float(os.getenv("EVENTS_INGEST_INTERVAL_MS", "100"))
+# Keep-alive for idle /events/stream connections (proxies drop silent ones)
+EVENTS_STREAM_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_STREAM_HEARTBEAT_SECONDS", "15"))
+EVENTS_BATCH_MAX = int(os.getenv("EVENTS_BATCH_MAX", "100"))
+
+# Built frontend (vite base "/kahuna-lab/"), served when present
+FRONTEND_DIST_DIR = os.getenv("FRONTEND_DIST_DIR", "frontend/dist")
+FRONTEND_MOUNT_PATH = os.getenv("FRONTEND_MOUNT_PATH", "/kahuna-lab")
+
+# "files": requests go to events/request, responses come back through
+#          events/response (a separate process shuttles them to the worker);
+# "queue": requests are inserted into queue_messages for the worker and its
+#          replies read back from there (see classes/queue_bridge.py).
+EVENTS_TRANSPORT = os.getenv("EVENTS_TRANSPORT", "files").strip().lower()
+
+# Responses reach GET /events and the streams through the broker, fed by one
+# reader per process: the response directory ingestor, or the queue bridge.
+broker = build_event_broker()
+ingestor = None
+bridge = None
+if EVENTS_TRANSPORT == "queue":
+    from classes.GCConnection_hlpr import get_db_engine, get_session_factory
+    from classes.queue_bridge import ProjectNotFound, QueueBridge
+
+    bridge = QueueBridge(get_session_factory(), get_db_engine(), broker)
+elif EVENTS_TRANSPORT == "files":
+    ingestor = ResponseDirIngestor(
+        broker, EVENTS_RESPONSE_DIR, EVENTS_PROCESSED_DIR, interval=EVENTS_INGEST_INTERVAL_MS / 1000.0
+    )
+else:
+    raise RuntimeError(f"Unknown EVENTS_TRANSPORT: {EVENTS_TRANSPORT} (expected files | queue)")
+
+
+@app.on_event("startup")
+async def _start_event_broker():
+    await broker.start()
+    if bridge is not None:
+        await bridge.start()
+    if ingestor is not None:
+        ingestor.start()
+
+
+@app.on_event("shutdown")
+async def _stop_event_broker():
+    if ingestor is not None:
+        await ingestor.stop()
+    if bridge is not None:
+        await bridge.stop()
+    await broker.stop()
+
 class Event(BaseModel):
     type: str
     username: str
@@ -42,8 +106,29 @@ def _sanitize_for_filename(s: str) -> str:
     # letters, digits, _ . - only
     return re.sub(r"[^A-Za-z0-9_.-]", "_", s)
 
+async def _follow(username: str, project_name: str) -> str:
+    """
+    Broker key of the project; in queue mode also makes sure its replies are
+    being read (404 if the project does not exist).
+    """
+    key = event_key(_sanitize_for_filename(username), _sanitize_for_filename(project_name))
+    if bridge is not None:
+        try:
+            await bridge.follow(username, project_name, key)
+        except ProjectNotFound as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    return key
+
 @app.post("/events")
 async def send_event(event: Event):
+    if bridge is not None:
+        key = await _follow(event.username, event.project_name)
+        try:
+            row_id = await bridge.send(event.username, event.project_name, key, event.type, event.payload)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        return {"status": "success", "id": row_id}
+
     try:
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
         filename = f"server_{timestamp}.json"
@@ -56,30 +141,155 @@ async def send_event(event: Event):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/events/batch")
+async def send_event_batch(events: List[Event]):
+    """
+    Several events of ONE project, kept in order. Each payload gets
+    batch_id / batch_seq / batch_size so the worker can run them as one unit.
+    Queue mode persists them in one transaction; files mode writes one Event
+    file per event (what the events/request readers expect), named so they
+    sort in batch order, and removes the ones written if a later one fails.
+    """
+    if not events:
+        raise HTTPException(status_code=400, detail="Empty batch")
+    if len(events) > EVENTS_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Batch too large (max {EVENTS_BATCH_MAX} events)")
+    first = events[0]
+    if any(e.username != first.username or e.project_name != first.project_name for e in events):
+        raise HTTPException(status_code=400, detail="All events of a batch must target the same project")
+    if any(e.payload is not None and not isinstance(e.payload, dict) for e in events):
+        raise HTTPException(status_code=400, detail="Batched event payloads must be JSON objects")
+
+    batch_id = uuid4().hex
+    for seq, event in enumerate(events):
+        event.payload = {**(event.payload or {}), "batch_id": batch_id, "batch_seq": seq, "batch_size": len(events)}
+
+    if bridge is not None:
+        key = await _follow(first.username, first.project_name)
+        try:
+            ids = await bridge.send_batch(
+                first.username, first.project_name, key, [(e.type, e.payload) for e in events]
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        return {"status": "success", "batch_id": batch_id, "ids": ids}
+
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    written = []
+    try:
+        for seq, event in enumerate(events):
+            filename = f"server_{timestamp}_{seq:04d}.json"
+            filepath = os.path.join(EVENTS_REQUEST_DIR, filename)
+            with open(filepath, "w") as f:
+                json.dump(event.dict(), f)
+            written.append(filename)
+
+        return {"status": "success", "batch_id": batch_id, "ids": written}
+    except Exception as e:
+        # not all-or-nothing like the queue: a reader may already have taken some
+        for filename in written:
+            try:
+                os.remove(os.path.join(EVENTS_REQUEST_DIR, filename))
+            except OSError:
+                pass
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/events")
-async def get_events(username: str, project_name: str):
-    events = []
+async def get_events(username: str, project_name: str, wait: float = 0.0):
+    """
+    Pending events for the project. With wait > 0 the request is held open
+    until at least one event arrives or `wait` seconds (capped) pass.
+    """
+    key = await _follow(username, project_name)
     try:
-        safe_user = _sanitize_for_filename(username)
-        safe_project = _sanitize_for_filename(project_name)
-        prefix = f"{safe_user}__{safe_project}__"
-        # Read all response files
-        files = sorted(os.listdir(EVENTS_RESPONSE_DIR))
-        for file in files:
-            if file.startswith(prefix):
-                filepath = os.path.join(EVENTS_RESPONSE_DIR, file)
+        wait = min(max(0.0, wait), EVENTS_LONG_POLL_MAX_SECONDS)
+        return await broker.fetch(key, wait)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/events/stream")
+async def stream_events(request: Request, username: str, project_name: str, last_event_id: Optional[str] = None):
+    """
+    Server-Sent Events: one `id:` + `data:` record per event. EventSource sends
+    the Last-Event-ID header on reconnect; the query parameter is for clients
+    that cannot set headers.
+    """
+    key = await _follow(username, project_name)
+    after = request.headers.get("last-event-id") or last_event_id
+
+    async def _records():
+        yield "retry: 2000\n\n"
+        async for item in broker.stream(key, after, heartbeat=EVENTS_STREAM_HEARTBEAT_SECONDS):
+            if item is None:
+                if await request.is_disconnected():
+                    return
                 try:
-                    with open(filepath, "r") as f:
-                        data = json.load(f)
-                    events.append(data)
-                    os.remove(filepath)
+                    await _follow(username, project_name)   # still connected: keep following
+                except Exception as e:
+                    # the response has started: end the stream, the reconnect gets the status
+                    logger.info("Event stream of %s/%s ended: %s", username, project_name, e)
+                    return
+                yield ": ping\n\n"
+                continue
+            event_id, data = item
+            yield f"id: {event_id}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    return StreamingResponse(
+        _records(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
+@app.websocket("/events/ws")
+async def websocket_events(websocket: WebSocket, username: str, project_name: str, last_event_id: Optional[str] = None):
+    """
+    WebSocket push: each event is sent as {"id": ..., "data": ...}; reconnect
+    with ?last_event_id=<id of the last one received> to resume.
+    """
+    try:
+        key = await _follow(username, project_name)
+    except HTTPException as e:
+        await websocket.close(code=4000 + e.status_code)
+        return
+    await websocket.accept()
+
+    async def _push():
+        async for item in broker.stream(key, last_event_id, heartbeat=EVENTS_STREAM_HEARTBEAT_SECONDS):
+            if item is None:
+                try:
+                    await _follow(username, project_name)
+                except HTTPException as e:
+                    await websocket.close(code=4000 + e.status_code)
+                    return
                 except Exception as e:
-                    print(f"Error reading {file}: {e}")
+                    logger.info("Event socket of %s/%s closed: %s", username, project_name, e)
+                    await websocket.close(code=1011)
+                    return
+            else:
+                event_id, data = item
+                await websocket.send_text(json.dumps({"id": event_id, "data": data}, default=str))
 
-        return events
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    async def _until_closed():
+        # nothing is expected from the client; this only notices the disconnect
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    tasks = [asyncio.create_task(_push()), asyncio.create_task(_until_closed())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, WebSocketDisconnect):
+                pass
+
+
+# Mounted last: the API routes above take precedence
+if os.path.isdir(FRONTEND_DIST_DIR):
+    app.mount(FRONTEND_MOUNT_PATH, PrecompressedStaticFiles(directory=FRONTEND_DIST_DIR, html=True), name="frontend")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,35 @@
+# tests/test_queue_outbox.py
+
+import threading
+import time
+
+from classes.queue_outbox import QueueOutbox
+
+
+class _RecordingSession:
+    def __init__(self, written: list, event: threading.Event):
+        self.written = written
+        self.event = event
+
+    def execute(self, stmt, rows):
+        self.written.extend(rows)
+
+    def commit(self):
+        self.event.set()
+
+    def close(self):
+        pass
+
+
+def test_single_row_is_written_without_flush():
+    written: list = []
+    event = threading.Event()
+    outbox = QueueOutbox(lambda: _RecordingSession(written, event), flush_interval=0.05)
+    try:
+        started = time.monotonic()
+        outbox.enqueue("worker-1", "bss_chat::p", "ingestion_status", {"correlation_id": "job-1"})
+        assert event.wait(1.0), "row not written within flush_interval"
+        assert time.monotonic() - started < 1.0
+        assert [row["type"] for row in written] == ["ingestion_status"]
+    finally:
+        outbox.close()
@@ -39,10 +39,14 @@ How many queues/workers are we administering?
 """
 
 import os
+import time
+import random
+import socket
 import asyncio
 import logging
 import traceback
 from typing import Any, Dict, List, Optional, Tuple, Callable
+from uuid import uuid4
 from sqlalchemy.orm import sessionmaker
 
 from dotenv import load_dotenv
@@ -57,7 +61,27 @@ from classes.backend import (
     _job_ctx_var,
     GLOBAL_BSS_HISTORY_CACHE,
 )
-from classes.GCConnection_hlpr import GCConnection
+from classes.GCConnection_hlpr import (
+    DB_MAX_OVERFLOW,
+    DB_POOL,
+    DB_POOL_SIZE,
+    get_db_engine,
+    get_pool_metrics,
+    get_session_factory,
+)
+from classes.queue_lease import QueueLeaseStore
+from classes.queue_notify import QueueNotifyListener
+from classes.queue_outbox import QueueOutbox
+from classes.queue_priority import queue_priority_for_type
+from classes.fair_scheduler import FairScheduler, default_lanes
+from classes.bss_cache import BSS_SCHEMA_CACHE, migrate_project_version_column
+from classes.bss_nodes import BSS_STORAGE, migrate_bss_node_schema
+from classes.bss_ref_index import migrate_bss_ref_schema
+from classes.bss_ui_view import BSS_REDACTION_CACHE, migrate_ui_view_columns
+from classes.cpu_pool import prewarm_cpu_pool, shutdown_cpu_pool
+from classes.google_helpers import PROJECT_ID, REGION
+from classes.llm_client import LLM_PREWARM_MODELS, get_llm_registry_metrics, prewarm_llm_clients
+from classes.queue_schema import migrate_queue_schema, run_queue_partition_maintenance
 
 
 logging.basicConfig(
@@ -69,6 +93,19 @@ logger = logging.getLogger("kahuna_worker")
 QUEUE_RECEIVER_ID = os.getenv("QUEUE_RECEIVER_ID")
 CURRENCY = os.getenv("CURRENCY")
 CONCURRENT_INSTANCES = int(os.getenv("CONCURRENT_INSTANCES"))
+# LISTEN/NOTIFY wakeup for AsyncGuard (poll_interval becomes the fallback timeout)
+QUEUE_USE_NOTIFY = os.getenv("QUEUE_USE_NOTIFY", "true").strip().lower() in ("1", "true", "yes")
+# Jobs claimed ahead of free slots (default: max_concurrent // 2) and lease length
+QUEUE_PREFETCH = int(os.getenv("QUEUE_PREFETCH")) if os.getenv("QUEUE_PREFETCH") else None
+QUEUE_LEASE_SECONDS = float(os.getenv("QUEUE_LEASE_SECONDS", "120"))
+# How often the guard logs DB pool metrics (0 = never)
+DB_POOL_METRICS_LOG_SECONDS = float(os.getenv("DB_POOL_METRICS_LOG_SECONDS", "300"))
+# Default interval for app sweeps without their own sweep_interval
+MAINTENANCE_SWEEP_SECONDS = float(os.getenv("MAINTENANCE_SWEEP_SECONDS", "60"))
+QUEUE_PARTITION_MAINTENANCE_SECONDS = float(os.getenv("QUEUE_PARTITION_MAINTENANCE_SECONDS", "3600"))
+# Batched, asynchronous writes of emits/responses (QueueOutbox)
+QUEUE_OUTBOX = os.getenv("QUEUE_OUTBOX", "true").strip().lower() in ("1", "true", "yes")
+QUEUE_OUTBOX_FLUSH_MS = float(os.getenv("QUEUE_OUTBOX_FLUSH_MS", "50"))
 
 
 class JobContext:
@@ -101,16 +138,30 @@ class JobContext:
 
 
 class AppHost:
-    def __init__(self, Session, receiver_id: str, apps: List[Any]):
+    def __init__(self, Session, receiver_id: str, apps: List[Any], outbox: Optional[QueueOutbox] = None):
         self.SessionFactory = Session
         self.receiver_id = receiver_id
         self.apps = list(apps or [])
+        # when set, messages are buffered and written in batches off the job thread
+        self.outbox = outbox
 
-    def sweep(self) -> None:
+    def maintenance_tasks(self) -> List["MaintenanceTask"]:
+        """
+        Periodic work declared by the apps:
+          - app.maintenance_tasks() -> [MaintenanceTask, ...], or
+          - app.sweep() every app.sweep_interval seconds (MAINTENANCE_SWEEP_SECONDS by default).
+        """
+        tasks: List[MaintenanceTask] = []
         for app in self.apps:
+            declared = getattr(app, "maintenance_tasks", None)
+            if callable(declared):
+                tasks.extend(declared())
+                continue
             fn = getattr(app, "sweep", None)
             if callable(fn):
-                fn()
+                interval = float(getattr(app, "sweep_interval", MAINTENANCE_SWEEP_SECONDS))
+                tasks.append(MaintenanceTask(f"{getattr(app, 'key', type(app).__name__)}.sweep", fn, interval))
+        return tasks
 
     def _send_queue_message(
         self,
@@ -118,7 +169,19 @@ class AppHost:
         msg_type: str,
         payload: Dict[str, Any],
         from_sender_id: str,
+        wait: bool = False,
     ) -> None:
+        """
+        wait=True: return only once the message (and everything emitted before it)
+        is committed. Used for the final response, which must be durable before
+        the job row is acked.
+        """
+        if self.outbox is not None:
+            self.outbox.enqueue(from_sender_id, to_receiver_id, msg_type, payload)
+            if wait:
+                self.outbox.flush()
+            return
+
         session = self.SessionFactory()
         try:
             session.add(
@@ -127,6 +190,7 @@ class AppHost:
                     receiver_id=str(to_receiver_id),
                     type=msg_type,
                     payload=payload,
+                    priority=queue_priority_for_type(msg_type),
                 )
             )
             session.commit()
@@ -157,30 +221,85 @@ class AppHost:
         _, prefix, app = candidates[0]
         return app, prefix, sender_full[len(prefix):]
 
-    def process_queue_job(self, job: Dict[str, Any]) -> None:
-        sender_full = str(job.get("sender_id") or "")
-        msg_type = job.get("type") or "unknown"
+    def batch_types(self) -> set:
+        """
+        Request types the apps can run as a coalesced batch (app.batch_types).
+        """
+        types: set = set()
+        for app in self.apps:
+            types.update(getattr(app, "batch_types", ()) or ())
+        return types
+
+    def process_queue_batch(self, jobs: List[Dict[str, Any]]) -> None:
+        """
+        Consecutive jobs of one project (same sender_id), handed over together
+        by the scheduler. Apps with handle_batch() run them as one unit; every
+        job still gets its own response (or error response).
+        """
+        if len(jobs) == 1:
+            self.process_queue_job(jobs[0])
+            return
 
-        app, prefix, project_id = self._resolve_app(sender_full)
-        ctx = JobContext(self, job, sender_full, project_id, prefix)
+        sender_full = str(jobs[0].get("sender_id") or "")
+        try:
+            app, prefix, project_id = self._resolve_app(sender_full)
+        except RuntimeError:
+            # each job gets its own error response
+            app, prefix, project_id = None, "", ""
+        handle_batch = getattr(app, "handle_batch", None)
+        if not callable(handle_batch):
+            for job in jobs:
+                self.process_queue_job(job)
+            return
 
+        ctxs = [JobContext(self, job, sender_full, project_id, prefix) for job in jobs]
         try:
-            response_payload = app.handle(job, ctx)
+            results = handle_batch(jobs, ctxs)
+        except Exception as e:
+            logger.info("Error processing batch of %d job(s) for %s: %s", len(jobs), sender_full, e)
+            traceback.print_exc()
+            results = [e] * len(jobs)
+
+        for i, (job, result) in enumerate(zip(jobs, results)):
+            msg_type = job.get("type") or "unknown"
+            if isinstance(result, Exception):
+                logger.info("Error processing job id=%s type=%s: %s", job.get("id"), msg_type, result)
+                result = {"status": "error", "message": str(result), "project_id": project_id}
             self._send_queue_message(
                 to_receiver_id=sender_full,
                 msg_type=f"{msg_type}_response",
-                payload=response_payload,
+                payload=result,
                 from_sender_id=str(job.get("receiver_id")),
+                wait=(i == len(jobs) - 1),
             )
+
+    def process_queue_job(self, job: Dict[str, Any]) -> None:
+        """
+        Runs one job and sends its response (or error response). Raises only
+        when that response could not be written: the job must not be acked then.
+        """
+        sender_full = str(job.get("sender_id") or "")
+        msg_type = job.get("type") or "unknown"
+        project_id = None
+
+        try:
+            app, prefix, project_id = self._resolve_app(sender_full)
+            ctx = JobContext(self, job, sender_full, project_id, prefix)
+            response_payload = app.handle(job, ctx)
         except Exception as e:
             logger.info("Error processing job id=%s type=%s: %s", job.get("id"), msg_type, e)
             traceback.print_exc()
-            self._send_queue_message(
-                to_receiver_id=sender_full,
-                msg_type=f"{msg_type}_response",
-                payload={"status": "error", "message": str(e), "project_id": project_id},
-                from_sender_id=str(job.get("receiver_id")),
-            )
+            response_payload = {"status": "error", "message": str(e), "project_id": project_id}
+
+        # outside the try: a response that was enqueued but not flushed must not
+        # be followed by a second (error) response for the same job
+        self._send_queue_message(
+            to_receiver_id=sender_full,
+            msg_type=f"{msg_type}_response",
+            payload=response_payload,
+            from_sender_id=str(job.get("receiver_id")),
+            wait=True,
+        )
 
 
 class ChatApp:
@@ -193,19 +312,34 @@ class ChatApp:
     """
     key = "bss_chat"
     key_delim = "::"
+    batch_types = Backend.BATCHABLE_REQUEST_TYPES
 
     def __init__(self) -> None:
         # no per-instance Backend, we create one per job
         pass
 
     def sweep(self) -> None:
+        self._sweep_history()
+        self._sweep_idempotency()
+
+    def _sweep_history(self) -> None:
         removed2 = GLOBAL_BSS_HISTORY_CACHE.sweep_expired()
         if removed2:
             logger.debug("BSS HistoryCache sweep: removed %d expired BSS histories", removed2)
+
+    def _sweep_idempotency(self) -> None:
         removed3 = IDEMPOTENCY_CACHE.sweep_charged()
         if removed3:
             logger.debug("IdempotencyCache sweep: removed %d charged keys", removed3)
 
+    def maintenance_tasks(self) -> List["MaintenanceTask"]:
+        # histories live 24h, a few minutes of slack is irrelevant;
+        # the idempotency sweep is a DB query, once a minute is plenty
+        return [
+            MaintenanceTask("bss_chat.history_sweep", self._sweep_history, 300.0),
+            MaintenanceTask("bss_chat.idempotency_sweep", self._sweep_idempotency, MAINTENANCE_SWEEP_SECONDS),
+        ]
+
     def handle(self, job: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
         backend = Backend()
         token = _job_ctx_var.set(ctx)
@@ -217,6 +351,41 @@ class ChatApp:
         finally:
             _job_ctx_var.reset(token)
 
+    def handle_batch(self, jobs: List[Dict[str, Any]], ctxs: List[JobContext]) -> List[Any]:
+        """
+        Consecutive jobs of one project: runs of batch_types go through
+        Backend._process_request_batch (one load / recompute / save each), any
+        other job (e.g. a bss_chat inside a client batch) runs on its own, in order.
+        """
+        backend = Backend()
+        results: List[Any] = []
+        i = 0
+        while i < len(jobs):
+            j = i + 1
+            if jobs[i].get("type") in self.batch_types:
+                while j < len(jobs) and jobs[j].get("type") in self.batch_types:
+                    j += 1
+            results.extend(self._run_jobs(backend, jobs[i:j], ctxs[i:j]))
+            i = j
+        return results
+
+    def _run_jobs(self, backend: Backend, jobs: List[Dict[str, Any]], ctxs: List[JobContext]) -> List[Any]:
+        requests = []
+        for job, ctx in zip(jobs, ctxs):
+            job2 = dict(job)
+            job2["sender_id"] = ctx.project_id
+            requests.append(job2)
+        if len(requests) > 1 or requests[0].get("type") in self.batch_types:
+            # each request runs under its own ctx (its correlation_id on emits)
+            return backend._process_request_batch(requests, ctxs)
+        token = _job_ctx_var.set(ctxs[0])
+        try:
+            return [backend._process_request_data(requests[0])]
+        except Exception as e:
+            return [e]
+        finally:
+            _job_ctx_var.reset(token)
+
 
 class Executor:
     def __init__(self, host: AppHost):
@@ -225,80 +394,382 @@ class Executor:
     def execute(self, job: Dict[str, Any]) -> None:
         self.host.process_queue_job(job)
 
+    def execute_batch(self, jobs: List[Dict[str, Any]]) -> None:
+        self.host.process_queue_batch(jobs)
+
+
+class MaintenanceTask:
+    def __init__(self, name: str, fn: Callable[[], Any], interval: float, jitter: float = 0.1):
+        self.name = name
+        self.fn = fn
+        self.interval = max(1.0, float(interval))
+        self.jitter = jitter        # fraction of interval, spreads runs across workers
+        self.next_run = 0.0
+        self.runs = 0
+        self.failures = 0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self.total_ms = 0.0
+
+    def schedule_next(self, now: float) -> None:
+        spread = self.interval * self.jitter
+        self.next_run = now + self.interval + random.uniform(-spread, spread)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_ms": round(self.last_ms, 2),
+            "max_ms": round(self.max_ms, 2),
+            "avg_ms": round(self.total_ms / self.runs, 2) if self.runs else 0.0,
+        }
+
+
+class MaintenanceScheduler:
+    """
+    Runs periodic maintenance (cache sweeps, partition upkeep, metrics logs)
+    off the event loop: each due task runs on a thread via asyncio.to_thread,
+    one run at a time per task, on its own jittered interval.
+    The first run of each task is spread over its first interval.
+    """
+
+    SLOW_TASK_MS = 1000.0
+
+    def __init__(self, tasks: Optional[List[MaintenanceTask]] = None):
+        self.tasks: List[MaintenanceTask] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        for task in tasks or []:
+            self.add(task)
+
+    def add(self, task: MaintenanceTask) -> None:
+        task.next_run = time.monotonic() + random.uniform(0.0, task.interval * max(task.jitter, 0.1))
+        self.tasks.append(task)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        return {t.name: t.metrics() for t in self.tasks}
+
+    async def _run_task(self, task: MaintenanceTask) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(task.fn)
+        except Exception as e:
+            task.failures += 1
+            logger.info("Maintenance task %s failed: %s", task.name, e)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000.0
+            task.runs += 1
+            task.last_ms = elapsed
+            task.max_ms = max(task.max_ms, elapsed)
+            task.total_ms += elapsed
+            if elapsed > self.SLOW_TASK_MS:
+                logger.info("Maintenance task %s took %.0f ms", task.name, elapsed)
+            task.schedule_next(time.monotonic())
+            self._running.pop(task.name, None)
+
+    async def run(self) -> None:
+        if not self.tasks:
+            return
+        try:
+            while True:
+                now = time.monotonic()
+                for task in self.tasks:
+                    if task.name not in self._running and now >= task.next_run:
+                        self._running[task.name] = asyncio.create_task(self._run_task(task))
+                pending = [t.next_run for t in self.tasks if t.name not in self._running]
+                delay = min(pending) - time.monotonic() if pending else 1.0
+                await asyncio.sleep(min(max(delay, 0.05), 5.0))
+        finally:
+            for running in list(self._running.values()):
+                running.cancel()
+
 
 class AsyncGuard:
+    """
+    Claims queue rows for receiver_id and runs them on threads.
+
+    Wakeup model:
+      - with use_notify, an insert trigger NOTIFYs the receiver's channel and the
+        guard waits on it; poll_interval is only the fallback timeout
+        (missed notifications, dropped LISTEN connection).
+      - a finished job also wakes the guard (a slot became free).
+      - if the last claim filled the buffer, the guard claims again
+        straight away instead of waiting.
+
+    Lease model (see QueueLeaseStore):
+      - rows are leased, not deleted, when claimed; up to max_concurrent + prefetch
+        jobs are held locally, so a freed slot refills from memory at once.
+      - finished jobs are acked (deleted) in bulk on the next loop iteration, only
+        once their responses are written; otherwise the lease lapses and the
+        job is redelivered.
+      - leases of buffered and running jobs are renewed every lease_seconds / 3;
+        buffered jobs whose lease was lost are dropped (another worker owns them).
+
+    Fair share (see FairScheduler):
+      - buffered jobs sit in per-type lanes (chat, ingestion, edits), each with
+        its own concurrency cap; free slots go to lanes by weighted round-robin,
+        so a long ingestion cannot hold every slot while chat turns wait.
+      - each project has an ordered mailbox and runs one batch at a time, so two
+        jobs never load-mutate-save the same bss_schema concurrently.
+      - consecutive cheap edits of a project (AppHost.batch_types) are taken as
+        one batch: one load, one recompute, one save, one slot. A client batch
+        (POST /events/batch) is claimed whole and run as one batch too.
+      - max_concurrent stays the global cap across all lanes; jobs waiting
+        behind their project's mailbox head do not count against the claim budget.
+
+    Priority (see classes/queue_priority.py):
+      - rows carry a priority set from their type by the sender; each lane's
+        claim and each lane's dispatch take the highest aged priority first, so
+        a burst of batch rows cannot push interactive ones back, and a batch
+        row that waited long enough is served like an interactive one.
+
+    Cache sweeps and other periodic work run on the MaintenanceScheduler, as a
+    separate task next to the claim loop.
+    """
+
+    LISTEN_RETRY_SECONDS = 30.0
+
     def __init__(
         self,
         host: AppHost,
         receiver_id: str,
         poll_interval: float = 1.0,
         max_concurrent: int = 4,
+        use_notify: bool = True,
+        prefetch: Optional[int] = None,
+        lease_seconds: float = 120.0,
+        scheduler: Optional[MaintenanceScheduler] = None,
+        lanes: Optional[FairScheduler] = None,
     ):
         self.host = host
         self.receiver_id = receiver_id
         self.poll_interval = poll_interval
         self.max_concurrent = max_concurrent
+        self.prefetch = max(1, max_concurrent // 2) if prefetch is None else max(0, prefetch)
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
         self._in_flight = set()
-        self.SessionFactory = GCConnection().build_db_session_factory()
+        self.lanes = lanes if lanes is not None else FairScheduler(
+            default_lanes(max_concurrent), coalesce_types=host.batch_types()
+        )
+        self._slots_used = 0   # running batches (a coalesced batch takes one slot)
+        self._acks: List[str] = []
+        self._next_renew = 0.0
+        # app sweeps etc. run here, never inline in the claim loop
+        self.scheduler = scheduler if scheduler is not None else MaintenanceScheduler(host.maintenance_tasks())
+        # same pooled engine as the AppHost and every Backend in this process
+        self.SessionFactory = get_session_factory()
+        self._engine = get_db_engine()
+        self._leases = QueueLeaseStore(self.SessionFactory, receiver_id, self.worker_id, lease_seconds)
+        self._listener = QueueNotifyListener(self._engine, receiver_id) if use_notify else None
+        self._next_listen_attempt = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _ensure_listener(self) -> None:
+        if self._listener is None or self._listener.active:
+            return
+        now = time.monotonic()
+        if now < self._next_listen_attempt:
+            return
+        self._next_listen_attempt = now + self.LISTEN_RETRY_SECONDS
+        if not self._listener.start(asyncio.get_running_loop(), self._wake) and not self._listener.supported:
+            self._listener = None
+
+    def _install_schema(self) -> None:
+        migrate_queue_schema(self._engine, with_notify=self._listener is not None)
+        try:
+            migrate_project_version_column(self._engine)
+        except Exception as e:
+            logger.info("project.version column not applied: %s", e)
+        if BSS_STORAGE == "nodes":
+            try:
+                migrate_bss_node_schema(self._engine)
+            except Exception as e:
+                # may already be in place while we lack DDL rights
+                logger.info("bss_node table not applied: %s", e)
+        try:
+            migrate_ui_view_columns(self._engine)
+        except Exception as e:
+            logger.info("BSS UI view columns not applied: %s", e)
+        try:
+            migrate_bss_ref_schema(self._engine)
+        except Exception as e:
+            logger.info("bss_ref table not applied: %s", e)
+
+    async def _wait_for_work(self) -> None:
+        """
+        Sleep until a NOTIFY arrives, a slot frees up, or poll_interval elapses.
+        """
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
 
-    async def _run_executor_for_message(self, job: Dict[str, Any]) -> None:
+    async def _run_executor_for_message(self, batch: List[Dict[str, Any]]) -> None:
         executor = Executor(self.host)
+        delivered = False
         try:
-            await asyncio.to_thread(executor.execute, job)
+            await asyncio.to_thread(executor.execute_batch, batch)
+            delivered = True
+        except Exception as e:
+            # the responses are not durable (outbox flush timed out, DB down):
+            # no ack, no renewal; the lease runs out and the job is redelivered
+            logger.info(
+                "Responses for %d job(s) not written, leaving them to lease expiry: %s", len(batch), e
+            )
         finally:
-            self._in_flight.discard(job["id"])
+            self._slots_used -= 1
+            self.lanes.finish(batch)
+            for job in batch:
+                self._in_flight.discard(job["id"])
+                if delivered:
+                    self._acks.append(job["id"])
+            # refill the freed slot from the prefetch buffer right away
+            self._dispatch_buffered()
+            self._wake()
+
+    def _dispatch_buffered(self) -> None:
+        while self._slots_used < self.max_concurrent:
+            batch = self.lanes.next_job()
+            if batch is None:
+                break
+            self._slots_used += 1
+            self._in_flight.update(job["id"] for job in batch)
+            asyncio.create_task(self._run_executor_for_message(batch))
+
+    def _flush_acks(self) -> None:
+        if not self._acks:
+            return
+        ids, self._acks = self._acks, []
+        try:
+            self._leases.ack(ids)
+        except Exception as e:
+            logger.info("Queue ack failed for %d job(s), will retry: %s", len(ids), e)
+            self._acks.extend(ids)
+
+    def _renew_leases_if_due(self) -> None:
+        now = time.monotonic()
+        if now < self._next_renew:
+            return
+        self._next_renew = now + self.lease_seconds / 3.0
+
+        held = set(self._in_flight) | self.lanes.buffered_ids()
+        if not held:
+            return
+        try:
+            owned = self._leases.renew(held)
+        except Exception as e:
+            logger.info("Queue lease renewal failed: %s", e)
+            return
 
-    async def run(self) -> None:
-        logger.info("AsyncGuard running – receiver_id=%s (max_concurrent=%d)", self.receiver_id, self.max_concurrent)
+        lost = held - owned
+        if lost:
+            logger.info("Lost lease on %d job(s); dropping the buffered ones", len(lost))
+            self.lanes.drop(lost)
 
-        while True:
-            self.host.sweep() # ! cleaning up the cache
+    def lane_metrics(self, timeout: float = 5.0) -> Dict[str, Any]:
+        """
+        lanes.metrics() for callers on other threads (the metrics task): the
+        lanes are only changed on the event loop, so the snapshot is taken there.
+        """
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return self.lanes.metrics()
 
-            available_slots = self.max_concurrent - len(self._in_flight)
-            if available_slots <= 0:
-                await asyncio.sleep(self.poll_interval)
-                continue
+        async def _snapshot() -> Dict[str, Any]:
+            return self.lanes.metrics()
 
-            session = self.SessionFactory()
-            try:
-                rows = (
-                    session.query(QueueMessage)
-                    .filter(QueueMessage.receiver_id == str(self.receiver_id))
-                    .order_by(QueueMessage.created_at.asc())
-                    .with_for_update(skip_locked=True)
-                    .limit(available_slots)
-                    .all()
-                )
+        return asyncio.run_coroutine_threadsafe(_snapshot(), loop).result(timeout)
 
-                jobs = [
-                    {
-                        "id": r.id,
-                        "sender_id": r.sender_id,
-                        "receiver_id": r.receiver_id,
-                        "type": r.type,
-                        "payload": r.payload,
-                    }
-                    for r in rows
-                ]
-
-                for r in rows:
-                    session.delete(r)
-
-                session.commit()
-            finally:
-                session.close()
-
-            if not jobs:
-                await asyncio.sleep(self.poll_interval)
-                continue
+    def backlog_stats(self) -> Dict[int, Dict[str, Any]]:
+        try:
+            return self._leases.backlog_stats()
+        except Exception as e:
+            logger.info("Queue backlog stats failed: %s", e)
+            return {}
 
-            for job in jobs:
-                if job["id"] in self._in_flight:
+    def _claim_specs(self, wanted: int):
+        """
+        Per-lane claim limits, scaled down so the total stays close to the global
+        max_concurrent + prefetch. Every lane keeps at least one row, otherwise
+        an idle lane with a big cap would starve the ones after it.
+        """
+        if wanted <= 0:
+            return []
+        specs = self.lanes.claim_specs(self.prefetch)
+        total = sum(limit for _, _, limit in specs)
+        if total <= wanted:
+            return specs
+        return [(include, exclude, max(1, limit * wanted // total)) for include, exclude, limit in specs]
+
+    async def run(self) -> None:
+        logger.info(
+            "AsyncGuard running – receiver_id=%s worker_id=%s (max_concurrent=%d, prefetch=%d, notify=%s)",
+            self.receiver_id, self.worker_id, self.max_concurrent, self.prefetch, self._listener is not None,
+        )
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._install_schema()
+        maintenance = asyncio.create_task(self.scheduler.run())
+
+        try:
+            while True:
+                self._ensure_listener()
+                self._flush_acks()
+                self._renew_leases_if_due()
+                self._dispatch_buffered()
+
+                wanted = self.max_concurrent + self.prefetch - self._slots_used - self.lanes.ready_count()
+                specs = self._claim_specs(wanted)
+                if not specs:
+                    await self._wait_for_work()
                     continue
-                self._in_flight.add(job["id"])
-                asyncio.create_task(self._run_executor_for_message(job))
 
-            await asyncio.sleep(self.poll_interval)
+                jobs = self._leases.claim_lanes(
+                    specs,
+                    per_sender=self.lanes.project_prefetch,
+                    skip_senders=self.lanes.saturated_projects(),
+                )
+                if jobs:
+                    # client batches (POST /events/batch) are scheduled whole
+                    jobs = sorted(jobs + self._leases.claim_batch_rest(jobs), key=lambda j: j["created_at"])
+                for job in jobs:
+                    # our own job whose lease lapsed while it was still running
+                    if job["id"] not in self._in_flight:
+                        self.lanes.add(job)
+                self._dispatch_buffered()
+
+                if len(jobs) >= sum(limit for _, _, limit in specs):
+                    # the claim filled the buffer: more rows are probably waiting
+                    continue
+
+                await self._wait_for_work()
+        finally:
+            maintenance.cancel()
+            # give back what we claimed but never started
+            try:
+                self._flush_acks()
+                self._leases.release(self.lanes.buffered_ids())
+            except Exception as e:
+                logger.info("Could not release buffered queue leases: %s", e)
+
+
+def _log_runtime_metrics(scheduler: MaintenanceScheduler, guard: "AsyncGuard") -> Callable[[], None]:
+    def _log() -> None:
+        for url, metrics in get_pool_metrics().items():
+            logger.info("DB pool %s: %s", url, metrics)
+        logger.info("Maintenance tasks: %s", scheduler.metrics())
+        logger.info("Queue lanes: %s", guard.lane_metrics())
+        logger.info("Queue backlog by priority: %s", guard.backlog_stats())
+        logger.info("LLM clients: %s", get_llm_registry_metrics())
+        logger.info("BSS schema cache: %s", BSS_SCHEMA_CACHE.metrics())
+        logger.info("BSS redaction cache: %s", BSS_REDACTION_CACHE.metrics())
+    return _log
 
 
 def main() -> None:
@@ -313,13 +784,53 @@ def main() -> None:
     apps = [
         ChatApp(),
     ]
-    host = AppHost(GCConnection().build_db_session_factory(), receiver_id=QUEUE_RECEIVER_ID, apps=apps)
+    if DB_POOL != "null" and DB_POOL_SIZE + DB_MAX_OVERFLOW < CONCURRENT_INSTANCES + 2:
+        logger.warning(
+            "DB pool (size=%d, overflow=%d) is smaller than CONCURRENT_INSTANCES=%d + guard; jobs will wait for connections",
+            DB_POOL_SIZE, DB_MAX_OVERFLOW, CONCURRENT_INSTANCES,
+        )
+    outbox = QueueOutbox(get_session_factory(), flush_interval=QUEUE_OUTBOX_FLUSH_MS / 1000.0) if QUEUE_OUTBOX else None
+    host = AppHost(get_session_factory(), receiver_id=QUEUE_RECEIVER_ID, apps=apps, outbox=outbox)
+    engine = get_db_engine()
+    scheduler = MaintenanceScheduler(host.maintenance_tasks())
+    scheduler.add(
+        MaintenanceTask(
+            "queue.partitions",
+            lambda: run_queue_partition_maintenance(engine),
+            QUEUE_PARTITION_MAINTENANCE_SECONDS,
+        )
+    )
     guard = AsyncGuard(
         host=host,
         receiver_id=QUEUE_RECEIVER_ID,
         max_concurrent=CONCURRENT_INSTANCES,  # set your desired cap here
+        use_notify=QUEUE_USE_NOTIFY,
+        prefetch=QUEUE_PREFETCH,
+        lease_seconds=QUEUE_LEASE_SECONDS,
+        scheduler=scheduler,
     )
-    asyncio.run(guard.run())
+    if DB_POOL_METRICS_LOG_SECONDS > 0:
+        scheduler.add(
+            MaintenanceTask("worker.metrics", _log_runtime_metrics(scheduler, guard), DB_POOL_METRICS_LOG_SECONDS)
+        )
+    if LLM_PREWARM_MODELS:
+        warmed = prewarm_llm_clients(
+            LLM_PREWARM_MODELS,
+            vertex_project=PROJECT_ID,
+            vertex_region=REGION,
+            timeout=backend.llm_timeout,
+        )
+        logger.info("LLM clients prewarmed for %d/%d model(s)", warmed, len(LLM_PREWARM_MODELS))
+    try:
+        prewarm_cpu_pool()
+    except Exception as e:
+        logger.warning("BSS CPU pool unavailable, CPU work stays in-thread: %s", e)
+    try:
+        asyncio.run(guard.run())
+    finally:
+        if outbox is not None:
+            outbox.close()
+        shutdown_cpu_pool()
 
 
 if __name__ == "__main__":